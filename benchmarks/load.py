@@ -0,0 +1,431 @@
+"""
+Simulates many concurrent editors against a server, to size a deployment:
+
+```bash
+python benchmarks/load.py --clients 1000 --rooms 100 --rate 2 --duration 30
+python benchmarks/load.py --port 8000 --server-pid 1234  # against a server on localhost
+```
+
+Clients are spread over rooms, and make random edits to a `Text`, a `Map` and an `Array`
+at a given rate. With the WebSocket wire, clients run in several processes so that the
+client side doesn't become the bottleneck. The report includes the propagation latency
+of the edits, the time it takes for the rooms to converge once the edits stop, and the
+CPU and memory usage of the server over time.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import AbstractAsyncContextManager, AsyncExitStack
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Any
+
+from anyio import create_task_group, run, sleep, to_thread
+from pycrdt import Array, Map, MapEvent, Text
+from wire_memory import AsyncMemoryClient, AsyncMemoryServer
+from wire_websocket import AsyncWebSocketClient, AsyncWebSocketServer
+
+from wiredb import AsyncClientMixin
+
+# the maximum number of latency samples kept by a process
+MAX_SAMPLE_NB = 100_000
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--wire", default="websocket", choices=["websocket", "memory"])
+    parser.add_argument("--clients", type=int, default=100, help="number of clients")
+    parser.add_argument("--rooms", type=int, default=10, help="number of rooms")
+    parser.add_argument(
+        "--rate", type=float, default=1, help="edits per second of each client"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10, help="time (in seconds) of the edits"
+    )
+    parser.add_argument(
+        "--types",
+        default="text,map,array",
+        help="comma-separated shared types to edit, among text, map and array",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=max((os.cpu_count() or 1) - 1, 1),
+        help="number of client processes (WebSocket wire only)",
+    )
+    parser.add_argument(
+        "--host", default="127.0.0.1", help="host of the server to connect to"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        help="port of a running server to connect to (default: start a server)",
+    )
+    parser.add_argument(
+        "--server-pid", type=int, help="PID of the running server, to monitor it"
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=10,
+        help="maximum time (in seconds) to wait for the rooms to converge",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--backend", default="asyncio", choices=["asyncio", "trio"])
+    parser.add_argument("--output", type=Path, help="JSON file to save the report to")
+    return parser.parse_args()
+
+
+class Editor:
+    def __init__(self, id: int, client: AsyncClientMixin, types: list[str]) -> None:
+        """
+        A simulated user, who edits the shared document of a client and records
+        the propagation latency of the edits of the other users.
+
+        Args:
+            id: The editor ID.
+            client: The client of the editor.
+            types: The shared types to edit.
+        """
+        self.id = id
+        self.doc = client.doc
+        self.types = types
+        self.edit_nb = 0
+        self.latencies: list[float] = []
+        self.last_edit = 0.0
+        self.last_change = 0.0
+        self._random = random.Random(id)
+        self._text = self.doc.get("text", type=Text)
+        self._map = self.doc.get("map", type=Map)
+        self._array = self.doc.get("array", type=Array)
+        # the time of the last edit of each editor
+        self._stamps = self.doc.get("stamps", type=Map)
+        self._stamps.observe(self._record_latencies)
+        self.doc.observe(self._record_change)
+
+    def _record_latencies(self, event: MapEvent) -> None:
+        now = time.time()
+        for key, change in event.keys.items():  # type: ignore[attr-defined]
+            if key != str(self.id) and "newValue" in change:
+                if len(self.latencies) < MAX_SAMPLE_NB:
+                    self.latencies.append(now - change["newValue"])
+
+    def _record_change(self, event) -> None:
+        self.last_change = time.time()
+
+    def edit(self) -> None:
+        with self.doc.transaction():
+            type = self._random.choice(self.types)
+            if type == "text":
+                length = len(self._text)
+                if length > 0 and self._random.random() < 0.2:
+                    index = self._random.randrange(length)
+                    end = min(index + self._random.randint(1, 5), length)
+                    del self._text[index:end]
+                else:
+                    index = self._random.randint(0, length)
+                    self._text.insert(index, self._random.choice(WORDS))
+            elif type == "map":
+                key = f"key{self._random.randrange(100)}"
+                self._map[key] = self._random.random()
+            else:
+                length = len(self._array)
+                if length > 0 and self._random.random() < 0.3:
+                    del self._array[self._random.randrange(length)]
+                else:
+                    self._array.append(self._random.randrange(1000))
+            self.last_edit = time.time()
+            self._stamps[str(self.id)] = self.last_edit
+        self.edit_nb += 1
+
+    def get_digest(self) -> str:
+        data = [str(self._text), self._map.to_py(), self._array.to_py()]
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    async def run(self, rate: float, stop_time: float) -> None:
+        while True:
+            # edits arrive as a Poisson process
+            await sleep(self._random.expovariate(rate))
+            if time.time() >= stop_time:
+                return
+            self.edit()
+
+
+WORDS = ["lorem ", "ipsum ", "dolor ", "sit ", "amet ", "\n"]
+
+
+async def simulate(
+    args: argparse.Namespace,
+    editor_ids: list[int],
+    connect: Callable[[int], AbstractAsyncContextManager[AsyncClientMixin]],
+    wait_start: Callable[[], Awaitable[float]],
+) -> dict[str, Any]:
+    async with AsyncExitStack() as exit_stack:
+        editors = []
+        types = args.types.split(",")
+        for id in editor_ids:
+            client = await exit_stack.enter_async_context(connect(id))
+            await client.synchronized.wait()
+            editors.append(Editor(id, client, types))
+        start_time = await wait_start()
+        await sleep(max(start_time - time.time(), 0))
+        stop_time = start_time + args.duration
+        async with create_task_group() as tg:
+            for editor in editors:
+                tg.start_soon(editor.run, args.rate, stop_time)
+        # wait for the updates to stop arriving
+        while time.time() < stop_time + args.settle:
+            await sleep(0.5)
+            if time.time() - max(editor.last_change for editor in editors) > 1:
+                break
+        digests: dict[str, list[str]] = {}
+        for editor in editors:
+            room = str(editor.id % args.rooms)
+            digests.setdefault(room, []).append(editor.get_digest())
+        return {
+            "last_edit": max(editor.last_edit for editor in editors),
+            "last_change": max(editor.last_change for editor in editors),
+            "edit_nb": sum(editor.edit_nb for editor in editors),
+            "latencies": [
+                latency for editor in editors for latency in editor.latencies
+            ][:MAX_SAMPLE_NB],
+            "digests": digests,
+        }
+
+
+def connect_websocket(
+    args: argparse.Namespace, port: int, id: int
+) -> AsyncWebSocketClient:
+    return AsyncWebSocketClient(
+        f"room{id % args.rooms}", host=f"http://{args.host}", port=port
+    )
+
+
+def _run_worker(
+    args: argparse.Namespace,
+    editor_ids: list[int],
+    port: int,
+    connection: Connection,
+) -> None:
+    async def wait_start() -> float:
+        connection.send("ready")
+        return await to_thread.run_sync(connection.recv)
+
+    async def main() -> None:
+        result = await simulate(
+            args,
+            editor_ids,
+            lambda id: connect_websocket(args, port, id),
+            wait_start,
+        )
+        connection.send(result)
+
+    run(main, backend=args.backend)
+
+
+class ProcessMonitor:
+    def __init__(self, pid: int) -> None:
+        """
+        Samples the CPU and memory usage of a process, using the `/proc` filesystem.
+
+        Args:
+            pid: The PID of the process.
+        """
+        self._pid = pid
+        self._clock_ticks = os.sysconf("SC_CLK_TCK")
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+        self.samples: list[dict[str, float]] = []
+
+    @property
+    def available(self) -> bool:
+        return Path(f"/proc/{self._pid}/stat").exists()
+
+    def _read(self) -> tuple[float, float]:
+        stat = Path(f"/proc/{self._pid}/stat").read_text()
+        # the command name can contain spaces, but is in parentheses
+        fields = stat.rsplit(")", 1)[1].split()
+        cpu_time = (int(fields[11]) + int(fields[12])) / self._clock_ticks
+        rss_pages = int(Path(f"/proc/{self._pid}/statm").read_text().split()[1])
+        return cpu_time, rss_pages * self._page_size
+
+    async def run(self, start_time: float, interval: float = 1) -> None:
+        last_time = time.time()
+        last_cpu_time, _ = self._read()
+        while True:
+            await sleep(interval)
+            now = time.time()
+            cpu_time, rss = self._read()
+            self.samples.append(
+                {
+                    "time": now - start_time,
+                    "cpu": (cpu_time - last_cpu_time) / (now - last_time) * 100,
+                    "rss": rss,
+                }
+            )
+            last_time, last_cpu_time = now, cpu_time
+
+
+def percentile(values: list[float], percent: float) -> float:
+    return sorted(values)[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+def make_report(
+    args: argparse.Namespace,
+    results: list[dict[str, Any]],
+    monitor: ProcessMonitor | None,
+) -> dict[str, Any]:
+    latencies = [latency for result in results for latency in result["latencies"]]
+    last_edit = max(result["last_edit"] for result in results)
+    last_change = max(result["last_change"] for result in results)
+    digests: dict[str, set[str]] = {}
+    for result in results:
+        for room, room_digests in result["digests"].items():
+            digests.setdefault(room, set()).update(room_digests)
+    report: dict[str, Any] = {
+        "clients": args.clients,
+        "rooms": args.rooms,
+        "edits": sum(result["edit_nb"] for result in results),
+        "converged": all(len(room_digests) == 1 for room_digests in digests.values()),
+        # the time it takes for the last edit to reach all the clients
+        "convergence_time": max(last_change - last_edit, 0),
+    }
+    if latencies:
+        report["latency"] = {
+            "p50": percentile(latencies, 50),
+            "p99": percentile(latencies, 99),
+            "mean": statistics.mean(latencies),
+            "max": max(latencies),
+        }
+    if monitor is not None:
+        report["server"] = monitor.samples
+    return report
+
+
+def print_report(report: dict[str, Any]) -> None:
+    print(f"{report['clients']} clients in {report['rooms']} rooms")
+    print(f"{report['edits']} edits")
+    print(f"converged: {'yes' if report['converged'] else 'NO'}")
+    print(f"convergence time: {report['convergence_time'] * 1000:.1f}ms")
+    if "latency" in report:
+        latency = report["latency"]
+        print(
+            "propagation latency: "
+            f"p50={latency['p50'] * 1000:.1f}ms p99={latency['p99'] * 1000:.1f}ms "
+            f"max={latency['max'] * 1000:.1f}ms"
+        )
+    if report.get("server"):
+        print("server:")
+        for sample in report["server"]:
+            print(
+                f"  {sample['time']:6.1f}s cpu={sample['cpu']:5.1f}% "
+                f"rss={sample['rss'] / 2**20:.1f}MiB"
+            )
+
+
+async def run_load(args: argparse.Namespace) -> dict[str, Any]:
+    async with AsyncExitStack() as exit_stack:
+        port = args.port
+        server_pid = args.server_pid
+        server: AsyncMemoryServer | AsyncWebSocketServer | None = None
+        if args.wire == "memory":
+            server = await exit_stack.enter_async_context(AsyncMemoryServer())
+            server_pid = os.getpid()
+        elif port is None:
+            server = await exit_stack.enter_async_context(
+                AsyncWebSocketServer(host=args.host, port=0)
+            )
+            port = server.port
+            server_pid = os.getpid()
+        monitor = None
+        if server_pid is not None:
+            monitor = ProcessMonitor(server_pid)
+            if not monitor.available:
+                print("the server can't be monitored", file=sys.stderr)
+                monitor = None
+
+        start_time = time.time()
+        async with create_task_group() as tg:
+            if args.wire == "memory":
+                # clients share the process of the server
+                memory_server = server
+                assert isinstance(memory_server, AsyncMemoryServer)
+
+                async def wait_start() -> float:
+                    if monitor is not None:
+                        tg.start_soon(monitor.run, start_time)
+                    return time.time()
+
+                results = [
+                    await simulate(
+                        args,
+                        list(range(args.clients)),
+                        lambda id: AsyncMemoryClient(
+                            f"room{id % args.rooms}", server=memory_server
+                        ),
+                        wait_start,
+                    )
+                ]
+            else:
+                results = await run_workers(args, port, tg, monitor, start_time)
+            tg.cancel_scope.cancel()
+    return make_report(args, results, monitor)
+
+
+async def run_workers(
+    args: argparse.Namespace,
+    port: int,
+    tg,
+    monitor: ProcessMonitor | None,
+    start_time: float,
+) -> list[dict[str, Any]]:
+    context = get_context("spawn")
+    process_nb = min(args.processes, args.clients)
+    connections = []
+    processes = []
+    for i in range(process_nb):
+        connection, worker_connection = context.Pipe()
+        editor_ids = list(range(i, args.clients, process_nb))
+        process = context.Process(
+            target=_run_worker,
+            args=(args, editor_ids, port, worker_connection),
+            daemon=True,
+        )
+        process.start()
+        connections.append(connection)
+        processes.append(process)
+    try:
+        for connection in connections:
+            assert await to_thread.run_sync(connection.recv) == "ready"
+        if monitor is not None:
+            tg.start_soon(monitor.run, start_time)
+        # all the workers start at the same time
+        edit_start_time = time.time() + 0.5
+        for connection in connections:
+            connection.send(edit_start_time)
+        return [await to_thread.run_sync(connection.recv) for connection in connections]
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+def main() -> None:
+    args = parse_args()
+    random.seed(args.seed)
+    report = run(run_load, args, backend=args.backend)
+    print_report(report)
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
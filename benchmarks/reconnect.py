@@ -0,0 +1,74 @@
+"""
+Measures the connection throughput of a server when many clients reconnect at the same time,
+for instance after a restart, while rooms take some time to start (e.g. to load a file):
+
+```bash
+python benchmarks/reconnect.py --clients 1000 --rooms 100 --room-startup 0.01
+```
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+from anyio import Event, create_task_group, run, sleep
+from wire_memory import AsyncMemoryClient, AsyncMemoryServer
+
+from wiredb import Room
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=1000, help="number of clients")
+    parser.add_argument("--rooms", type=int, default=100, help="number of rooms")
+    parser.add_argument(
+        "--room-startup",
+        type=float,
+        default=0.01,
+        help="time (in seconds) it takes for a room to start",
+    )
+    parser.add_argument("--backend", default="asyncio", choices=["asyncio", "trio"])
+    return parser.parse_args()
+
+
+async def reconnect(client_nb: int, room_nb: int, room_startup: float) -> float:
+    class SlowRoom(Room):
+        async def run(self, *args, **kwargs) -> None:
+            await sleep(room_startup)
+            await super().run(*args, **kwargs)
+
+    connected_nb = 0
+    connected = Event()
+    stop = Event()
+
+    async def connect_client(server: AsyncMemoryServer, id: str) -> None:
+        nonlocal connected_nb
+        async with AsyncMemoryClient(id=id, server=server):
+            connected_nb += 1
+            if connected_nb == client_nb:
+                connected.set()
+            await stop.wait()
+
+    async with AsyncMemoryServer(room_factory=SlowRoom) as server:
+        async with create_task_group() as tg:
+            start = time.monotonic()
+            for i in range(client_nb):
+                tg.start_soon(connect_client, server, f"room{i % room_nb}")
+            await connected.wait()
+            duration = time.monotonic() - start
+            stop.set()
+    return duration
+
+
+def main() -> None:
+    args = parse_args()
+    duration = run(
+        reconnect, args.clients, args.rooms, args.room_startup, backend=args.backend
+    )
+    print(f"{args.clients} clients connected to {args.rooms} rooms in {duration:.3f}s")
+    print(f"{args.clients / duration:.0f} connections/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+"""
+Runs the benchmark suite, which measures the update latency and throughput of every wire
+(and of the file wire when each batch of writes is synced to disk), the fan-out of a room
+to many clients, the cost of the handshake against the document size, and the load time
+of the file wire against the length of its log, compacted or not:
+
+```bash
+python benchmarks/suite.py --output results.json
+python benchmarks/suite.py --baseline results.json  # flags the regressions
+```
+
+A result is a regression if it is worse than the baseline by more than the tolerance,
+in which case the command exits with a non-zero status.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from time import perf_counter
+
+from anyio import Event, fail_after, run, sleep
+from pycrdt import Doc, Text, write_message
+from wire_file import AsyncFileClient
+from wire_file.client import FsyncPolicy, apply_updates, create_file, read_updates
+from wire_memory import AsyncMemoryClient, AsyncMemoryServer
+from wire_pipe import AsyncPipeClient, AsyncPipeServer
+from wire_websocket import AsyncWebSocketClient, AsyncWebSocketServer
+
+from wiredb import AsyncClientMixin
+
+WIRES = ["memory", "pipe", "websocket"]
+BACKENDS = ["asyncio", "trio"]
+TIMEOUT = 300
+
+
+class Sizes:
+    def __init__(self, quick: bool) -> None:
+        self.repeat_nb = 20 if quick else 100
+        self.update_nb = 100 if quick else 1000
+        self.client_nbs = [1, 10, 100] if quick else [1, 10, 100, 1000]
+        self.doc_sizes = [1_000, 10_000] if quick else [1_000, 10_000, 100_000]
+        self.log_lengths = [100, 1_000] if quick else [100, 1_000, 10_000]
+
+
+# a result is a name, a value and a unit, where a value in a unit per second is better
+# when it is higher, and a value in seconds is better when it is lower
+Result = tuple[str, float, str]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--backend",
+        action="append",
+        choices=BACKENDS,
+        help="backend to run the benchmarks on (default: all)",
+    )
+    parser.add_argument(
+        "--only", default="", help="only run the benchmarks whose name contains this"
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="use smaller sizes, for a quick check"
+    )
+    parser.add_argument("--output", type=Path, help="JSON file to save the results to")
+    parser.add_argument(
+        "--baseline", type=Path, help="JSON file of results to compare with"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="relative degradation above which a result is a regression",
+    )
+    return parser.parse_args()
+
+
+@asynccontextmanager
+async def connect_clients(
+    wire: str, client_nb: int
+) -> AsyncIterator[list[AsyncClientMixin]]:
+    async with AsyncExitStack() as exit_stack:
+        clients: list[AsyncClientMixin] = []
+        if wire == "memory":
+            memory_server = await exit_stack.enter_async_context(AsyncMemoryServer())
+            for i in range(client_nb):
+                clients.append(
+                    await exit_stack.enter_async_context(
+                        AsyncMemoryClient(server=memory_server)
+                    )
+                )
+        elif wire == "pipe":
+            pipe_server = await exit_stack.enter_async_context(AsyncPipeServer())
+            for i in range(client_nb):
+                connection = await pipe_server.connect("")
+                clients.append(
+                    await exit_stack.enter_async_context(
+                        AsyncPipeClient(connection=connection)
+                    )
+                )
+        else:
+            websocket_server = await exit_stack.enter_async_context(
+                AsyncWebSocketServer(host="127.0.0.1", port=0)
+            )
+            for i in range(client_nb):
+                clients.append(
+                    await exit_stack.enter_async_context(
+                        AsyncWebSocketClient(
+                            host="http://127.0.0.1", port=websocket_server.port
+                        )
+                    )
+                )
+        for client in clients:
+            await client.synchronized.wait()
+        yield clients
+
+
+async def measure_latency(doc0: Doc, doc1: Doc, repeat_nb: int) -> float:
+    text0 = doc0.get("text", type=Text)
+    text1 = doc1.get("text", type=Text)
+    latencies = []
+    for i in range(repeat_nb):
+        received = Event()
+        subscription = text1.observe(lambda event: received.set())
+        start_time = perf_counter()
+        text0 += "."
+        await received.wait()
+        latencies.append(perf_counter() - start_time)
+        text1.unobserve(subscription)
+    return statistics.median(latencies)
+
+
+async def measure_throughput(doc0: Doc, doc1: Doc, update_nb: int) -> float:
+    text0 = doc0.get("text", type=Text)
+    text1 = doc1.get("text", type=Text)
+    length = len(text1) + update_nb
+    received = Event()
+
+    def check_length(event) -> None:
+        if len(text1) == length:
+            received.set()
+
+    subscription = text1.observe(check_length)
+    start_time = perf_counter()
+    for i in range(update_nb):
+        text0 += "."
+        await sleep(0)
+    await received.wait()
+    duration = perf_counter() - start_time
+    text1.unobserve(subscription)
+    return update_nb / duration
+
+
+async def bench_wire(wire: str, sizes: Sizes) -> list[Result]:
+    async with connect_clients(wire, 2) as (client0, client1):
+        latency = await measure_latency(client0.doc, client1.doc, sizes.repeat_nb)
+        throughput = await measure_throughput(client0.doc, client1.doc, sizes.update_nb)
+    return [
+        (f"{wire}.latency", latency, "s"),
+        (f"{wire}.throughput", throughput, "updates/s"),
+    ]
+
+
+async def bench_file(sizes: Sizes, fsync_policy: FsyncPolicy = "never") -> list[Result]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "updates.y"
+        async with AsyncFileClient(path=path, fsync_policy=fsync_policy) as client:
+            await client.synchronized.wait()
+            text = client.doc.get("text", type=Text)
+
+            async def wait_written() -> None:
+                # the pending updates are merged before being written, so the file
+                # is reloaded when it changes, until it holds the whole document
+                size = None
+                while True:
+                    await sleep(0)
+                    new_size = path.stat().st_size
+                    if new_size != size:
+                        size = new_size
+                        if read_text(path, client.version) == str(text):
+                            return
+
+            latencies = []
+            for i in range(sizes.repeat_nb):
+                start_time = perf_counter()
+                text += "."
+                await wait_written()
+                latencies.append(perf_counter() - start_time)
+
+            start_time = perf_counter()
+            for i in range(sizes.update_nb):
+                text += "."
+                await sleep(0)
+            await wait_written()
+            throughput = sizes.update_nb / (perf_counter() - start_time)
+    name = "file" if fsync_policy == "never" else f"file.fsync={fsync_policy}"
+    return [
+        (f"{name}.latency", statistics.median(latencies), "s"),
+        (f"{name}.throughput", throughput, "updates/s"),
+    ]
+
+
+def read_text(path: Path, version: str) -> str | None:
+    data = path.read_bytes()
+    try:
+        snapshot, updates = read_updates(version, data[len(version) + 1 :])
+    except Exception:
+        # the file is being written
+        return None
+    doc: Doc = Doc()
+    apply_updates(doc, snapshot, updates)
+    return str(doc.get("text", type=Text))
+
+
+async def bench_fanout(sizes: Sizes) -> list[Result]:
+    results = []
+    for client_nb in sizes.client_nbs:
+        async with connect_clients("memory", client_nb + 1) as clients:
+            writer, *readers = clients
+            text = writer.doc.get("text", type=Text)
+            latencies = []
+            for i in range(max(sizes.repeat_nb // 10, 3)):
+                received = Event()
+                remaining = [len(readers)]
+
+                def count(event) -> None:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        received.set()
+
+                subscriptions = [
+                    (reader_text, reader_text.observe(count))
+                    for reader_text in (
+                        reader.doc.get("text", type=Text) for reader in readers
+                    )
+                ]
+                start_time = perf_counter()
+                text += "."
+                await received.wait()
+                latencies.append(perf_counter() - start_time)
+                for reader_text, subscription in subscriptions:
+                    reader_text.unobserve(subscription)
+        results.append(
+            (f"fanout.clients={client_nb}", statistics.median(latencies), "s")
+        )
+    return results
+
+
+async def bench_handshake(sizes: Sizes) -> list[Result]:
+    results = []
+    for doc_size in sizes.doc_sizes:
+        async with AsyncMemoryServer() as server:
+            room = await server.room_manager.get_room("")
+            room_text = room.doc.get("text", type=Text)
+            for i in range(doc_size // 100):
+                # many small updates, as if made by a client
+                room_text += "." * 100
+            durations = []
+            for i in range(max(sizes.repeat_nb // 10, 3)):
+                start_time = perf_counter()
+                async with AsyncMemoryClient(server=server) as client:
+                    await client.synchronized.wait()
+                    durations.append(perf_counter() - start_time)
+        results.append(
+            (f"handshake.doc_size={doc_size}", statistics.median(durations), "s")
+        )
+    return results
+
+
+async def bench_file_load(sizes: Sizes) -> list[Result]:
+    results = []
+    for log_length in sizes.log_lengths:
+        updates = []
+        doc: Doc = Doc()
+        doc.observe(lambda event: updates.append(event.update))
+        text = doc.get("text", type=Text)
+        for i in range(log_length):
+            text += "."
+        version = AsyncFileClient(path="").version
+        files = {
+            # a log of all the updates
+            "file_load": create_file(version)
+            + b"".join(write_message(update) for update in updates),
+            # a compacted file, with the snapshot of the document
+            "file_load.snapshot": create_file(version, doc.get_update()),
+        }
+        for name, data in files.items():
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = Path(tmp_dir) / "updates.y"
+                path.write_bytes(data)
+                durations = []
+                for i in range(3):
+                    start_time = perf_counter()
+                    async with AsyncFileClient(path=path) as client:
+                        await client.synchronized.wait()
+                        durations.append(perf_counter() - start_time)
+            results.append(
+                (f"{name}.log_length={log_length}", statistics.median(durations), "s")
+            )
+    return results
+
+
+def get_benchmarks(sizes: Sizes) -> dict[str, Callable[[], Awaitable[list[Result]]]]:
+    benchmarks: dict[str, Callable[[], Awaitable[list[Result]]]] = {
+        wire: lambda wire=wire: bench_wire(wire, sizes)  # type: ignore[misc]
+        for wire in WIRES
+    }
+    benchmarks["file"] = lambda: bench_file(sizes)
+    benchmarks["file_fsync"] = lambda: bench_file(sizes, "batch")
+    benchmarks["fanout"] = lambda: bench_fanout(sizes)
+    benchmarks["handshake"] = lambda: bench_handshake(sizes)
+    benchmarks["file_load"] = lambda: bench_file_load(sizes)
+    return benchmarks
+
+
+async def run_benchmarks(
+    benchmarks: dict[str, Callable[[], Awaitable[list[Result]]]], only: str
+) -> list[Result]:
+    results = []
+    for name, benchmark in benchmarks.items():
+        if only not in name:
+            continue
+        with fail_after(TIMEOUT):
+            results.extend(await benchmark())
+    return results
+
+
+def compare(
+    results: dict[str, dict[str, float | str]],
+    baseline: dict[str, dict[str, float | str]],
+    tolerance: float,
+) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        value = float(result["value"])
+        base_value = float(baseline[name]["value"])
+        if str(result["unit"]).endswith("/s"):
+            ratio = base_value / value if value else float("inf")
+        else:
+            ratio = value / base_value if base_value else float("inf")
+        if ratio > 1 + tolerance:
+            regressions.append(
+                f"{name}: {format_value(value, result['unit'])} "
+                f"(baseline: {format_value(base_value, result['unit'])}, "
+                f"{(ratio - 1) * 100:.0f}% worse)"
+            )
+    return regressions
+
+
+def format_value(value: float, unit: float | str) -> str:
+    if unit == "s":
+        return f"{value * 1000:.3f}ms"
+    return f"{value:.0f}{unit}"
+
+
+def main() -> None:
+    args = parse_args()
+    sizes = Sizes(args.quick)
+    results: dict[str, dict[str, float | str]] = {}
+    for backend in args.backend or BACKENDS:
+        benchmarks = get_benchmarks(sizes)
+        for name, value, unit in run(
+            run_benchmarks, benchmarks, args.only, backend=backend
+        ):
+            results[f"{backend}/{name}"] = {"value": value, "unit": unit}
+            print(f"{backend}/{name}: {format_value(value, unit)}")
+
+    if args.output is not None:
+        data = {
+            "meta": {
+                "date": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "quick": args.quick,
+            },
+            "results": results,
+        }
+        args.output.write_text(json.dumps(data, indent=2))
+
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s):")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regression.")
+
+
+if __name__ == "__main__":
+    main()
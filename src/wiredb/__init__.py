@@ -1,3 +1,4 @@
+from .buffer import MessageBuffer as MessageBuffer
 from .channel import AsyncChannel as AsyncChannel
 from .channel import Channel as Channel
 from .client import AsyncClient as AsyncClient
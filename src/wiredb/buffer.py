@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+from collections import deque
+from types import TracebackType
+from typing import Literal
+
+from anyio import BrokenResourceError, EndOfStream, Event, WouldBlock
+from pycrdt import (
+    YMessageType,
+    YSyncMessageType,
+    create_update_message,
+    merge_updates,
+    read_message,
+)
+
+OverflowPolicy = Literal["block", "drop", "collapse"]
+
+
+class MessageBuffer:
+    def __init__(
+        self,
+        max_size: int | None = None,
+        max_bytes: int | None = None,
+        overflow_policy: OverflowPolicy = "block",
+    ) -> None:
+        """
+        A buffer of messages between a sender and a receiver, which is bounded both
+        in number of messages and in bytes. A message bigger than `max_bytes`
+        is accepted only if the buffer is empty.
+
+        When the sender closes the buffer, the receiver gets the remaining messages
+        and then `EndOfStream`. When the receiver closes the buffer, the sender gets
+        `BrokenResourceError`.
+
+        Args:
+            max_size: The maximum number of messages in the buffer, or `None` for no limit.
+            max_bytes: The maximum number of bytes in the buffer, or `None` for no limit.
+            overflow_policy: What to do when a message doesn't fit in the buffer:
+                `"block"` waits until the receiver makes room for it, `"drop"` closes
+                the buffer, discarding its messages, and raises `BrokenResourceError`,
+                and `"collapse"` merges the queued updates into a single update,
+                and then blocks if the message still doesn't fit.
+        """
+        self._max_size = max_size
+        self._max_bytes = max_bytes
+        self._overflow_policy = overflow_policy
+        self._messages: deque[bytes] = deque()
+        self._byte_nb = 0
+        self._closed = False
+        self._sent = Event()
+        self._received = Event()
+
+    @property
+    def max_size(self) -> int | None:
+        """
+        Returns:
+            The maximum number of messages in the buffer.
+        """
+        return self._max_size
+
+    @property
+    def max_bytes(self) -> int | None:
+        """
+        Returns:
+            The maximum number of bytes in the buffer.
+        """
+        return self._max_bytes
+
+    @property
+    def overflow_policy(self) -> OverflowPolicy:
+        """
+        Returns:
+            The overflow policy of the buffer.
+        """
+        return self._overflow_policy
+
+    @property
+    def size(self) -> int:
+        """
+        Returns:
+            The number of messages in the buffer.
+        """
+        return len(self._messages)
+
+    @property
+    def byte_size(self) -> int:
+        """
+        Returns:
+            The number of bytes in the buffer.
+        """
+        return self._byte_nb
+
+    @property
+    def closed(self) -> bool:
+        """
+        Returns:
+            Whether the buffer is closed.
+        """
+        return self._closed
+
+    async def __aenter__(self) -> MessageBuffer:
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_val: BaseException | None,
+        exc_tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Closes the buffer.
+        """
+        self._closed = True
+        self._sent.set()
+        self._received.set()
+
+    async def send(self, message: bytes) -> None:
+        """
+        Sends a message, applying the overflow policy if it doesn't fit in the buffer.
+
+        Args:
+            message: The message to send.
+
+        Raises:
+            BrokenResourceError: The buffer is closed.
+        """
+        while True:
+            if self._closed:
+                raise BrokenResourceError()
+            if self._fits(message):
+                break
+            if self._overflow_policy == "drop":
+                self._messages.clear()
+                self._byte_nb = 0
+                self.close()
+                raise BrokenResourceError()
+            if self._overflow_policy == "collapse" and self._collapse():
+                continue
+            if self._received.is_set():
+                self._received = Event()
+            await self._received.wait()
+        self._messages.append(message)
+        self._byte_nb += len(message)
+        self._sent.set()
+
+    async def receive(self) -> bytes:
+        """
+        Receives a message, waiting for one to be sent if the buffer is empty.
+
+        Returns:
+            The received message.
+
+        Raises:
+            EndOfStream: The buffer is closed and empty.
+        """
+        while True:
+            try:
+                return self.receive_nowait()
+            except WouldBlock:
+                if self._sent.is_set():
+                    self._sent = Event()
+                await self._sent.wait()
+
+    def receive_nowait(self) -> bytes:
+        """
+        Receives a message without waiting.
+
+        Returns:
+            The received message.
+
+        Raises:
+            WouldBlock: The buffer is empty.
+            EndOfStream: The buffer is closed and empty.
+        """
+        if not self._messages:
+            if self._closed:
+                raise EndOfStream()
+            raise WouldBlock()
+        message = self._messages.popleft()
+        self._byte_nb -= len(message)
+        self._received.set()
+        return message
+
+    def _fits(self, message: bytes) -> bool:
+        if not self._messages:
+            return True
+        if self._max_size is not None and len(self._messages) >= self._max_size:
+            return False
+        if (
+            self._max_bytes is not None
+            and self._byte_nb + len(message) > self._max_bytes
+        ):
+            return False
+        return True
+
+    def _collapse(self) -> bool:
+        indices = [
+            index
+            for index, message in enumerate(self._messages)
+            if message[0] == YMessageType.SYNC
+            and message[1] == YSyncMessageType.SYNC_UPDATE
+        ]
+        if len(indices) < 2:
+            return False
+        updates = [read_message(self._messages[index][2:]) for index in indices]
+        message = create_update_message(merge_updates(*updates))
+        # the merged update takes the place of the last one, so that the updates
+        # are not applied before the messages that preceded them
+        messages = list(self._messages)
+        messages[indices[-1]] = message
+        for index in reversed(indices[:-1]):
+            del messages[index]
+        self._messages = deque(messages)
+        self._byte_nb = sum(len(message) for message in self._messages)
+        return True
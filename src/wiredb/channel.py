@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
 
+from anyio import WouldBlock
+
 
 class Channel(ABC):
     """A transport-agnostic stream used to synchronize a document.
@@ -62,6 +64,9 @@ class AsyncChannel(ABC):
     ```py
     message = await channel.receive()
     ```
+    A channel can also implement `receive_nowait()`, which returns a message
+    only if one is already available, so that clients can apply the received
+    updates in batches.
     Sending messages is done with `send()`:
     ```py
     await channel.send(message)
@@ -97,3 +102,15 @@ class AsyncChannel(ABC):
             The received message.
         """
         ...  # pragma: nocover
+
+    def receive_nowait(self) -> bytes:
+        """Receives a message without waiting. Channels that don't implement it
+        never have a message available this way.
+
+        Returns:
+            The received message.
+
+        Raises:
+            WouldBlock: No message is available.
+        """
+        raise WouldBlock()
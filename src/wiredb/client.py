@@ -3,21 +3,38 @@ from __future__ import annotations
 import sys
 from contextlib import AsyncExitStack
 from types import TracebackType
-
-from anyio import Event, create_task_group
+from typing import Any
+
+from anyio import (
+    EndOfStream,
+    Event,
+    WouldBlock,
+    create_task_group,
+    current_time,
+    move_on_after,
+    sleep,
+)
 from anyio.abc import TaskStatus
+from anyio.streams.memory import MemoryObjectReceiveStream
 from pycrdt import (
+    Awareness,
     Doc,
     Subscription,
     TransactionEvent,
     YMessageType,
     YSyncMessageType,
+    create_awareness_message,
     create_sync_message,
     create_update_message,
     handle_sync_message,
+    merge_updates,
+    read_message,
 )
 
+from . import tracing
 from .channel import AsyncChannel, Channel
+from .metrics import metrics
+from .tracing import get_message_type
 
 if sys.version_info >= (3, 11):
     pass
@@ -50,6 +67,10 @@ class AsyncClientMixin:
     def doc(self) -> Doc:
         return self._client._doc
 
+    @property
+    def awareness(self) -> Awareness:
+        return self._client.awareness
+
     def push(self) -> None:
         self._client.push()
 
@@ -63,7 +84,13 @@ class AsyncClientMixin:
 
 class Client:
     def __init__(
-        self, channel: Channel, doc: Doc | None = None, auto_push: bool = False
+        self,
+        channel: Channel,
+        doc: Doc | None = None,
+        auto_push: bool = False,
+        *,
+        max_push_size: int | None = None,
+        max_pull_size: int | None = None,
     ) -> None:
         """
         Creates a client that connects to a server. The client must always
@@ -79,10 +106,17 @@ class Client:
             auto_push: Whether to automatically send updates of the shared document as they
                 are made by this client. If `False`, the client can use the `push()` method
                 to send the local updates.
+            max_push_size: The maximum size (in bytes) of the updates merged into a single
+                message when pushing, or `None` for no limit. An update bigger than
+                this size is sent in its own message.
+            max_pull_size: The maximum size (in bytes) of the received updates applied
+                in a single transaction when pulling, or `None` for no limit.
         """
         self._channel = channel
         self._doc: Doc = Doc() if doc is None else doc
         self._auto_push = auto_push
+        self._max_push_size = max_push_size
+        self._max_pull_size = max_pull_size
         self._synchronizing = False
         self._synchronized = False
         self._subscription: Subscription | None = None
@@ -112,13 +146,21 @@ class Client:
 
         timeout = None if self._synchronizing else 0
 
-        while True:
+        # the received updates are applied together
+        updates: list[bytes] = []
+        size = 0
+        while self._max_pull_size is None or size < self._max_pull_size:
             try:
                 message = self._channel.receive(timeout)
             except TimeoutError:
-                return
+                break
 
             if message[0] == YMessageType.SYNC:
+                if message[1] == YSyncMessageType.SYNC_UPDATE:
+                    updates.append(read_message(message[2:]))
+                    size += len(message)
+                    continue
+                self._apply_updates(updates)
                 reply = handle_sync_message(message[1:], self._doc)
                 if reply is not None:
                     self._channel.send(reply)
@@ -127,6 +169,13 @@ class Client:
                     self._synchronizing = False
                     self._subscription = self._doc.observe(self._store_updates)
                     return
+        self._apply_updates(updates)
+
+    def _apply_updates(self, updates: list[bytes]) -> None:
+        if updates:
+            update = updates[0] if len(updates) == 1 else merge_updates(*updates)
+            updates.clear()
+            self._doc.apply_update(update)
 
     def _store_updates(self, event: TransactionEvent) -> None:
         self._updates.append(event.update)
@@ -134,10 +183,10 @@ class Client:
 
     def _send_updates(self, push: bool = False) -> None:
         if push or self._auto_push:
-            for update in self._updates:
-                message = create_update_message(update)
-                self._channel.send(message)
+            messages = create_update_messages(self._updates, self._max_push_size)
             self._updates.clear()
+            for message in messages:
+                self._channel.send(message)
 
     def __enter__(self) -> "Client":
         self._updates: list[bytes] = []
@@ -161,6 +210,13 @@ class AsyncClient:
         doc: Doc | None = None,
         auto_push: bool = True,
         auto_pull: bool = True,
+        *,
+        awareness_interval: float = 0.05,
+        push_interval: float = 0,
+        max_push_delay: float | None = None,
+        max_push_size: int | None = None,
+        max_pull_size: int | None = None,
+        awareness: Awareness | None = None,
     ) -> None:
         """
         Creates an async client that connects to a server. The client must always
@@ -179,19 +235,59 @@ class AsyncClient:
             auto_pull: Whether to automatically apply updates to the shared document
                 as they are received. If `False`, the client can use the `pull()`
                 method to apply the remote updates.
+            awareness_interval: The minimum time (in seconds) between two awareness
+                messages sent by the client. The changes to the local awareness state
+                made in the meantime are merged into a single message.
+            push_interval: If `auto_push=True`, the time (in seconds) to wait for another
+                update before sending the pending updates, which are merged into a single
+                message. Each new update restarts the wait.
+            max_push_delay: If `auto_push=True`, the maximum time (in seconds) an update
+                waits before being sent, or `None` for ten times `push_interval`.
+            max_push_size: The maximum size (in bytes) of the updates merged into a single
+                message when pushing, or `None` for no limit. An update bigger than
+                this size is sent in its own message.
+            max_pull_size: The maximum size (in bytes) of the received updates applied
+                in a single transaction when pulling, or `None` for no limit.
+            awareness: An optional external awareness of the shared document, which
+                must be started by its owner (or a new one will be created and started).
         """
         self._channel = channel
         self._doc: Doc = Doc() if doc is None else doc
+        self._start_awareness = awareness is None
+        if awareness is None:
+            awareness = Awareness(self._doc)
+            # the awareness state is only sent once it is set by the application
+            awareness.set_local_state(None)
+        self._awareness = awareness
+        self._awareness_interval = awareness_interval
+        self._awareness_event = Event()
         self._auto_push = auto_push
         self._auto_pull = auto_pull
+        self._push_interval = push_interval
+        # an update waits for at most ten push intervals by default
+        self._max_push_delay = (
+            10 * push_interval if max_push_delay is None else max_push_delay
+        )
+        self._max_push_size = max_push_size
+        self._max_pull_size = max_pull_size
         self._pull_event = Event()
         self._push_event = Event()
         self._synchronizing = False
         self._synchronized = Event()
+        self._handshake_start_time: float | None = None
         self._ready = Event()
         if not auto_pull:
             self._ready.set()
 
+    @property
+    def awareness(self) -> Awareness:
+        """
+        Returns:
+            The client's awareness. Its local state is sent to the server once set with
+            `awareness.set_local_state()`, and it holds the states of the other clients.
+        """
+        return self._awareness
+
     def pull(self) -> None:
         """
         If the client was created with `auto_pull=False`, applies the received updates
@@ -221,41 +317,149 @@ class AsyncClient:
         await self._push_event.wait()
         self._push_event = Event()
 
-    async def _run(self):
+    async def _run(self) -> None:
         await self._wait_pull()
         self._synchronizing = True
-        async with self._doc.new_transaction():
-            sync_message = create_sync_message(self._doc)
-        await self._channel.send(sync_message)
+        with tracing.tracer.span("client.create_sync_message", self._channel.id):
+            async with self._doc.new_transaction():
+                sync_message = create_sync_message(self._doc)
+        self._handshake_start_time = current_time() if metrics.enabled else None
+        await self._send(sync_message)
         async for message in self._channel:
+            messages = [message]
             if message[0] == YMessageType.SYNC:
                 await self._wait_pull()
+                # the updates that are already received are applied together
+                messages.extend(self._receive_available(len(message)))
+            updates: list[bytes] = []
+            for message in messages:
+                if metrics.enabled:
+                    metrics.message_received("client", self._channel.id, message)
+                if (
+                    message[0] == YMessageType.SYNC
+                    and message[1] == YSyncMessageType.SYNC_UPDATE
+                ):
+                    updates.append(read_message(message[2:]))
+                else:
+                    await self._apply_updates(updates)
+                    await self._handle_message(message)
+            await self._apply_updates(updates)
+
+    def _receive_available(self, size: int) -> list[bytes]:
+        messages = []
+        while self._max_pull_size is None or size < self._max_pull_size:
+            try:
+                message = self._channel.receive_nowait()
+            except (WouldBlock, EndOfStream):
+                break
+            messages.append(message)
+            size += len(message)
+        return messages
+
+    async def _apply_updates(self, updates: list[bytes]) -> None:
+        if not updates:
+            return
+        update = updates[0] if len(updates) == 1 else merge_updates(*updates)
+        updates.clear()
+        with tracing.tracer.span(
+            "client.handle_sync_message", self._channel.id, "sync_update", len(update)
+        ):
+            async with self._doc.new_transaction():
+                self._doc.apply_update(update)
+
+    async def _handle_message(self, message: bytes) -> None:
+        if message[0] == YMessageType.SYNC:
+            with tracing.tracer.span(
+                "client.handle_sync_message",
+                self._channel.id,
+                get_message_type(message),
+                len(message),
+            ):
                 async with self._doc.new_transaction():
                     reply = handle_sync_message(message[1:], self._doc)
-                if reply is not None:
-                    await self._channel.send(reply)
-                if message[1] == YSyncMessageType.SYNC_STEP2:
-                    await self._task_group.start(self._send_updates)
-                    self._synchronizing = False
+            if reply is not None:
+                await self._send(reply)
+            if message[1] == YSyncMessageType.SYNC_STEP2:
+                if self._handshake_start_time is not None:
+                    handshake_time = current_time() - self._handshake_start_time
+                    metrics.handshake_seconds.observe(handshake_time, "client")
+                    self._handshake_start_time = None
+                await self._task_group.start(self._send_updates)
+                self._synchronizing = False
+        elif message[0] == YMessageType.AWARENESS:
+            update = read_message(message[1:])
+            self._awareness.apply_awareness_update(update, self._channel)
+
+    def _put_awareness_change(
+        self, topic: str, changes: tuple[dict[str, Any], Any]
+    ) -> None:
+        if topic == "update" and changes[1] == "local":
+            self._awareness_event.set()
+
+    async def _send_awareness(self) -> None:
+        while True:
+            await self._awareness_event.wait()
+            self._awareness_event = Event()
+            client_id = self._awareness.client_id
+            update = self._awareness.encode_awareness_update([client_id])
+            await self._send(create_awareness_message(update))
+            await sleep(self._awareness_interval)
 
     async def _send_updates(self, *, task_status: TaskStatus[None]):
         async with self._doc.events() as events:
             self._ready.set()
             self._synchronized.set()
             task_status.started()
-            update_nb = 0
             async for event in events:
-                if update_nb == 0:
-                    await self._wait_push()
-                    update_nb = events.statistics().current_buffer_used
-                else:
-                    update_nb -= 1
-                message = create_update_message(event.update)
-                await self._channel.send(message)
+                await self._wait_push()
+                # all the pending updates are sent together
+                updates = [event.update]
+                if self._auto_push and self._push_interval > 0:
+                    await self._wait_updates(events, updates)
+                while True:
+                    try:
+                        updates.append(events.receive_nowait().update)
+                    except WouldBlock:
+                        break
+                for message in create_update_messages(updates, self._max_push_size):
+                    await self._send(message)
+
+    async def _wait_updates(
+        self,
+        events: MemoryObjectReceiveStream[TransactionEvent],
+        updates: list[bytes],
+    ) -> None:
+        deadline = current_time() + self._max_push_delay
+        while True:
+            timeout = min(self._push_interval, deadline - current_time())
+            with move_on_after(timeout) as scope:
+                try:
+                    event = await events.receive()
+                except EndOfStream:  # pragma: nocover
+                    return
+                updates.append(event.update)
+            if scope.cancelled_caught:
+                return
+
+    async def _send(self, message: bytes) -> None:
+        with tracing.tracer.span(
+            "client.send", self._channel.id, get_message_type(message), len(message)
+        ):
+            await self._channel.send(message)
+        if metrics.enabled:
+            metrics.message_sent("client", self._channel.id, message)
 
     async def __aenter__(self) -> "AsyncClient":
         async with AsyncExitStack() as exit_stack:
+            subscription = self._awareness.observe(self._put_awareness_change)
+            exit_stack.callback(self._awareness.unobserve, subscription)
+            if self._awareness.get_local_state() is not None:
+                # the state set before connecting is sent
+                self._awareness_event.set()
             self._task_group = await exit_stack.enter_async_context(create_task_group())
+            if self._start_awareness:
+                await self._task_group.start(self._awareness.start)
+            self._task_group.start_soon(self._send_awareness)
             self._task_group.start_soon(self._run)
             await self._ready.wait()
             self._exit_stack = exit_stack.pop_all()
@@ -269,3 +473,33 @@ class AsyncClient:
     ) -> bool | None:
         self._task_group.cancel_scope.cancel()
         return await self._exit_stack.__aexit__(exc_type, exc_val, exc_tb)
+
+
+def create_update_messages(
+    updates: list[bytes], max_size: int | None = None
+) -> list[bytes]:
+    """
+    Merges updates into as few update messages as possible.
+
+    Args:
+        updates: The updates to merge, in the order they were made.
+        max_size: The maximum size (in bytes) of the updates merged into a single
+            message, or `None` for no limit. An update bigger than this size
+            is put in its own message.
+
+    Returns:
+        The update messages.
+    """
+    batches: list[list[bytes]] = []
+    size = 0
+    for update in updates:
+        if batches and (max_size is None or size + len(update) <= max_size):
+            batches[-1].append(update)
+            size += len(update)
+        else:
+            batches.append([update])
+            size = len(update)
+    return [
+        create_update_message(batch[0] if len(batch) == 1 else merge_updates(*batch))
+        for batch in batches
+    ]
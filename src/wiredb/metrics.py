@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import math
+from collections.abc import Iterator
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.075,
+    0.1,
+    0.25,
+    0.5,
+    0.75,
+    1,
+    2.5,
+    5,
+    7.5,
+    10,
+)
+QUEUE_DEPTH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        """
+        A metric, whose values are identified by the values of its labels.
+
+        Args:
+            name: The name of the metric.
+            help: The description of the metric.
+            labels: The names of the labels of the metric.
+        """
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def get(self, *labels: str) -> float:
+        """
+        Args:
+            labels: The values of the labels.
+
+        Returns:
+            The value of the metric for these labels.
+        """
+        return self._values.get(labels, 0)
+
+    def remove(self, *labels: str) -> None:
+        """
+        Removes the value of the metric for some labels.
+
+        Args:
+            labels: The values of the labels.
+        """
+        self._values.pop(labels, None)
+
+    def clear(self) -> None:
+        """
+        Removes all the values of the metric.
+        """
+        self._values.clear()
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        for labels, value in self._values.items():
+            yield f"{self.name}{self._render_labels(labels)} {_render_value(value)}"
+
+    def _render_labels(
+        self, labels: tuple[str, ...], extra_label: tuple[str, str] | None = None
+    ) -> str:
+        items = list(zip(self.labels, labels))
+        if extra_label is not None:
+            items.append(extra_label)
+        if not items:
+            return ""
+        rendered = ",".join(f'{name}="{_escape(value)}"' for name, value in items)
+        return f"{{{rendered}}}"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        """
+        Increments the counter.
+
+        Args:
+            labels: The values of the labels.
+            amount: The amount to increment the counter by.
+        """
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        """
+        Increments the gauge.
+
+        Args:
+            labels: The values of the labels.
+            amount: The amount to increment the gauge by.
+        """
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        """
+        Decrements the gauge.
+
+        Args:
+            labels: The values of the labels.
+            amount: The amount to decrement the gauge by.
+        """
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, *labels: str, value: float) -> None:
+        """
+        Sets the gauge.
+
+        Args:
+            labels: The values of the labels.
+            value: The value of the gauge.
+        """
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        """
+        A histogram, which counts observed values in buckets.
+
+        Args:
+            name: The name of the histogram.
+            help: The description of the histogram.
+            labels: The names of the labels of the histogram.
+            buckets: The upper bounds of the buckets.
+        """
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self._counts: dict[tuple[str, ...], list[int]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        """
+        Observes a value.
+
+        Args:
+            value: The observed value.
+            labels: The values of the labels.
+        """
+        counts = self._counts.get(labels)
+        if counts is None:
+            # the last bucket is +Inf
+            counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def get_count(self, *labels: str) -> int:
+        """
+        Args:
+            labels: The values of the labels.
+
+        Returns:
+            The number of observed values for these labels.
+        """
+        return sum(self._counts.get(labels, ()))
+
+    def remove(self, *labels: str) -> None:
+        super().remove(*labels)
+        self._counts.pop(labels, None)
+
+    def clear(self) -> None:
+        super().clear()
+        self._counts.clear()
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        for labels, counts in self._counts.items():
+            total = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                total += count
+                le = "+Inf" if bound == math.inf else _render_value(bound)
+                rendered_labels = self._render_labels(labels, ("le", le))
+                yield f"{self.name}_bucket{rendered_labels} {total}"
+            rendered_labels = self._render_labels(labels)
+            yield f"{self.name}_sum{rendered_labels} {_render_value(self._values[labels])}"
+            yield f"{self.name}_count{rendered_labels} {total}"
+
+
+class Metrics:
+    def __init__(self) -> None:
+        """
+        The registry of the metrics recorded by rooms, room managers, clients and wires.
+        Metrics are not recorded until the registry is enabled:
+        ```py
+        from wiredb.metrics import metrics
+
+        metrics.enabled = True
+        ```
+        """
+        self.enabled = False
+        self.messages = Counter(
+            "wiredb_messages_total",
+            "Messages received and sent, by rooms and by clients.",
+            ("side", "room", "direction"),
+        )
+        self.bytes = Counter(
+            "wiredb_bytes_total",
+            "Bytes received and sent, by rooms and by clients.",
+            ("side", "room", "direction"),
+        )
+        self.handshake_seconds = Histogram(
+            "wiredb_handshake_seconds",
+            "Duration of the synchronization handshake, by rooms and by clients.",
+            ("side",),
+        )
+        self.broadcast_seconds = Histogram(
+            "wiredb_broadcast_seconds",
+            "Time between the reception of an update by a room and its fan-out "
+            "to the queues of the clients.",
+        )
+        self.queue_depth = Histogram(
+            "wiredb_queue_depth",
+            "Number of updates in the queue of a client when an update is queued.",
+            buckets=QUEUE_DEPTH_BUCKETS,
+        )
+        self.rooms = Gauge("wiredb_rooms", "Active rooms.")
+        self.idle_rooms = Gauge(
+            "wiredb_idle_rooms", "Rooms kept alive without clients."
+        )
+        self.clients = Gauge("wiredb_clients", "Clients of a room.", ("room",))
+        self.write_seconds = Histogram(
+            "wiredb_write_seconds", "Duration of the writes of updates to a file."
+        )
+
+    @property
+    def all(self) -> list[Metric]:
+        """
+        Returns:
+            All the metrics.
+        """
+        return [value for value in vars(self).values() if isinstance(value, Metric)]
+
+    def message_received(self, side: str, room: str, message: bytes) -> None:
+        """
+        Records a received message.
+
+        Args:
+            side: `"room"` or `"client"`.
+            room: The room ID.
+            message: The received message.
+        """
+        self.messages.inc(side, room, "in")
+        self.bytes.inc(side, room, "in", amount=len(message))
+
+    def message_sent(self, side: str, room: str, message: bytes) -> None:
+        """
+        Records a sent message.
+
+        Args:
+            side: `"room"` or `"client"`.
+            room: The room ID.
+            message: The sent message.
+        """
+        self.messages.inc(side, room, "out")
+        self.bytes.inc(side, room, "out", amount=len(message))
+
+    def remove_room(self, room: str) -> None:
+        """
+        Removes the values of the metrics of a room, when it is closed.
+
+        Args:
+            room: The room ID.
+        """
+        for metric in self.all:
+            if "room" in metric.labels:
+                index = metric.labels.index("room")
+                for labels in list(metric._values):
+                    if labels[index] == room:
+                        metric.remove(*labels)
+
+    def clear(self) -> None:
+        """
+        Removes all the values of the metrics.
+        """
+        for metric in self.all:
+            metric.clear()
+
+    def render(self) -> str:
+        """
+        Returns:
+            The metrics in the Prometheus text exposition format.
+        """
+        return "".join(f"{line}\n" for metric in self.all for line in metric.render())
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _render_value(value: float) -> str:
+    return repr(float(value))
+
+
+metrics = Metrics()
@@ -1,46 +1,166 @@
 from __future__ import annotations
 
+import math
 import sys
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from collections.abc import AsyncGenerator, Callable
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, Literal
 
 from anyio import (
     TASK_STATUS_IGNORED,
     AsyncContextManagerMixin,
+    CancelScope,
     Event,
-    Lock,
+    WouldBlock,
+    create_memory_object_stream,
     create_task_group,
+    current_time,
     get_cancelled_exc_class,
+    move_on_after,
+    sleep,
+    sleep_forever,
 )
 from anyio.abc import TaskGroup, TaskStatus
+from anyio.streams.memory import MemoryObjectReceiveStream, MemoryObjectSendStream
 from pycrdt import (
+    Awareness,
     Doc,
+    TransactionEvent,
     YMessageType,
+    YSyncMessageType,
+    create_awareness_message,
     create_sync_message,
     create_update_message,
     handle_sync_message,
+    merge_updates,
+    read_message,
 )
 
+from . import tracing
 from .channel import AsyncChannel
+from .metrics import metrics
+from .tracing import get_message_type
 
 if sys.version_info >= (3, 11):
     from typing import Self
 else:  # pragma: nocover
     from typing_extensions import Self
 
+SlowClientPolicy = Literal["drop", "coalesce", "resync"]
+
+# the number of SYNC_STEP2 replies cached per room
+SYNC_CACHE_SIZE = 16
+
+# the channel from which the updates applied in the current task originate
+_origin: ContextVar[AsyncChannel | None] = ContextVar("origin", default=None)
+
+
+class ClientQueue:
+    def __init__(
+        self,
+        channel: AsyncChannel,
+        max_size: int,
+        *,
+        batch_window: float = 0,
+        peer: bool = False,
+    ) -> None:
+        """
+        The bounded queue of updates waiting to be sent to a client of a room.
+
+        Args:
+            channel: The channel of the client.
+            max_size: The maximum number of updates in the queue.
+            batch_window: The time (in seconds) during which updates are merged
+                before being sent to the client.
+            peer: Whether the client is a replica of the room on another server.
+        """
+        self.channel = channel
+        self.batch_window = batch_window
+        self.peer = peer
+        # the awareness client IDs of the client
+        self.awareness_ids: set[int] = set()
+        # the awareness client IDs whose state must be sent to the client
+        self.awareness_changes: set[int] = set()
+        self.awareness_event = Event()
+        self.send_stream, self.receive_stream = create_memory_object_stream[bytes](
+            max_buffer_size=max_size
+        )
+        self.cancel_scope = CancelScope()
+
+    def drain(self) -> list[bytes]:
+        updates = []
+        while True:
+            try:
+                updates.append(self.receive_stream.receive_nowait())
+            except WouldBlock:
+                return updates
+
 
 class Room(AsyncContextManagerMixin):
-    def __init__(self, id: str) -> None:
+    def __init__(
+        self,
+        id: str,
+        *,
+        max_queue_size: int = 64,
+        slow_client_policy: SlowClientPolicy = "coalesce",
+        coalesce_window: float = 0,
+        coalesce_size: int | None = None,
+        awareness_interval: float = 0.05,
+        awareness_timeout: float = 30,
+    ) -> None:
         """
         Creates a new room in which clients with the same ID will be connected.
 
+        Each client has its own outbound queue, so that a slow client doesn't
+        delay the updates sent to the other clients.
+        The synchronization messages sent to the clients are cached until the
+        shared document changes, so that many clients can join at the same time.
+
         Args:
             id: The room ID.
+            max_queue_size: The maximum number of updates waiting to be sent to a client.
+            slow_client_policy: What to do when the queue of a client is full:
+                `"drop"` disconnects the client, `"coalesce"` merges the queued updates
+                into a single update, and `"resync"` replaces the queued updates with
+                the whole state of the shared document.
+            coalesce_window: The time (in seconds) during which updates are merged
+                before being broadcast as a single update. If `0`, every update
+                is broadcast as soon as it is made.
+            coalesce_size: The size (in bytes) of the merged updates above which
+                they are broadcast before the end of the coalescing window.
+            awareness_interval: The minimum time (in seconds) between two awareness
+                messages sent to a client. The awareness changes made in the meantime
+                are merged into a single message.
+            awareness_timeout: The time (in seconds) after which the awareness state
+                of a client that didn't update it is removed.
+
+        Raises:
+            ValueError: `max_queue_size` is smaller than 1.
         """
+        if max_queue_size < 1:
+            raise ValueError(
+                f"max_queue_size must be at least 1 (got {max_queue_size})"
+            )
         self._id = id
         self._doc: Doc = Doc()
-        self._clients: set[AsyncChannel] = set()
+        self._clients: dict[AsyncChannel, ClientQueue] = {}
+        self._max_queue_size = max_queue_size
+        self._slow_client_policy = slow_client_policy
+        self._coalesce_window = coalesce_window
+        self._coalesce_size = coalesce_size
+        self._sync_step1: bytes | None = None
+        self._sync_step2: dict[bytes, bytes] = {}
+        self._awareness_interval = awareness_interval
+        self._awareness = Awareness(
+            self._doc, outdated_timeout=int(awareness_timeout * 1000)
+        )
+        # the room itself has no awareness state
+        self._awareness.set_local_state(None)
+        self._awareness.observe(self._put_awareness_changes)
         self._clean_event = Event()
 
     @property
@@ -59,6 +179,14 @@ class Room(AsyncContextManagerMixin):
         """
         return self._doc
 
+    @property
+    def awareness(self) -> Awareness:
+        """
+        Returns:
+            The room's awareness, which holds the awareness states of the clients.
+        """
+        return self._awareness
+
     @property
     def task_group(self) -> TaskGroup:
         """
@@ -70,31 +198,161 @@ class Room(AsyncContextManagerMixin):
     @asynccontextmanager
     async def __asynccontextmanager__(self) -> AsyncGenerator[Self]:
         async with create_task_group() as self._task_group:
+            await self._task_group.start(self._awareness.start)
             await self._task_group.start(self.run)
             yield self
+            self._task_group.cancel_scope.cancel()
 
     async def run(self, *, task_status: TaskStatus[None] = TASK_STATUS_IGNORED) -> None:
         """
         The main background task which is responsible for forwarding every update
         from a client to all other clients in the room.
+        Updates are put in the queue of each client without waiting for them to be sent,
+        and are not sent back to the client they originate from. If the room has a
+        coalescing window, the updates made during the window are merged together.
 
         Args:
             task_status: The task status that is set when the task has started.
         """
-        async with self._doc.events() as events:
-            task_status.started()
-            async for event in events:
-                if self._clients:
-                    message = create_update_message(event.update)
-                    clients = set(self._clients)
-                    for client in clients:
-                        try:
-                            await client.send(message)
-                        except get_cancelled_exc_class():  # pragma: nocover
-                            self._remove_client(client)
-                            raise
-                        except Exception:  # pragma: nocover
-                            self._remove_client(client)
+        send_stream, receive_stream = create_memory_object_stream[
+            tuple[bytes, AsyncChannel | None]
+        ](max_buffer_size=math.inf)
+        subscription = self._doc.observe(partial(self._put_update, send_stream))
+        try:
+            async with receive_stream:
+                task_status.started()
+                async for update, origin in receive_stream:
+                    start_time = current_time() if metrics.enabled else None
+                    batch = [(update, origin)]
+                    with tracing.tracer.span(
+                        "room.broadcast", self._id, size=len(update)
+                    ):
+                        if self._coalesce_window > 0:
+                            await self._coalesce(receive_stream, batch)
+                        self._broadcast(batch)
+                    if start_time is not None:
+                        metrics.broadcast_seconds.observe(current_time() - start_time)
+        finally:
+            self._doc.unobserve(subscription)
+
+    async def _coalesce(
+        self,
+        receive_stream: MemoryObjectReceiveStream[tuple[bytes, AsyncChannel | None]],
+        batch: list[tuple[bytes, AsyncChannel | None]],
+    ) -> None:
+        size = len(batch[0][0])
+        with move_on_after(self._coalesce_window):
+            while self._coalesce_size is None or size < self._coalesce_size:
+                update, origin = await receive_stream.receive()
+                batch.append((update, origin))
+                size += len(update)
+
+    def _broadcast(self, batch: list[tuple[bytes, AsyncChannel | None]]) -> None:
+        # a client doesn't receive the updates that originate from it,
+        # so the merged update depends on whether the client is an origin
+        origins = {origin for _, origin in batch}
+        merged_updates: dict[AsyncChannel | None, bytes | None] = {}
+        for queue in list(self._clients.values()):
+            origin = queue.channel if queue.channel in origins else None
+            if origin not in merged_updates:
+                updates = [
+                    update
+                    for update, _origin in batch
+                    if origin is None or _origin is not origin
+                ]
+                if not updates:
+                    merged_updates[origin] = None
+                elif len(updates) == 1:
+                    merged_updates[origin] = updates[0]
+                else:
+                    merged_updates[origin] = merge_updates(*updates)
+            update = merged_updates[origin]
+            if update is not None:
+                self._enqueue(queue, update)
+
+    def _put_update(
+        self,
+        send_stream: MemoryObjectSendStream[tuple[bytes, AsyncChannel | None]],
+        event: TransactionEvent,
+    ) -> None:
+        self._sync_step1 = None
+        self._sync_step2.clear()
+        send_stream.send_nowait((event.update, _origin.get()))
+
+    def _enqueue(self, queue: ClientQueue, update: bytes) -> None:
+        try:
+            queue.send_stream.send_nowait(update)
+        except WouldBlock:
+            pass
+        else:
+            if metrics.enabled:
+                depth = queue.send_stream.statistics().current_buffer_used
+                metrics.queue_depth.observe(depth)
+            return
+
+        if self._slow_client_policy == "drop":
+            queue.cancel_scope.cancel()
+            self._remove_client(queue.channel)
+            return
+
+        updates = queue.drain()
+        if self._slow_client_policy == "coalesce":
+            update = merge_updates(*updates, update)
+        else:
+            update = self._doc.get_update()
+        queue.send_stream.send_nowait(update)
+
+    def _put_awareness_changes(
+        self, topic: str, changes: tuple[dict[str, Any], Any]
+    ) -> None:
+        if topic != "update":
+            return
+
+        change, origin = changes
+        client_ids = change["added"] + change["updated"] + change["removed"]
+        if origin in self._clients:
+            awareness_ids = self._clients[origin].awareness_ids
+            awareness_ids.update(change["added"] + change["updated"])
+            awareness_ids.difference_update(change["removed"])
+        for queue in self._clients.values():
+            if queue.channel is not origin:
+                queue.awareness_changes.update(client_ids)
+                queue.awareness_event.set()
+
+    async def _send_awareness(self, queue: ClientQueue) -> None:
+        while True:
+            await queue.awareness_event.wait()
+            queue.awareness_event = Event()
+            client_ids = list(queue.awareness_changes)
+            queue.awareness_changes.clear()
+            update = self._awareness.encode_awareness_update(client_ids)
+            await self._send(queue, create_awareness_message(update))
+            await sleep(self._awareness_interval)
+
+    async def _send_updates(self, queue: ClientQueue) -> None:
+        async for update in queue.receive_stream:
+            if queue.batch_window > 0:
+                await sleep(queue.batch_window)
+                updates = queue.drain()
+                if updates:
+                    update = merge_updates(update, *updates)
+            message = create_update_message(update)
+            await self._send(queue, message)
+
+    async def _send(self, queue: ClientQueue, message: bytes) -> None:
+        try:
+            with tracing.tracer.span(
+                "room.send", self._id, get_message_type(message), len(message)
+            ):
+                await queue.channel.send(message)
+        except get_cancelled_exc_class():
+            raise
+        except Exception:
+            # the connection was dropped
+            queue.cancel_scope.cancel()
+        else:
+            if metrics.enabled:
+                metrics.message_sent("room", self._id, message)
 
     async def serve(
         self,
@@ -109,39 +367,178 @@ class Room(AsyncContextManagerMixin):
             client: The client making the connection.
             task_status: The task status that is set when the task has started.
         """
-        self._clients.add(client)
+        queue = ClientQueue(client, self._max_queue_size)
+        await self._serve(queue, task_status=task_status)
+
+    async def replicate(
+        self,
+        peer: AsyncChannel,
+        *,
+        batch_window: float = 0.01,
+        task_status: TaskStatus[None] = TASK_STATUS_IGNORED,
+    ) -> None:
+        """
+        Keeps the room in sync with a replica of the room on another server, so that
+        clients can connect to any of the servers. For instance, using the WebSocket wire:
+        ```py
+        async with aconnect_ws(f"http://other-server:8000/{room.id}") as ws:
+            await room.replicate(HttpxAsyncWebSocket(ws, room.id))
+        ```
+        The replication is symmetric: both replicas exchange their updates through the
+        peer channel. Updates received from a peer are not sent back to it, and updates
+        sent to a peer are merged during `batch_window`.
+        The peer doesn't count as a client of this room, which is closed when all its
+        clients are gone, but this room counts as a client of the other replica.
+
+        Args:
+            peer: The channel connected to the other replica of the room.
+            batch_window: The time (in seconds) during which updates are merged before
+                being sent to the peer.
+            task_status: The task status that is set when the task has started.
+        """
+        queue = ClientQueue(
+            peer, self._max_queue_size, batch_window=batch_window, peer=True
+        )
+        await self._serve(queue, task_status=task_status)
+
+    async def _serve(
+        self,
+        queue: ClientQueue,
+        *,
+        task_status: TaskStatus[None] = TASK_STATUS_IGNORED,
+    ) -> None:
+        client = queue.channel
+        self._clients[client] = queue
+        if not queue.peer and self._clean_event.is_set():
+            self._clean_event = Event()
+        start_time = None
+        if metrics.enabled:
+            metrics.clients.inc(self._id)
+            start_time = current_time()
         started = False
         try:
-            async with self._doc.new_transaction():
-                sync_message = create_sync_message(self._doc)
-            await client.send(sync_message)
-            task_status.started()
-            started = True
-            async for message in client:
-                message_type = message[0]
-                if message_type == YMessageType.SYNC:
-                    async with self._doc.new_transaction():
-                        reply = handle_sync_message(message[1:], self._doc)
-                    if reply is not None:
-                        await client.send(reply)
+            with queue.cancel_scope:
+                async with create_task_group() as tg:
+                    with tracing.tracer.span("room.create_sync_message", self._id):
+                        sync_message = await self._create_sync_message()
+                    await self._send(queue, sync_message)
+                    task_status.started()
+                    started = True
+                    tg.start_soon(self._send_updates, queue)
+                    tg.start_soon(self._send_awareness, queue)
+                    if self._awareness.states:
+                        queue.awareness_changes.update(self._awareness.states)
+                        queue.awareness_event.set()
+                    async for message in client:
+                        if metrics.enabled:
+                            metrics.message_received("room", self._id, message)
+                        message_type = message[0]
+                        if message_type == YMessageType.SYNC:
+                            with tracing.tracer.span(
+                                "room.handle_sync_message",
+                                self._id,
+                                get_message_type(message),
+                                len(message),
+                            ):
+                                reply = await self._handle_sync_message(message, client)
+                            if reply is not None:
+                                await self._send(queue, reply)
+                                if start_time is not None:
+                                    # the client is synchronized
+                                    handshake_time = current_time() - start_time
+                                    metrics.handshake_seconds.observe(
+                                        handshake_time, "room"
+                                    )
+                                    start_time = None
+                        elif message_type == YMessageType.AWARENESS:
+                            update = read_message(message[1:])
+                            self._awareness.apply_awareness_update(update, client)
+                    tg.cancel_scope.cancel()
         except get_cancelled_exc_class():
             raise
         finally:
             if not started:  # pragma: nocover
                 task_status.started()
+            queue.send_stream.close()
+            queue.receive_stream.close()
             self._remove_client(client)
 
+    async def _create_sync_message(self) -> bytes:
+        if self._sync_step1 is None:
+            async with self._doc.new_transaction():
+                # the cache is set inside the transaction, so that it cannot be
+                # invalidated by a change made before it is set
+                self._sync_step1 = create_sync_message(self._doc)
+        return self._sync_step1
+
+    async def _handle_sync_message(
+        self, message: bytes, client: AsyncChannel
+    ) -> bytes | None:
+        if message[1] == YSyncMessageType.SYNC_STEP1:
+            # the reply only depends on the client's state vector, but even if it is
+            # the same as the room's, it must include the room's deletions,
+            # which are not part of the state vector
+            state = message[2:]
+            if state not in self._sync_step2:
+                async with self._doc.new_transaction():
+                    reply = handle_sync_message(message[1:], self._doc)
+                    if len(self._sync_step2) == SYNC_CACHE_SIZE:
+                        del self._sync_step2[next(iter(self._sync_step2))]
+                    assert reply is not None
+                    self._sync_step2[state] = reply
+                return reply
+            return self._sync_step2[state]
+
+        token = _origin.set(client)
+        try:
+            async with self._doc.new_transaction():
+                return handle_sync_message(message[1:], self._doc)
+        finally:
+            _origin.reset(token)
+
     def _remove_client(self, client: AsyncChannel) -> None:
-        self._clients.discard(client)
-        if not self._clients:
+        queue = self._clients.pop(client, None)
+        if queue is not None and metrics.enabled:
+            metrics.clients.dec(self._id)
+        if queue is not None and queue.awareness_ids:
+            self._awareness.remove_awareness_states(list(queue.awareness_ids), client)
+        if all(queue.peer for queue in self._clients.values()):
             self._clean_event.set()
 
 
 class RoomManager(AsyncContextManagerMixin):
-    def __init__(self, room_factory: Callable[[str], Room] = Room) -> None:
+    def __init__(
+        self,
+        room_factory: Callable[[str], Room] = Room,
+        *,
+        room_ttl: float = 0,
+        max_idle_rooms: int | None = None,
+        max_idle_size: int | None = None,
+    ) -> None:
+        """
+        Creates a room manager, which creates rooms when clients connect to them and
+        closes them when all their clients are gone.
+
+        Rooms without clients can be kept alive for some time, so that clients
+        reconnecting to them don't have to wait for them to be created again.
+        When there are too many of these idle rooms, the ones that have been idle
+        for the longest time are closed first.
+
+        Args:
+            room_factory: An optional callable used to create a room.
+            room_ttl: The time (in seconds) during which a room without clients is kept alive.
+            max_idle_rooms: The maximum number of rooms without clients kept alive.
+            max_idle_size: The maximum estimated size (in bytes) of the shared documents
+                of the rooms without clients kept alive.
+        """
         self._room_factory = room_factory
+        self._room_ttl = room_ttl
+        self._max_idle_rooms = max_idle_rooms
+        self._max_idle_size = max_idle_size
         self._rooms: dict[str, Room] = {}
-        self._lock = Lock()
+        self._idle_rooms: OrderedDict[str, tuple[CancelScope, int]] = OrderedDict()
+        self._idle_size = 0
+        self._creating_rooms: dict[str, Event] = {}
 
     @asynccontextmanager
     async def __asynccontextmanager__(self) -> AsyncGenerator[Self]:
@@ -152,21 +549,96 @@ class RoomManager(AsyncContextManagerMixin):
     async def _create_room(self, id: str, *, task_status: TaskStatus[Room]):
         async with self._room_factory(id) as room:
             task_status.started(room)
-            await room._clean_event.wait()
+            if metrics.enabled:
+                metrics.rooms.inc()
+            while True:
+                await room._clean_event.wait()
+                if self._room_ttl > 0:
+                    with CancelScope(deadline=current_time() + self._room_ttl) as scope:
+                        self._add_idle_room(id, scope, len(room.doc.get_update()))
+                        await sleep_forever()
+                    self._remove_idle_room(id)
+                # the event is replaced when a client joins the room
+                if room._clean_event.is_set():
+                    break
             del self._rooms[id]
+            if metrics.enabled:
+                metrics.rooms.dec()
+                metrics.remove_room(id)
+
+    def _add_idle_room(self, id: str, scope: CancelScope, size: int) -> None:
+        self._idle_rooms[id] = (scope, size)
+        self._idle_size += size
+        if metrics.enabled:
+            metrics.idle_rooms.inc()
+        while self._idle_rooms and (
+            (
+                self._max_idle_rooms is not None
+                and len(self._idle_rooms) > self._max_idle_rooms
+            )
+            or (
+                self._max_idle_size is not None
+                and self._idle_size > self._max_idle_size
+            )
+        ):
+            _, (scope, size) = self._idle_rooms.popitem(last=False)
+            self._idle_size -= size
+            scope.cancel()
+            if metrics.enabled:
+                metrics.idle_rooms.dec()
+
+    def _remove_idle_room(self, id: str) -> CancelScope | None:
+        if id not in self._idle_rooms:
+            return None
+        scope, size = self._idle_rooms.pop(id)
+        self._idle_size -= size
+        if metrics.enabled:
+            metrics.idle_rooms.dec()
+        return scope
 
     async def get_room(self, id: str) -> Room:
-        async with self._lock:
-            if id not in self._rooms:
-                room = await self._task_group.start(self._create_room, id)
-                self._rooms[id] = room
-            else:
+        """
+        Gets a room, creating it if it doesn't exist. Only clients of a room that
+        is being created wait for it, clients of other rooms are not blocked.
+
+        Args:
+            id: The room ID.
+
+        Returns:
+            The room.
+        """
+        while True:
+            if id in self._rooms:
                 room = self._rooms[id]
+                scope = self._remove_idle_room(id)
+                if scope is not None:
+                    room._clean_event = Event()
+                    scope.cancel()
+                return room
+            if id not in self._creating_rooms:
+                break
+            # the room is being created, wait for it
+            await self._creating_rooms[id].wait()
+
+        self._creating_rooms[id] = created = Event()
+        try:
+            room = await self._task_group.start(self._create_room, id)
+            self._rooms[id] = room
+        finally:
+            del self._creating_rooms[id]
+            created.set()
         return room
 
 
 class AsyncServer(ABC):
-    def __init__(self, room_factory: Callable[[str], Room] = Room) -> None:
+    def __init__(
+        self,
+        room_factory: Callable[[str], Room] = Room,
+        *,
+        room_ttl: float = 0,
+        max_idle_rooms: int | None = None,
+        max_idle_size: int | None = None,
+    ) -> None:
         """
         Creates an asynchronous server. The server must always
         be used with an async context manager, for instance:
@@ -177,8 +649,17 @@ class AsyncServer(ABC):
 
         Args:
             room_factory: An optional callable used to create a room.
+            room_ttl: The time (in seconds) during which a room without clients is kept alive.
+            max_idle_rooms: The maximum number of rooms without clients kept alive.
+            max_idle_size: The maximum estimated size (in bytes) of the shared documents
+                of the rooms without clients kept alive.
         """
-        self._room_manager = RoomManager(room_factory)
+        self._room_manager = RoomManager(
+            room_factory,
+            room_ttl=room_ttl,
+            max_idle_rooms=max_idle_rooms,
+            max_idle_size=max_idle_size,
+        )
 
     @property
     def room_manager(self) -> RoomManager:
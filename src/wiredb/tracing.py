@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from time import perf_counter
+
+from pycrdt import YMessageType, YSyncMessageType
+
+_null_span: AbstractContextManager[None] = nullcontext()
+
+
+class Tracer:
+    """
+    The interface of the tracing hooks, which are called around the operations of
+    the synchronization handshake and of the update pipeline, in rooms and in clients.
+    This tracer does nothing, a tracer that does something must override `span()`
+    and be set with `set_tracer()`:
+    ```py
+    class MyTracer(Tracer):
+        @contextmanager
+        def span(self, name, room, message_type=None, size=0):
+            ...
+            yield
+            ...
+
+    set_tracer(MyTracer())
+    ```
+
+    The spans are:
+
+    - `"room.create_sync_message"`: the creation of the first synchronization message
+        sent to a client.
+    - `"room.handle_sync_message"`: the handling of a synchronization message received
+        from a client, including the wait for the room's transaction.
+    - `"room.broadcast"`: the fan-out of updates to the queues of the clients, including
+        the coalescing window.
+    - `"room.send"`: the sending of a message to a client.
+    - `"client.create_sync_message"`: the creation of the first synchronization message
+        sent to the room.
+    - `"client.handle_sync_message"`: the handling of a synchronization message received
+        from the room.
+    - `"client.send"`: the sending of a message to the room.
+    """
+
+    def span(
+        self,
+        name: str,
+        room: str,
+        message_type: str | None = None,
+        size: int = 0,
+    ) -> AbstractContextManager[None]:
+        """
+        Args:
+            name: The name of the span.
+            room: The room ID.
+            message_type: The type of the message the operation is about, if any.
+            size: The size (in bytes) of the message or update the operation is about.
+
+        Returns:
+            A context manager around the operation.
+        """
+        return _null_span
+
+
+class Span:
+    def __init__(
+        self,
+        name: str,
+        room: str,
+        message_type: str | None,
+        size: int,
+        duration: float,
+    ) -> None:
+        """
+        A recorded operation.
+
+        Args:
+            name: The name of the span.
+            room: The room ID.
+            message_type: The type of the message the operation is about, if any.
+            size: The size (in bytes) of the message or update the operation is about.
+            duration: The duration (in seconds) of the operation.
+        """
+        self.name = name
+        self.room = room
+        self.message_type = message_type
+        self.size = size
+        self.duration = duration
+
+    def __str__(self) -> str:
+        return (
+            f"{self.duration * 1000:.3f}ms {self.name} room={self.room!r} "
+            f"message_type={self.message_type} size={self.size}"
+        )
+
+
+class SlowSpanRecorder(Tracer):
+    def __init__(self, threshold: float, max_spans: int = 1000) -> None:
+        """
+        A tracer that records the operations slower than a threshold, for instance:
+        ```py
+        recorder = SlowSpanRecorder(threshold=0.1)
+        set_tracer(recorder)
+        ...
+        print(recorder.dump())
+        ```
+
+        Args:
+            threshold: The duration (in seconds) above which an operation is recorded.
+            max_spans: The maximum number of recorded operations, the oldest ones
+                being discarded first.
+        """
+        self._threshold = threshold
+        self._spans: deque[Span] = deque(maxlen=max_spans)
+
+    @property
+    def spans(self) -> list[Span]:
+        """
+        Returns:
+            The recorded operations, from the oldest to the newest.
+        """
+        return list(self._spans)
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        room: str,
+        message_type: str | None = None,
+        size: int = 0,
+    ) -> Iterator[None]:
+        start_time = perf_counter()
+        try:
+            yield
+        finally:
+            duration = perf_counter() - start_time
+            if duration >= self._threshold:
+                self._spans.append(Span(name, room, message_type, size, duration))
+
+    def dump(self) -> str:
+        """
+        Returns:
+            The recorded operations, one per line, from the oldest to the newest.
+        """
+        return "".join(f"{span}\n" for span in self._spans)
+
+    def clear(self) -> None:
+        """
+        Removes the recorded operations.
+        """
+        self._spans.clear()
+
+
+def get_message_type(message: bytes) -> str:
+    """
+    Args:
+        message: A message of the synchronization protocol.
+
+    Returns:
+        The type of the message.
+    """
+    if message[0] == YMessageType.AWARENESS:
+        return "awareness"
+    if message[0] == YMessageType.SYNC:
+        if message[1] == YSyncMessageType.SYNC_STEP1:
+            return "sync_step1"
+        if message[1] == YSyncMessageType.SYNC_STEP2:
+            return "sync_step2"
+        return "sync_update"
+    return "unknown"
+
+
+def set_tracer(new_tracer: Tracer) -> None:
+    """
+    Sets the tracer called by rooms and clients.
+
+    Args:
+        new_tracer: The tracer.
+    """
+    global tracer
+    tracer = new_tracer
+
+
+tracer = Tracer()
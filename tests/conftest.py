@@ -6,21 +6,26 @@ import pytest
 from anyio import run, sleep_forever
 from wire_websocket import AsyncWebSocketServer
 
+from wiredb.metrics import metrics
 
-def run_server(host: str, port: int):  # pragma: nocover
+
+def run_server(
+    host: str, port: int, compression_threshold: int | None
+):  # pragma: nocover
     async def main():
-        async with AsyncWebSocketServer(host=host, port=port):
+        async with AsyncWebSocketServer(
+            host=host, port=port, compression_threshold=compression_threshold
+        ):
             await sleep_forever()
 
     run(main)
 
 
-@pytest.fixture()
-def websocket_server(free_tcp_port: int):
+def start_server(port: int, compression_threshold: int | None = None):
     host = "localhost"
-    p = Process(target=run_server, args=(host, free_tcp_port))
+    p = Process(target=run_server, args=(host, port, compression_threshold))
     p.start()
-    url = f"http://{host}:{free_tcp_port}"
+    url = f"http://{host}:{port}"
     while True:
         try:
             httpx.get(url)
@@ -28,9 +33,27 @@ def websocket_server(free_tcp_port: int):
             time.sleep(0.1)
         else:
             break
-    yield host, free_tcp_port
+    yield host, port
     p.terminate()
     while True:
         time.sleep(0.1)
         if not p.is_alive():
             break
+
+
+@pytest.fixture()
+def websocket_server(free_tcp_port: int):
+    yield from start_server(free_tcp_port)
+
+
+@pytest.fixture()
+def compressed_websocket_server(free_tcp_port: int):
+    yield from start_server(free_tcp_port, compression_threshold=10)
+
+
+@pytest.fixture()
+def enabled_metrics():
+    metrics.enabled = True
+    yield metrics
+    metrics.enabled = False
+    metrics.clear()
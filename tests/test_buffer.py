@@ -0,0 +1,123 @@
+import pytest
+from anyio import (
+    BrokenResourceError,
+    EndOfStream,
+    create_task_group,
+    wait_all_tasks_blocked,
+)
+from pycrdt import (
+    Doc,
+    Text,
+    create_sync_message,
+    create_update_message,
+    read_message,
+)
+
+from wiredb import MessageBuffer
+
+pytestmark = pytest.mark.anyio
+
+
+def update_messages(n: int) -> list[bytes]:
+    doc: Doc = Doc()
+    text = doc.get("text", type=Text)
+    messages = []
+    for i in range(n):
+        with doc.new_transaction():
+            text += str(i)
+            messages.append(create_update_message(doc.get_update()))
+    return messages
+
+
+async def test_block() -> None:
+    buffer = MessageBuffer(max_size=2)
+    sent = []
+
+    async def send() -> None:
+        for message in (b"0", b"1", b"2", b"3"):
+            await buffer.send(message)
+            sent.append(message)
+
+    async with create_task_group() as tg:
+        tg.start_soon(send)
+        await wait_all_tasks_blocked()
+        assert sent == [b"0", b"1"]
+        assert await buffer.receive() == b"0"
+        await wait_all_tasks_blocked()
+        assert sent == [b"0", b"1", b"2"]
+        assert await buffer.receive() == b"1"
+    assert sent == [b"0", b"1", b"2", b"3"]
+    assert buffer.size == 2
+
+
+async def test_max_bytes() -> None:
+    buffer = MessageBuffer(max_bytes=4)
+    sent = []
+
+    async def send() -> None:
+        for message in (b"00000", b"1", b"2"):
+            await buffer.send(message)
+            sent.append(message)
+
+    async with create_task_group() as tg:
+        tg.start_soon(send)
+        await wait_all_tasks_blocked()
+        # a message bigger than the buffer is accepted if the buffer is empty
+        assert sent == [b"00000"]
+        assert buffer.byte_size == 5
+        assert await buffer.receive() == b"00000"
+        await wait_all_tasks_blocked()
+        assert sent == [b"00000", b"1", b"2"]
+    assert buffer.byte_size == 2
+
+
+async def test_drop() -> None:
+    buffer = MessageBuffer(max_size=2, overflow_policy="drop")
+    await buffer.send(b"0")
+    await buffer.send(b"1")
+    with pytest.raises(BrokenResourceError):
+        await buffer.send(b"2")
+    with pytest.raises(EndOfStream):
+        await buffer.receive()
+
+
+async def test_collapse() -> None:
+    buffer = MessageBuffer(max_size=3, overflow_policy="collapse")
+    sync_message = create_sync_message(Doc())
+    messages = update_messages(4)
+    await buffer.send(sync_message)
+    for message in messages:
+        await buffer.send(message)
+    assert buffer.size == 3
+    assert await buffer.receive() == sync_message
+    doc: Doc = Doc()
+    for i in range(2):
+        message = await buffer.receive()
+        doc.apply_update(read_message(message[2:]))
+    assert str(doc.get("text", type=Text)) == "0123"
+
+    # nothing to collapse, the sender blocks
+    buffer = MessageBuffer(max_size=1, overflow_policy="collapse")
+    await buffer.send(sync_message)
+    async with create_task_group() as tg:
+        tg.start_soon(buffer.send, messages[0])
+        await wait_all_tasks_blocked()
+        assert buffer.size == 1
+        assert await buffer.receive() == sync_message
+        assert await buffer.receive() == messages[0]
+
+
+async def test_close() -> None:
+    async with create_task_group() as tg:
+        async with MessageBuffer() as buffer:
+
+            async def receive() -> None:
+                assert await buffer.receive() == b"0"
+                with pytest.raises(EndOfStream):
+                    await buffer.receive()
+
+            tg.start_soon(receive)
+            await wait_all_tasks_blocked()
+            await buffer.send(b"0")
+    with pytest.raises(BrokenResourceError):
+        await buffer.send(b"1")
@@ -1,10 +1,18 @@
+import os
 import re
 from pathlib import Path
 
 import pytest
-from anyio import sleep, wait_all_tasks_blocked
-from pycrdt import Doc, Text
-from wire_file.client import AsyncFileClient, FileClient
+from anyio import fail_after, sleep, wait_all_tasks_blocked
+from pycrdt import Decoder, Doc, Text, write_message
+from wire_file.client import (
+    INDEX_SIZE,
+    AsyncFileClient,
+    FileClient,
+    create_file,
+    read_updates,
+    squash_updates,
+)
 
 pytestmark = pytest.mark.anyio
 
@@ -28,6 +36,30 @@ def test_synchronous_file(tmp_path: Path) -> None:
     assert str(text1) == "Hello"
 
 
+def test_synchronous_file_squash(tmp_path: Path) -> None:
+    update_path = tmp_path / "updates.y"
+    doc0: Doc = Doc()
+    text0 = doc0.get("text", type=Text)
+    text0 += "Hello"
+    with FileClient(doc=doc0, path=update_path) as client:
+        client.pull()
+        version = client.version
+    text0 += ", World!"
+    with FileClient(doc=doc0, path=update_path, squash=True) as client:
+        client.pull()
+    data = update_path.read_bytes()
+    snapshot, updates = read_updates(version, data[len(version) + 1 :])
+    # the updates are squashed when they are written
+    assert snapshot
+    assert updates == []
+    assert list(tmp_path.iterdir()) == [update_path]
+
+    doc1: Doc = Doc()
+    with FileClient(doc=doc1, path=update_path) as client:
+        client.pull()
+    assert str(doc1.get("text", type=Text)) == "Hello, World!"
+
+
 async def test_file_without_write_delay(tmp_path: Path) -> None:
     update_path = tmp_path / "updates.y"
     doc0: Doc = Doc()
@@ -52,7 +84,7 @@ async def test_file_with_write_delay(tmp_path: Path) -> None:
         for i in range(20):
             text += "."
             await sleep(0.01)
-        header = client.version.encode() + bytes([0])
+        header = create_file(client.version)
         assert update_path.read_bytes() == header
         await sleep(0.2)
         data = update_path.read_bytes()
@@ -60,13 +92,79 @@ async def test_file_with_write_delay(tmp_path: Path) -> None:
         assert len(data) > len(header)
 
 
+@pytest.mark.parametrize(
+    "write_delay,max_write_delay",
+    [
+        (0.1, 0.1),
+        # ten times the write delay by default
+        (0.02, None),
+    ],
+)
+async def test_file_with_max_write_delay(
+    tmp_path: Path, write_delay: float, max_write_delay: float | None
+) -> None:
+    update_path = tmp_path / "updates.y"
+    doc: Doc = Doc()
+    async with AsyncFileClient(
+        doc=doc,
+        path=update_path,
+        write_delay=write_delay,
+        max_write_delay=max_write_delay,
+    ) as client:
+        header = create_file(client.version)
+        text = doc.get("text", type=Text)
+        # the updates are written while they keep being made
+        for i in range(50):
+            text += "."
+            await sleep(0.01)
+            if update_path.read_bytes() != header:
+                break
+        else:
+            raise TimeoutError()  # pragma: nocover
+        assert i < 40
+
+
+@pytest.mark.parametrize("batch", ["updates", "bytes"])
+async def test_file_with_max_write_batch(tmp_path: Path, batch: str) -> None:
+    update_path = tmp_path / "updates.y"
+    async with AsyncFileClient(
+        path=update_path,
+        write_delay=10,
+        max_write_updates=3 if batch == "updates" else None,
+        max_write_bytes=60 if batch == "bytes" else None,
+    ) as client:
+        header = create_file(client.version)
+        text = client.doc.get("text", type=Text)
+        for i in range(2):
+            text += "." * 10
+            await wait_all_tasks_blocked()
+        assert update_path.read_bytes() == header
+        text += "." * 10
+        await wait_all_tasks_blocked()
+        # the batch is written without waiting for the write delay
+        with fail_after(1):
+            while True:
+                messages = update_path.read_bytes()[len(header) :]
+                message_nb = 0
+                decoder = Decoder(messages)
+                while decoder.read_message():
+                    message_nb += 1
+                if message_nb == 3:
+                    break
+                await sleep(0.01)  # pragma: nocover
+        text += "!"
+        await wait_all_tasks_blocked()
+    # the pending updates are written when the client exits
+    assert b"!" in update_path.read_bytes()
+
+
 async def test_file_wrong_version(tmp_path: Path) -> None:
     update_path = tmp_path / "updates.y"
     update_path.write_bytes(b"0.0.0" + bytes([0]))
 
     with pytest.raises(
         RuntimeError,
-        match=re.escape('File version mismatch (got "0.0.0", expected "0.0.1")'),
+        match=re.escape('File version mismatch (got "0.0.0", expected "0.0.2")'),
     ):
         async with AsyncFileClient(path=update_path):
             pass  # pragma: nocover
@@ -114,6 +212,130 @@ async def test_squash(tmp_path: Path) -> None:
     assert b"Hello, World! Goodbye." not in data
 
 
+async def test_compaction(tmp_path: Path) -> None:
+    update_path = tmp_path / "updates.y"
+    async with AsyncFileClient(path=update_path, compaction_ratio=1) as client:
+        version = client.version
+        text = client.doc.get("text", type=Text)
+        for i in range(10):
+            text += "."
+            await sleep(0.005)
+    data = update_path.read_bytes()
+    snapshot, updates = read_updates(version, data[len(version) + 1 :])
+    # the log is smaller than the minimum compaction size
+    assert not snapshot
+    assert len(updates) == 10
+    update_path.unlink()
+
+    async with AsyncFileClient(
+        path=update_path, compaction_ratio=1, min_compaction_bytes=256
+    ) as client:
+        text = client.doc.get("text", type=Text)
+        for i in range(100):
+            text += "."
+            await sleep(0.005)
+        # wait for the log to be compacted, which writes a snapshot index
+        header_size = len(version) + 1
+        with fail_after(5):
+            while True:
+                index = update_path.read_bytes()[header_size:][:INDEX_SIZE]
+                if int.from_bytes(index, "little"):
+                    break
+                await sleep(0.01)  # pragma: nocover
+    data = update_path.read_bytes()
+    snapshot, updates = read_updates(version, data[header_size:])
+    # the log was compacted in the background, into a new file
+    assert snapshot
+    assert len(updates) < 50
+    assert list(tmp_path.iterdir()) == [update_path]
+
+    async with AsyncFileClient(path=update_path) as client:
+        text = client.doc.get("text", type=Text)
+        assert str(text) == "." * 100
+
+
+def test_squash_updates() -> None:
+    doc: Doc = Doc()
+    updates: list[bytes] = []
+    doc.observe(lambda event: updates.append(event.update))
+    text = doc.get("text", type=Text)
+    for i in range(3):
+        text += str(i)
+    snapshot = squash_updates(updates[0], updates[1:])
+    squashed_doc: Doc = Doc()
+    squashed_doc.apply_update(snapshot)
+    assert str(squashed_doc.get("text", type=Text)) == "012"
+
+
+async def test_migration(tmp_path: Path) -> None:
+    doc: Doc = Doc()
+    updates: list[bytes] = []
+    doc.observe(lambda event: updates.append(event.update))
+    text = doc.get("text", type=Text)
+    for i in range(3):
+        text += str(i)
+    legacy_data = b"0.0.1" + bytes([0])
+    legacy_data += b"".join(write_message(update) for update in updates)
+    for path in (tmp_path / "async.y", tmp_path / "sync.y"):
+        path.write_bytes(legacy_data)
+
+    # a file in the previous format is migrated to the current one
+    async with AsyncFileClient(path=tmp_path / "async.y") as client:
+        version = client.version
+        assert str(client.doc.get("text", type=Text)) == "012"
+    with FileClient(path=tmp_path / "sync.y") as sync_client:
+        sync_client.pull()
+        assert str(sync_client.doc.get("text", type=Text)) == "012"
+    for path in (tmp_path / "async.y", tmp_path / "sync.y"):
+        data = path.read_bytes()
+        assert data.startswith(version.encode() + bytes([0]))
+        snapshot, updates = read_updates(version, data[len(version) + 1 :])
+        assert snapshot
+        assert updates == []
+
+    async with AsyncFileClient(path=tmp_path / "async.y") as client:
+        assert str(client.doc.get("text", type=Text)) == "012"
+
+
+@pytest.mark.parametrize("fsync_policy", ["never", "batch", "interval"])
+async def test_fsync_policy(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, fsync_policy: str
+) -> None:
+    update_path = tmp_path / "updates.y"
+    fsync_nb = [0]
+    fsync = os.fsync
+
+    def count_fsync(fd: int) -> None:
+        fsync_nb[0] += 1
+        fsync(fd)
+
+    async with AsyncFileClient(
+        path=update_path,
+        fsync_policy=fsync_policy,  # type: ignore[arg-type]
+        fsync_interval=0.1,
+    ) as client:
+        monkeypatch.setattr(os, "fsync", count_fsync)
+        text = client.doc.get("text", type=Text)
+        for i in range(3):
+            text += "."
+            await sleep(0.01)
+        if fsync_policy == "batch":
+            # each written batch is synced
+            assert fsync_nb[0] == 3
+        else:
+            assert fsync_nb[0] == 0
+        await sleep(0.15)
+        if fsync_policy == "interval":
+            # the written batches are synced together
+            assert fsync_nb[0] == 1
+        text += "."
+    if fsync_policy == "never":
+        assert fsync_nb[0] == 0
+    else:
+        # the last batch is synced when the client exits
+        assert fsync_nb[0] == (4 if fsync_policy == "batch" else 2)
+
+
 @pytest.mark.skip(reason="Updates from different docs are not squashed")
 async def test_not_squash(tmp_path: Path) -> None:  # pragma: nocover
     update_path = tmp_path / "updates.y"
@@ -188,3 +410,40 @@ async def test_reconnect_after_update(tmp_path: Path) -> None:
     assert str(client_text) == "Hello, World! Goodbye."
     size4 = len(update_path.read_bytes())
     assert size4 == size3
+
+
+@pytest.mark.parametrize("overflow_policy", ["block", "collapse"])
+async def test_max_buffer_size(tmp_path: Path, overflow_policy: str) -> None:
+    update_path = tmp_path / "updates.y"
+    async with AsyncFileClient(
+        path=update_path,
+        write_delay=0.2,
+        max_buffer_size=2,
+        overflow_policy=overflow_policy,  # type: ignore[arg-type]
+    ) as client:
+        header = create_file(client.version)
+        text = client.doc.get("text", type=Text)
+        for i in range(5):
+            text += str(i)
+            await wait_all_tasks_blocked()
+        if overflow_policy == "block":
+            # the pending updates are written when there are too many of them
+            with fail_after(1):
+                while update_path.read_bytes() == header:
+                    await sleep(0.01)  # pragma: nocover
+        else:
+            # the pending updates are merged
+            assert update_path.read_bytes() == header
+        await sleep(0.3)
+    messages = update_path.read_bytes()[len(header) :]
+    message_nb = 0
+    decoder = Decoder(messages)
+    while decoder.read_message():
+        message_nb += 1
+    if overflow_policy == "block":
+        # updates made while the client waits for a write may be sent merged
+        assert 1 < message_nb <= 5
+    else:
+        assert message_nb == 1
+    async with AsyncFileClient(path=update_path) as client:
+        assert str(client.doc.get("text", type=Text)) == "01234"
@@ -1,6 +1,6 @@
 import pytest
 from anyio import fail_after, sleep, wait_all_tasks_blocked
-from pycrdt import Text
+from pycrdt import Text, TransactionEvent
 from wire_memory import AsyncMemoryClient, AsyncMemoryServer
 
 pytestmark = pytest.mark.anyio
@@ -52,3 +52,115 @@ async def test_push_pull() -> None:
             client1.push()
             await wait_all_tasks_blocked()
             assert str(text0) == "Hello, World!"
+
+
+async def test_awareness() -> None:
+    async with AsyncMemoryServer() as server:
+        async with (
+            AsyncMemoryClient(server=server) as client0,
+            AsyncMemoryClient(server=server) as client1,
+        ):
+            assert client0.awareness.states == {}
+            client0.awareness.set_local_state({"user": "foo"})
+            client_id = client0.awareness.client_id
+            with fail_after(1):
+                while client_id not in client1.awareness.states:
+                    await sleep(0.01)
+            assert client1.awareness.states[client_id] == {"user": "foo"}
+
+
+async def test_drop_slow_client() -> None:
+    async with AsyncMemoryServer(max_buffer_size=1, overflow_policy="drop") as server:
+        room = await server.room_manager.get_room("")
+        # a client that doesn't pull doesn't receive messages
+        async with AsyncMemoryClient(server=server, auto_pull=False):
+            async with AsyncMemoryClient(server=server) as client1:
+                await client1.synchronized.wait()
+                assert len(room._clients) == 2
+                text1 = client1.doc.get("text", type=Text)
+                text1 += "Hello"
+                with fail_after(1):
+                    while len(room._clients) != 1:
+                        await sleep(0.01)
+
+
+@pytest.mark.parametrize("max_push_size,message_nb", [(None, 1), (1, 10)])
+async def test_batched_push(max_push_size, message_nb, enabled_metrics) -> None:
+    async with AsyncMemoryServer() as server:
+        async with AsyncMemoryClient(
+            auto_push=False, server=server, max_push_size=max_push_size
+        ) as client0:
+            await client0.synchronized.wait()
+            text0 = client0.doc.get("text", type=Text)
+            for i in range(10):
+                text0 += str(i)
+            sent_nb = enabled_metrics.messages.get("client", "", "out")
+            client0.push()
+            await wait_all_tasks_blocked()
+            assert enabled_metrics.messages.get("client", "", "out") == (
+                sent_nb + message_nb
+            )
+            async with AsyncMemoryClient(server=server) as client1:
+                text1 = client1.doc.get("text", type=Text)
+                with fail_after(1):
+                    while True:
+                        await sleep(0.01)
+                        if str(text1) == "0123456789":
+                            break
+
+
+@pytest.mark.parametrize("max_pull_size,text", [(None, "0123456789"), (1, "0")])
+async def test_batched_pull(max_pull_size, text) -> None:
+    async with AsyncMemoryServer() as server:
+        async with (
+            AsyncMemoryClient(server=server) as client0,
+            AsyncMemoryClient(
+                auto_pull=False, server=server, max_pull_size=max_pull_size
+            ) as client1,
+        ):
+            client1.pull()
+            await client1.synchronized.wait()
+            text0 = client0.doc.get("text", type=Text)
+            text1 = client1.doc.get("text", type=Text)
+            events: list[TransactionEvent] = []
+            client1.doc.observe(events.append)
+            for i in range(10):
+                text0 += str(i)
+                await wait_all_tasks_blocked()
+            assert str(text1) == ""
+            client1.pull()
+            await wait_all_tasks_blocked()
+            assert str(text1) == text
+            # the updates are applied in a single transaction
+            assert len(events) == 1
+
+
+@pytest.mark.parametrize("max_push_delay", [None, 0.05])
+async def test_debounced_push(max_push_delay, enabled_metrics) -> None:
+    async with AsyncMemoryServer() as server:
+        async with AsyncMemoryClient(
+            server=server, push_interval=0.1, max_push_delay=max_push_delay
+        ) as client0:
+            await client0.synchronized.wait()
+            # an update waits for at most ten push intervals by default
+            assert client0._client._max_push_delay == (
+                1 if max_push_delay is None else max_push_delay
+            )
+            text0 = client0.doc.get("text", type=Text)
+            sent_nb = enabled_metrics.messages.get("client", "", "out")
+            for i in range(10):
+                text0 += str(i)
+                await sleep(0.02)
+            await sleep(0.2)
+            message_nb = enabled_metrics.messages.get("client", "", "out") - sent_nb
+            if max_push_delay is None:
+                assert message_nb == 1
+            else:
+                assert 1 < message_nb < 10
+            async with AsyncMemoryClient(server=server) as client1:
+                text1 = client1.doc.get("text", type=Text)
+                with fail_after(1):
+                    while True:
+                        await sleep(0.01)
+                        if str(text1) == "0123456789":
+                            break
@@ -24,4 +24,4 @@ async def test_messages(client_nb: int) -> None:
             for client in clients:
                 channel = cast(Memory, client.channel)
                 assert channel.send_nb == client_nb + 2
-                assert channel.receive_nb == client_nb + 2
+                assert channel.receive_nb == client_nb + 1
@@ -0,0 +1,109 @@
+import pytest
+from anyio import fail_after, sleep
+from pycrdt import Text
+from wire_file import AsyncFileClient
+from wire_memory import AsyncMemoryClient, AsyncMemoryServer
+
+from wiredb.metrics import Counter, Gauge, Histogram, Metrics, metrics
+
+pytestmark = pytest.mark.anyio
+
+
+def test_render() -> None:
+    counter = Counter("counter", "A counter.", ("room",))
+    counter.inc('a"\\\nb')
+    counter.inc('a"\\\nb', amount=2)
+    assert list(counter.render()) == [
+        "# HELP counter A counter.",
+        "# TYPE counter counter",
+        'counter{room="a\\"\\\\\\nb"} 3.0',
+    ]
+
+    gauge = Gauge("gauge", "A gauge.")
+    gauge.inc()
+    gauge.dec(amount=3)
+    assert gauge.get() == -2
+    gauge.set(value=5)
+    assert list(gauge.render())[2] == "gauge 5.0"
+
+    histogram = Histogram("histogram", "A histogram.", ("side",), buckets=(1, 2))
+    for value in (0.5, 1.5, 3):
+        histogram.observe(value, "room")
+    assert histogram.get_count("room") == 3
+    assert list(histogram.render()) == [
+        "# HELP histogram A histogram.",
+        "# TYPE histogram histogram",
+        'histogram_bucket{side="room",le="1.0"} 1',
+        'histogram_bucket{side="room",le="2.0"} 2',
+        'histogram_bucket{side="room",le="+Inf"} 3',
+        'histogram_sum{side="room"} 5.0',
+        'histogram_count{side="room"} 3',
+    ]
+    histogram.remove("room")
+    assert histogram.get_count("room") == 0
+
+
+def test_remove_room() -> None:
+    registry = Metrics()
+    registry.message_received("room", "room0", b"00")
+    registry.message_sent("room", "room1", b"0")
+    registry.clients.inc("room0")
+    registry.rooms.inc()
+    registry.remove_room("room0")
+    assert registry.messages.get("room", "room0", "in") == 0
+    assert registry.clients.get("room0") == 0
+    assert registry.bytes.get("room", "room1", "out") == 1
+    assert registry.rooms.get() == 1
+    registry.clear()
+    assert registry.render().count("\n") == 2 * len(registry.all)
+
+
+async def test_disabled() -> None:
+    assert not metrics.enabled
+    async with AsyncMemoryServer() as server:
+        async with AsyncMemoryClient(server=server) as client:
+            await client.synchronized.wait()
+    assert metrics.render().count("\n") == 2 * len(metrics.all)
+
+
+async def test_memory(enabled_metrics: Metrics) -> None:
+    async with AsyncMemoryServer(room_ttl=10) as server:
+        async with (
+            AsyncMemoryClient("room", server=server) as client0,
+            AsyncMemoryClient("room", server=server) as client1,
+        ):
+            await client0.synchronized.wait()
+            await client1.synchronized.wait()
+            assert metrics.rooms.get() == 1
+            assert metrics.clients.get("room") == 2
+            text0 = client0.doc.get("text", type=Text)
+            text0 += "Hello"
+            text1 = client1.doc.get("text", type=Text)
+            with fail_after(1):
+                while str(text1) != "Hello":
+                    await sleep(0.01)
+        for direction in ("in", "out"):
+            for side in ("room", "client"):
+                assert metrics.messages.get(side, "room", direction) > 0
+                assert metrics.bytes.get(side, "room", direction) > 0
+        assert metrics.handshake_seconds.get_count("room") == 2
+        assert metrics.handshake_seconds.get_count("client") == 2
+        assert metrics.broadcast_seconds.get_count() == 1
+        assert metrics.queue_depth.get_count() == 1
+        with fail_after(1):
+            while metrics.idle_rooms.get() != 1:
+                await sleep(0.01)
+        assert metrics.clients.get("room") == 0
+        await server.room_manager.get_room("room")
+        assert metrics.idle_rooms.get() == 0
+    text = metrics.render()
+    assert 'wiredb_messages_total{side="room",room="room",direction="in"}' in text
+
+
+async def test_write_latency(enabled_metrics: Metrics, tmp_path) -> None:
+    async with AsyncFileClient(path=tmp_path / "updates.y") as client:
+        text = client.doc.get("text", type=Text)
+        text += "Hello"
+        with fail_after(1):
+            while metrics.write_seconds.get_count() == 0:
+                await sleep(0.01)
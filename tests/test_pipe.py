@@ -1,7 +1,10 @@
+import os
+
 import pytest
-from anyio import fail_after, sleep
+from anyio import create_task_group, fail_after, sleep
 from pycrdt import Text
 from wire_pipe import AsyncPipeClient, AsyncPipeServer
+from wire_pipe.server import SEPARATOR, STOP, Pipe
 
 pytestmark = pytest.mark.anyio
 
@@ -28,3 +31,53 @@ async def test_pipe(anyio_backend: str) -> None:
                     await sleep(0.01)
                     if str(text0) == "Hello, World!":
                         break
+
+
+async def test_stalled_client() -> None:
+    async with AsyncPipeServer() as server:
+        # a client that never reads from its pipe, which gets full
+        (
+            client_sender,
+            client_receiver,
+            server_sender,
+            server_receiver,
+        ) = await server.connect("")
+        connection0 = await server.connect("")
+        connection1 = await server.connect("")
+        async with (
+            AsyncPipeClient(connection=connection0) as client0,
+            AsyncPipeClient(connection=connection1) as client1,
+        ):
+            text0 = client0.doc.get("text", type=Text)
+            text1 = client1.doc.get("text", type=Text)
+            # the other clients are not blocked by the stalled one
+            for i in range(2):
+                text0 += "." * 2**20
+                with fail_after(5):
+                    while True:
+                        await sleep(0.01)
+                        if len(text1) == (i + 1) * 2**20:
+                            break
+        os.write(client_sender, STOP)
+        os.close(client_sender)
+        os.close(client_receiver)
+    os.close(server_sender)
+    os.close(server_receiver)
+
+
+async def test_pipe_chunks() -> None:
+    receiver, sender = os.pipe()
+    async with create_task_group() as tg:
+        pipe = Pipe(tg, sender, receiver, "")
+        # a big message and a separator received in several reads
+        message = b"." * 2**20
+        await pipe.send(message)
+        os.write(sender, b"Hello" + SEPARATOR[:4])
+        await sleep(0.1)
+        os.write(sender, SEPARATOR[4:])
+        with fail_after(1):
+            assert await pipe.receive() == message
+            assert await pipe.receive() == b"Hello"
+        os.write(sender, STOP)
+    os.close(sender)
+    os.close(receiver)
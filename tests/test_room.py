@@ -0,0 +1,392 @@
+from __future__ import annotations
+
+import math
+from functools import partial
+
+import pytest
+from anyio import (
+    EndOfStream,
+    Event,
+    create_memory_object_stream,
+    create_task_group,
+    fail_after,
+    sleep,
+    wait_all_tasks_blocked,
+)
+from pycrdt import (
+    Awareness,
+    Doc,
+    Text,
+    YMessageType,
+    YSyncMessageType,
+    create_awareness_message,
+    create_sync_message,
+    create_update_message,
+    handle_sync_message,
+    read_message,
+)
+
+from wiredb import AsyncChannel, Room, RoomManager
+from wiredb.metrics import Metrics
+from wiredb.server import SYNC_CACHE_SIZE
+
+pytestmark = pytest.mark.anyio
+
+
+class TestChannel(AsyncChannel):
+    __test__ = False
+
+    def __init__(self, blocked: bool = False) -> None:
+        self.send_stream, self._receive_stream = create_memory_object_stream[bytes](
+            max_buffer_size=math.inf
+        )
+        self.doc: Doc = Doc()
+        self.messages: list[bytes] = []
+        self._unblocked = Event()
+        if not blocked:
+            self._unblocked.set()
+
+    @property
+    def id(self) -> str:
+        return ""  # pragma: nocover
+
+    def block(self) -> None:
+        self._unblocked = Event()
+
+    def unblock(self) -> None:
+        self._unblocked.set()
+
+    async def __anext__(self) -> bytes:
+        try:
+            return await self.receive()
+        except EndOfStream:
+            raise StopAsyncIteration()
+
+    async def send(self, message: bytes) -> None:
+        await self._unblocked.wait()
+        self.messages.append(message)
+        if message[0] == YMessageType.SYNC:
+            handle_sync_message(message[1:], self.doc)
+
+    async def receive(self) -> bytes:
+        return await self._receive_stream.receive()
+
+
+def update_messages(channel: TestChannel) -> list[bytes]:
+    return [
+        message
+        for message in channel.messages
+        if message[1] == YSyncMessageType.SYNC_UPDATE
+    ]
+
+
+@pytest.mark.parametrize("slow_client_policy", ["drop", "coalesce", "resync"])
+async def test_slow_client(slow_client_policy) -> None:
+    async with Room(
+        "", max_queue_size=2, slow_client_policy=slow_client_policy
+    ) as room:
+        async with create_task_group() as tg:
+            fast_channel = TestChannel()
+            slow_channel = TestChannel()
+            await tg.start(room.serve, fast_channel)
+            await tg.start(room.serve, slow_channel)
+            slow_channel.block()
+            text = room.doc.get("text", type=Text)
+            for i in range(10):
+                text += str(i)
+                await wait_all_tasks_blocked()
+            assert len(update_messages(fast_channel)) == 10
+            assert str(fast_channel.doc.get("text", type=Text)) == "0123456789"
+            slow_channel.unblock()
+            await wait_all_tasks_blocked()
+            slow_text = str(slow_channel.doc.get("text", type=Text))
+            if slow_client_policy == "drop":
+                assert slow_channel not in room._clients
+                assert slow_text == ""
+            else:
+                assert slow_channel in room._clients
+                assert len(update_messages(slow_channel)) < 10
+                assert slow_text == "0123456789"
+            tg.cancel_scope.cancel()
+
+
+def test_max_queue_size() -> None:
+    with pytest.raises(ValueError, match="max_queue_size must be at least 1"):
+        Room("", max_queue_size=0)
+
+
+async def test_no_echo() -> None:
+    async with Room("") as room:
+        async with create_task_group() as tg:
+            channel0 = TestChannel()
+            channel1 = TestChannel()
+            await tg.start(room.serve, channel0)
+            await tg.start(room.serve, channel1)
+            doc: Doc = Doc()
+            text = doc.get("text", type=Text)
+            text += "Hello"
+            await channel0.send_stream.send(create_update_message(doc.get_update()))
+            await wait_all_tasks_blocked()
+            assert str(room.doc.get("text", type=Text)) == "Hello"
+            assert update_messages(channel0) == []
+            assert len(update_messages(channel1)) == 1
+            assert str(channel1.doc.get("text", type=Text)) == "Hello"
+            tg.cancel_scope.cancel()
+
+
+@pytest.mark.parametrize("coalesce_size", [None, 1])
+async def test_coalesce(coalesce_size) -> None:
+    async with Room("", coalesce_window=0.1, coalesce_size=coalesce_size) as room:
+        async with create_task_group() as tg:
+            channel0 = TestChannel()
+            channel1 = TestChannel()
+            await tg.start(room.serve, channel0)
+            await tg.start(room.serve, channel1)
+            text = channel0.doc.get("text", type=Text)
+            text += "Hello"
+            update = channel0.doc.get_update()
+            await channel0.send_stream.send(create_update_message(update))
+            room_text = room.doc.get("text", type=Text)
+            while str(room_text) != "Hello":
+                await sleep(0.01)
+            room_text += ", World!"
+            with fail_after(1):
+                while len(update_messages(channel1)) < 1:
+                    await sleep(0.01)
+            await sleep(0.2)
+            if coalesce_size is None:
+                assert len(update_messages(channel0)) == 1
+                assert len(update_messages(channel1)) == 1
+            else:
+                assert len(update_messages(channel0)) == 1
+                assert len(update_messages(channel1)) == 2
+            assert str(text) == "Hello, World!"
+            assert str(channel1.doc.get("text", type=Text)) == "Hello, World!"
+            tg.cancel_scope.cancel()
+
+
+async def test_sync_cache() -> None:
+    async with Room("") as room:
+        async with create_task_group() as tg:
+            channels = [TestChannel() for i in range(3)]
+            for channel in channels[:2]:
+                await tg.start(room.serve, channel)
+                await channel.send_stream.send(create_sync_message(channel.doc))
+                await wait_all_tasks_blocked()
+            assert channels[0].messages == channels[1].messages
+            assert room._sync_step1 is not None
+            assert len(room._sync_step2) == 1
+            text = room.doc.get("text", type=Text)
+            text += "Hello"
+            assert room._sync_step1 is None
+            assert room._sync_step2 == {}
+            await tg.start(room.serve, channels[2])
+            await channels[2].send_stream.send(create_sync_message(channels[2].doc))
+            await wait_all_tasks_blocked()
+            assert str(channels[2].doc.get("text", type=Text)) == "Hello"
+            assert len(room._sync_step2) == 1
+            tg.cancel_scope.cancel()
+
+
+async def test_sync_cache_size() -> None:
+    async with Room("") as room:
+        async with create_task_group() as tg:
+            channel = TestChannel()
+            await tg.start(room.serve, channel)
+            text = room.doc.get("text", type=Text)
+            text += "Hello"
+            await wait_all_tasks_blocked()
+            for i in range(SYNC_CACHE_SIZE + 1):
+                doc: Doc = Doc()
+                doc.get("text", type=Text).insert(0, str(i))
+                await channel.send_stream.send(create_sync_message(doc))
+            await wait_all_tasks_blocked()
+            assert len(room._sync_step2) == SYNC_CACHE_SIZE
+            tg.cancel_scope.cancel()
+
+
+async def test_room_ttl() -> None:
+    async with RoomManager(room_ttl=0.2) as room_manager:
+        async with create_task_group() as tg:
+            room = await room_manager.get_room("room")
+            channel = TestChannel()
+            await tg.start(room.serve, channel)
+            channel.send_stream.close()
+            await wait_all_tasks_blocked()
+            assert "room" in room_manager._idle_rooms
+            assert await room_manager.get_room("room") is room
+            assert "room" not in room_manager._idle_rooms
+            channel = TestChannel()
+            await tg.start(room.serve, channel)
+            channel.send_stream.close()
+            with fail_after(1):
+                while "room" in room_manager._rooms:
+                    await sleep(0.01)
+            assert "room" not in room_manager._idle_rooms
+            assert room_manager._idle_size == 0
+
+
+@pytest.mark.parametrize("max_idle", ["rooms", "size"])
+async def test_max_idle_rooms(max_idle: str, enabled_metrics: Metrics) -> None:
+    async with RoomManager(
+        room_ttl=10,
+        max_idle_rooms=1 if max_idle == "rooms" else None,
+        max_idle_size=40 if max_idle == "size" else None,
+    ) as room_manager:
+        async with create_task_group() as tg:
+            for id in ("room0", "room1"):
+                room = await room_manager.get_room(id)
+                room.doc.get("text", type=Text).insert(0, "Hello")
+                channel = TestChannel()
+                await tg.start(room.serve, channel)
+                channel.send_stream.close()
+                await wait_all_tasks_blocked()
+            assert list(room_manager._rooms) == ["room1"]
+            assert list(room_manager._idle_rooms) == ["room1"]
+            assert enabled_metrics.idle_rooms.get() == 1
+            assert enabled_metrics.rooms.get() == 1
+
+
+async def test_clean_event() -> None:
+    async with Room("") as room:
+        async with create_task_group() as tg:
+            channel = TestChannel()
+            await tg.start(room.serve, channel)
+            channel.send_stream.close()
+            await wait_all_tasks_blocked()
+            assert room._clean_event.is_set()
+            await tg.start(room.serve, TestChannel())
+            assert not room._clean_event.is_set()
+            tg.cancel_scope.cancel()
+
+
+async def test_concurrent_room_creation() -> None:
+    started = Event()
+    created = Event()
+
+    class SlowRoom(Room):
+        async def run(self, *args, **kwargs) -> None:
+            if self.id == "slow":
+                started.set()
+                await created.wait()
+            await super().run(*args, **kwargs)
+
+    async with RoomManager(room_factory=SlowRoom) as room_manager:
+        async with create_task_group() as tg:
+            rooms = []
+
+            async def get_slow_room() -> None:
+                rooms.append(await room_manager.get_room("slow"))
+
+            tg.start_soon(get_slow_room)
+            tg.start_soon(get_slow_room)
+            await started.wait()
+            fast_room = await room_manager.get_room("fast")
+            assert await room_manager.get_room("fast") is fast_room
+            assert rooms == []
+            created.set()
+            await wait_all_tasks_blocked()
+            assert len(rooms) == 2
+            assert rooms[0] is rooms[1]
+            tg.cancel_scope.cancel()
+
+
+async def test_replicate() -> None:
+    async with Room("") as room:
+        async with create_task_group() as tg:
+            peer = TestChannel()
+            await tg.start(partial(room.replicate, peer, batch_window=0.1))
+            channel = TestChannel()
+            await tg.start(room.serve, channel)
+            text = channel.doc.get("text", type=Text)
+            for i in range(3):
+                text += str(i)
+                update = channel.doc.get_update()
+                await channel.send_stream.send(create_update_message(update))
+                await sleep(0.01)
+            await sleep(0.2)
+            assert len(update_messages(peer)) == 1
+            assert str(peer.doc.get("text", type=Text)) == "012"
+            channel.send_stream.close()
+            await wait_all_tasks_blocked()
+            assert room._clean_event.is_set()
+            tg.cancel_scope.cancel()
+
+
+def awareness_messages(channel: TestChannel) -> list[bytes]:
+    return [
+        message for message in channel.messages if message[0] == YMessageType.AWARENESS
+    ]
+
+
+def apply_awareness_messages(awareness: Awareness, channel: TestChannel) -> None:
+    for message in awareness_messages(channel):
+        awareness.apply_awareness_update(read_message(message[1:]), "remote")
+
+
+async def test_awareness() -> None:
+    async with Room("", awareness_interval=0.1) as room:
+        async with create_task_group() as tg:
+            channel0 = TestChannel()
+            channel1 = TestChannel()
+            awareness0 = Awareness(channel0.doc)
+            awareness1 = Awareness(channel1.doc)
+            await tg.start(room.serve, channel0)
+            await tg.start(room.serve, channel1)
+            client_id = awareness0.client_id
+            for i in range(5):
+                awareness0.set_local_state({"cursor": i})
+                update = awareness0.encode_awareness_update([client_id])
+                await channel0.send_stream.send(create_awareness_message(update))
+                await sleep(0.01)
+            await sleep(0.2)
+            assert room.awareness.states[client_id] == {"cursor": 4}
+            assert awareness_messages(channel0) == []
+            messages = awareness_messages(channel1)
+            assert len(messages) < 5
+            for message in messages:
+                awareness1.apply_awareness_update(read_message(message[1:]), "remote")
+            assert awareness1.states[client_id] == {"cursor": 4}
+
+            # a new client receives the current awareness states
+            channel2 = TestChannel()
+            await tg.start(room.serve, channel2)
+            await wait_all_tasks_blocked()
+            assert len(awareness_messages(channel2)) == 1
+
+            # awareness states are removed when a client leaves
+            channel0.send_stream.close()
+            await sleep(0.2)
+            assert client_id not in room.awareness.states
+            message = awareness_messages(channel1)[-1]
+            awareness1.apply_awareness_update(read_message(message[1:]), "remote")
+            assert client_id not in awareness1.states
+            tg.cancel_scope.cancel()
+
+
+async def test_awareness_timeout() -> None:
+    async with Room("", awareness_interval=0.01, awareness_timeout=0.5) as room:
+        async with create_task_group() as tg:
+            channel0 = TestChannel()
+            channel1 = TestChannel()
+            awareness0 = Awareness(channel0.doc)
+            awareness1 = Awareness(channel1.doc)
+            await tg.start(room.serve, channel0)
+            await tg.start(room.serve, channel1)
+            client_id = awareness1.client_id
+            awareness1.set_local_state({"cursor": 0})
+            update = awareness1.encode_awareness_update([client_id])
+            await channel1.send_stream.send(create_awareness_message(update))
+            with fail_after(1):
+                while client_id not in awareness0.states:
+                    await sleep(0.01)
+                    apply_awareness_messages(awareness0, channel0)
+
+            # awareness states expire when a client goes silent,
+            # and the other clients are told about it
+            with fail_after(2):
+                while client_id in awareness0.states:
+                    await sleep(0.01)
+                    apply_awareness_messages(awareness0, channel0)
+            assert client_id not in room.awareness.states
+            tg.cancel_scope.cancel()
@@ -0,0 +1,74 @@
+import pytest
+from anyio import fail_after, sleep
+from pycrdt import Awareness, Doc, Text, create_awareness_message
+from wire_memory import AsyncMemoryClient, AsyncMemoryServer
+
+from wiredb import tracing
+from wiredb.tracing import SlowSpanRecorder, Tracer, get_message_type, set_tracer
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture()
+def recorder():
+    recorder = SlowSpanRecorder(threshold=0)
+    set_tracer(recorder)
+    yield recorder
+    set_tracer(Tracer())
+
+
+async def test_slow_span_recorder(recorder: SlowSpanRecorder) -> None:
+    async with AsyncMemoryServer() as server:
+        async with (
+            AsyncMemoryClient("room", server=server) as client0,
+            AsyncMemoryClient("room", server=server) as client1,
+        ):
+            text0 = client0.doc.get("text", type=Text)
+            text0 += "Hello"
+            text1 = client1.doc.get("text", type=Text)
+            with fail_after(1):
+                while str(text1) != "Hello":
+                    await sleep(0.01)
+    names = {span.name for span in recorder.spans}
+    assert names == {
+        "room.create_sync_message",
+        "room.handle_sync_message",
+        "room.broadcast",
+        "room.send",
+        "client.create_sync_message",
+        "client.handle_sync_message",
+        "client.send",
+    }
+    assert all(span.room == "room" for span in recorder.spans)
+    message_types = {
+        span.message_type for span in recorder.spans if span.name == "room.send"
+    }
+    assert message_types == {"sync_step1", "sync_step2", "sync_update"}
+    lines = recorder.dump().splitlines()
+    assert len(lines) == len(recorder.spans)
+    assert any(
+        "room.send room='room' message_type=sync_update size=" in line for line in lines
+    )
+    recorder.clear()
+    assert recorder.spans == []
+
+
+async def test_threshold() -> None:
+    recorder = SlowSpanRecorder(threshold=0.05, max_spans=2)
+    for delay in (0, 0.1, 0.1, 0.1):
+        with recorder.span("span", "room"):
+            await sleep(delay)
+    assert len(recorder.spans) == 2
+    assert all(span.duration >= 0.05 for span in recorder.spans)
+
+
+def test_default_tracer() -> None:
+    assert type(tracing.tracer) is Tracer
+    with tracing.tracer.span("span", "room"):
+        pass
+
+
+def test_message_type() -> None:
+    update = Awareness(Doc()).encode_awareness_update([])
+    assert get_message_type(create_awareness_message(update)) == "awareness"
+    assert get_message_type(bytes([2])) == "unknown"
@@ -1,19 +1,60 @@
+import sys
 import time
+import zlib
 from collections.abc import Callable
+from functools import partial
+from pathlib import Path
 
+import httpx
 import pytest
 from anyio import (
     TASK_STATUS_IGNORED,
+    BrokenResourceError,
+    Event,
+    WouldBlock,
     create_task_group,
     fail_after,
     sleep,
     sleep_forever,
 )
 from anyio.abc import TaskStatus
-from pycrdt import Doc, Text
-from wire_websocket import AsyncWebSocketClient, AsyncWebSocketServer, WebSocketClient
+from httpx_ws import AsyncWebSocketSession, WebSocketDisconnect, aconnect_ws
+from pycrdt import (
+    Doc,
+    Text,
+    TransactionEvent,
+    create_sync_message,
+    handle_sync_message,
+)
+from wire_file import AsyncFileClient
+from wire_websocket import (
+    AsyncShardedWebSocketServer,
+    AsyncWebSocketClient,
+    AsyncWebSocketMultiplexer,
+    AsyncWebSocketServer,
+    WebSocketClient,
+)
+from wire_websocket.client import HttpxAsyncWebSocket, is_connection_error
+from wire_websocket.compression import (
+    COMPRESSED,
+    COMPRESSION_SUBPROTOCOL,
+    compress_message,
+    decompress_message,
+)
+from wire_websocket.multiplex import (
+    MULTIPLEX_SUBPROTOCOL,
+    FrameType,
+    MultiplexedChannel,
+    create_frame,
+    read_frame,
+)
+from wire_websocket.sharded_server import HashRing
 
-from wiredb import Room
+from wiredb import AsyncChannel, Room
+from wiredb.metrics import Metrics
+
+if sys.version_info < (3, 11):  # pragma: nocover
+    from exceptiongroup import ExceptionGroup
 
 pytestmark = pytest.mark.anyio
 
@@ -29,6 +70,7 @@ async def test_server(free_tcp_port: int) -> None:
             ) as client1,
         ):
             assert len(server.room_manager._rooms) == 1
+            assert server.port == free_tcp_port
             text0 = client0.doc.get("text", type=Text)
             text1 = client1.doc.get("text", type=Text)
             text0 += "Hello"
@@ -148,3 +190,797 @@ def test_server_sync_client(websocket_server) -> None:
                 break
         else:
             raise TimeoutError()  # pragma: nocover
+
+
+def test_server_sync_client_compression(compressed_websocket_server) -> None:
+    host, port = compressed_websocket_server
+    with (
+        WebSocketClient(
+            host=f"http://{host}", auto_push=True, port=port, compression_threshold=10
+        ) as client0,
+        WebSocketClient(host=f"http://{host}", port=port) as client1,
+    ):
+        assert client0._channel._compression_threshold == 10
+        assert client1._channel._compression_threshold is None
+        client0.pull()
+        client1.pull()
+        text0 = client0.doc.get("text", type=Text)
+        text1 = client1.doc.get("text", type=Text)
+        text0 += "." * 1_000
+        for i in range(10):
+            time.sleep(0.1)
+            client1.pull()
+            if str(text1) == "." * 1_000:
+                break
+        else:
+            raise TimeoutError()  # pragma: nocover
+        text1 += "!"
+        client1.push()
+        for i in range(10):
+            time.sleep(0.1)
+            client0.pull()
+            if str(text0) == "." * 1_000 + "!":
+                break
+        else:
+            raise TimeoutError()  # pragma: nocover
+
+
+def test_hash_ring() -> None:
+    ring = HashRing()
+    with pytest.raises(LookupError, match="The ring has no node"):
+        ring.get("key")
+    for node in ("node0", "node1", "node2"):
+        ring.add(node)
+    assert ring.nodes == {"node0", "node1", "node2"}
+    keys = [f"key{i}" for i in range(1000)]
+    nodes = {key: ring.get(key) for key in keys}
+    assert set(nodes.values()) == {"node0", "node1", "node2"}
+    ring.remove("node1")
+    assert ring.nodes == {"node0", "node2"}
+    for key in keys:
+        if nodes[key] != "node1":
+            assert ring.get(key) == nodes[key]
+    ring.add("node3")
+    for key in keys:
+        node = ring.get(key)
+        if node != "node3" and nodes[key] != "node1":
+            assert node == nodes[key]
+
+
+async def test_sharded_server(free_tcp_port: int) -> None:
+    # find a room that moves to the worker that will be added
+    ring = HashRing()
+    for i in range(3):
+        ring.add(f"worker{i}")
+    room_id = next(
+        f"room{i}" for i in range(1000) if ring.get(f"/room{i}") == "worker2"
+    )
+    async with AsyncShardedWebSocketServer(
+        host="localhost", port=free_tcp_port, worker_nb=2
+    ) as server:
+        assert len(server.workers) == 2
+        async with (
+            AsyncWebSocketClient(
+                id=room_id, host="http://localhost", port=free_tcp_port
+            ) as client0,
+            AsyncWebSocketClient(
+                id=room_id, host="http://localhost", port=free_tcp_port
+            ) as client1,
+        ):
+            text0 = client0.doc.get("text", type=Text)
+            text1 = client1.doc.get("text", type=Text)
+            text0 += "Hello"
+            with fail_after(1):
+                while True:
+                    await sleep(0.01)
+                    if str(text1) == "Hello":
+                        break
+            assert len(server._connections[f"/{room_id}"]) == 2
+            worker = await server.add_worker()
+            assert server.get_worker(f"/{room_id}") is worker
+            with fail_after(1):
+                while f"/{room_id}" in server._connections:
+                    await sleep(0.01)
+            await server.remove_worker(worker)
+            assert len(server.workers) == 2
+        async with AsyncWebSocketClient(
+            id=room_id, host="http://localhost", port=free_tcp_port
+        ):
+            pass
+        with fail_after(1):
+            while server._connections:
+                await sleep(0.01)
+
+
+async def test_sharded_server_last_worker(free_tcp_port: int) -> None:
+    with pytest.raises(ValueError, match="worker_nb must be at least 1"):
+        AsyncShardedWebSocketServer(host="localhost", port=free_tcp_port, worker_nb=0)
+    async with AsyncShardedWebSocketServer(
+        host="localhost", port=free_tcp_port, worker_nb=1
+    ) as server:
+        (worker,) = server.workers.values()
+        with pytest.raises(RuntimeError, match="Cannot remove the last worker"):
+            await server.remove_worker(worker)
+        assert server.workers == {worker.id: worker}
+
+
+class RecordingServer(AsyncWebSocketServer):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.headers: list[list[tuple[bytes, bytes]]] = []
+
+    async def _serve(self, websocket) -> None:
+        self.headers.append(websocket.headers)
+        await super()._serve(websocket)
+
+
+async def test_sharded_server_subprotocols(
+    free_tcp_port_factory: Callable[[], int],
+) -> None:
+    port = free_tcp_port_factory()
+    worker_port = free_tcp_port_factory()
+    cookies = httpx.Cookies({"session": "secret"})
+    worker_server = RecordingServer(host="127.0.0.1", port=worker_port)
+    async with (
+        worker_server,
+        AsyncShardedWebSocketServer(
+            host="localhost", port=port, worker_nb=1, compression_threshold=10
+        ) as server,
+    ):
+        # the rooms are served in-process to record the proxied connections
+        (worker,) = server.workers.values()
+        worker.port = worker_port
+        async with (
+            AsyncWebSocketClient(
+                "room0",
+                host="http://localhost",
+                port=port,
+                cookies=cookies,
+                compression_threshold=10,
+            ) as client,
+            AsyncWebSocketMultiplexer(
+                host="http://localhost", port=port, cookies=cookies
+            ) as mux,
+            mux.client("room0") as mux_client,
+        ):
+            # the compression is negotiated with the sharded server
+            channel = client._client._channel
+            assert isinstance(channel, HttpxAsyncWebSocket)
+            assert channel._compression_threshold == 10
+            text = client.doc.get("text", type=Text)
+            mux_text = mux_client.doc.get("text", type=Text)
+            text += "." * 100
+            with fail_after(1):
+                while len(mux_text) != 100:
+                    await sleep(0.01)
+        # the cookies are forwarded to the worker
+        assert len(worker_server.headers) == 2
+        for headers in worker_server.headers:
+            assert (b"cookie", b"session=secret") in headers
+
+
+# a room running in a worker process
+class FileRoom(Room):  # pragma: nocover
+    def __init__(self, id: str, *, directory: str) -> None:
+        super().__init__(id)
+        self._directory = directory
+
+    async def run(self, *args, **kwargs) -> None:
+        await self.task_group.start(self._connect_to_file)
+        await super().run(*args, **kwargs)
+
+    async def _connect_to_file(
+        self, *, task_status: TaskStatus[None] = TASK_STATUS_IGNORED
+    ) -> None:
+        # the updates are only written when the room is closed
+        async with AsyncFileClient(
+            doc=self.doc,
+            path=Path(self._directory) / "updates.y",
+            write_delay=3600,
+            max_write_delay=3600,
+        ):
+            task_status.started()
+            await sleep_forever()
+
+
+async def test_sharded_server_stop(free_tcp_port: int, tmp_path: Path) -> None:
+    async with AsyncShardedWebSocketServer(
+        partial(FileRoom, directory=str(tmp_path)),
+        host="localhost",
+        port=free_tcp_port,
+        worker_nb=1,
+    ):
+        async with (
+            AsyncWebSocketClient(
+                host="http://localhost", port=free_tcp_port
+            ) as client0,
+            AsyncWebSocketClient(
+                host="http://localhost", port=free_tcp_port
+            ) as client1,
+        ):
+            text0 = client0.doc.get("text", type=Text)
+            text1 = client1.doc.get("text", type=Text)
+            text0 += "Hello"
+            with fail_after(1):
+                while str(text1) != "Hello":
+                    await sleep(0.01)
+    # the worker is stopped gracefully, so its room writes the pending updates
+    async with AsyncFileClient(path=tmp_path / "updates.y") as client:
+        assert str(client.doc.get("text", type=Text)) == "Hello"
+
+
+def fail_to_unpickle() -> None:  # pragma: nocover
+    raise RuntimeError("The room factory cannot be unpickled")
+
+
+class UnpicklableRoomFactory:
+    def __call__(self, id: str) -> Room:
+        return Room(id)  # pragma: nocover
+
+    def __reduce__(self):
+        return (fail_to_unpickle, ())
+
+
+async def test_sharded_server_worker_error(free_tcp_port: int) -> None:
+    with pytest.raises(
+        RuntimeError, match="Worker worker0 exited with code 1 before starting"
+    ):
+        async with AsyncShardedWebSocketServer(
+            UnpicklableRoomFactory(),
+            host="localhost",
+            port=free_tcp_port,
+            worker_nb=1,
+        ):
+            pass  # pragma: nocover
+
+
+async def test_replication(free_tcp_port_factory: Callable[[], int]) -> None:
+    port0 = free_tcp_port_factory()
+    port1 = free_tcp_port_factory()
+    port2 = free_tcp_port_factory()
+
+    class ReplicatedRoom(Room):
+        async def run(self, *args, **kwargs) -> None:
+            await self.task_group.start(self._replicate)
+            await super().run(*args, **kwargs)
+
+        async def _replicate(
+            self, *, task_status: TaskStatus[None] = TASK_STATUS_IGNORED
+        ) -> None:
+            ws: AsyncWebSocketSession
+            async with aconnect_ws(
+                f"http://localhost:{port0}{self.id}",
+                keepalive_ping_interval_seconds=None,
+            ) as ws:
+                await self.replicate(
+                    HttpxAsyncWebSocket(ws, self.id), task_status=task_status
+                )
+
+    async with (
+        AsyncWebSocketServer(host="localhost", port=port0) as server0,
+        AsyncWebSocketServer(
+            room_factory=ReplicatedRoom, host="localhost", port=port1
+        ) as server1,
+        AsyncWebSocketServer(
+            room_factory=ReplicatedRoom, host="localhost", port=port2
+        ) as server2,
+    ):
+        async with (
+            AsyncWebSocketClient(host="http://localhost", port=port1) as client1,
+            AsyncWebSocketClient(host="http://localhost", port=port2) as client2,
+        ):
+            text1 = client1.doc.get("text", type=Text)
+            text2 = client2.doc.get("text", type=Text)
+            text1 += "Hello"
+            with fail_after(1):
+                while str(text2) != "Hello":
+                    await sleep(0.01)
+            text2 += ", World!"
+            with fail_after(1):
+                while str(text1) != "Hello, World!":
+                    await sleep(0.01)
+            room0 = server0.room_manager._rooms["/"]
+            assert str(room0.doc.get("text", type=Text)) == "Hello, World!"
+            assert len(room0._clients) == 2
+        with fail_after(1):
+            while (
+                server0.room_manager._rooms
+                or server1.room_manager._rooms
+                or server2.room_manager._rooms
+            ):
+                await sleep(0.01)
+
+
+async def test_metrics(free_tcp_port: int, enabled_metrics: Metrics) -> None:
+    # serving the metrics enables them until the server exits
+    enabled_metrics.enabled = False
+    async with AsyncWebSocketServer(
+        host="localhost", port=free_tcp_port, metrics_path="/metrics"
+    ):
+        assert enabled_metrics.enabled
+        async with AsyncWebSocketClient(
+            host="http://localhost", port=free_tcp_port
+        ) as client:
+            await client.synchronized.wait()
+        async with httpx.AsyncClient() as http_client:
+            url = f"http://localhost:{free_tcp_port}"
+            response = await http_client.get(f"{url}/metrics")
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/plain")
+            assert "# TYPE wiredb_messages_total counter" in response.text
+            assert 'wiredb_messages_total{side="client"' in response.text
+            response = await http_client.get(f"{url}/other")
+            assert response.status_code == 404
+    assert not enabled_metrics.enabled
+
+
+async def test_reconnect(free_tcp_port: int) -> None:
+    async def run_server(stop_event: Event, *, task_status: TaskStatus[None]) -> None:
+        async with AsyncWebSocketServer(host="localhost", port=free_tcp_port):
+            task_status.started()
+            await stop_event.wait()
+
+    states: list[str] = []
+    async with create_task_group() as tg:
+        stop_event = Event()
+        await tg.start(run_server, stop_event)
+        async with AsyncWebSocketClient(
+            host="http://localhost",
+            port=free_tcp_port,
+            reconnect=True,
+            reconnect_delay=0.01,
+            max_reconnect_delay=0.1,
+        ) as client0:
+            assert client0.connection_state == "connected"
+            client0.observe_connection(states.append)
+            awareness = client0.awareness
+            awareness_changes: list[str] = []
+            awareness.observe(lambda topic, changes: awareness_changes.append(topic))
+            awareness.set_local_state({"user": "foo"})
+            text0 = client0.doc.get("text", type=Text)
+            text0 += "Hello"
+            await sleep(0.1)
+            # the server closes the connections after its graceful shutdown timeout
+            stop_event.set()
+            with fail_after(5):
+                while True:
+                    await sleep(0.01)
+                    if client0.connection_state != "connected":
+                        break
+            # edited while disconnected
+            text0 += ", World!"
+            stop_event = Event()
+            await tg.start(run_server, stop_event)
+            with fail_after(5):
+                while True:
+                    await sleep(0.01)
+                    if client0.connection_state == "connected":
+                        break
+            # the awareness and its observers survive the reconnection
+            assert client0.awareness is awareness
+            awareness_changes.clear()
+            awareness.set_local_state({"user": "foo"})
+            assert awareness_changes == ["update"]
+            async with AsyncWebSocketClient(
+                host="http://localhost", port=free_tcp_port
+            ) as client1:
+                text1 = client1.doc.get("text", type=Text)
+                with fail_after(1):
+                    while True:
+                        await sleep(0.01)
+                        if str(text1) == "Hello, World!" and {"user": "foo"} in (
+                            client1.awareness.states.values()
+                        ):
+                            break
+            client0.unobserve_connection(states.append)
+        stop_event.set()
+    assert states[:2] == ["disconnected", "connecting"]
+    assert states[-1] == "connected"
+
+
+async def test_reconnect_error(
+    free_tcp_port: int, caplog: pytest.LogCaptureFixture
+) -> None:
+    async def run_server(stop_event: Event, *, task_status: TaskStatus[None]) -> None:
+        async with AsyncWebSocketServer(host="localhost", port=free_tcp_port):
+            task_status.started()
+            await stop_event.wait()
+
+    async def start_server_after_error(stop_event: Event) -> None:
+        # the connection errors are logged until the server is started
+        with fail_after(5):
+            while "reconnecting" not in caplog.text:
+                await sleep(0.01)
+        await tg.start(run_server, stop_event)
+
+    async with create_task_group() as tg:
+        stop_event = Event()
+        tg.start_soon(start_server_after_error, stop_event)
+        async with AsyncWebSocketClient(
+            host="http://localhost",
+            port=free_tcp_port,
+            reconnect=True,
+            reconnect_delay=0.01,
+            max_reconnect_delay=0.1,
+        ) as client:
+            assert client.connection_state == "connected"
+        stop_event.set()
+    records = [
+        record for record in caplog.records if record.name == "wire_websocket.client"
+    ]
+    assert records[0].levelname == "WARNING"
+    assert "ConnectError" in caplog.text
+
+
+def test_is_connection_error() -> None:
+    assert is_connection_error(httpx.ConnectError("error"))
+    assert is_connection_error(
+        ExceptionGroup("errors", [WebSocketDisconnect(), OSError()])
+    )
+    assert not is_connection_error(RuntimeError())
+    assert not is_connection_error(
+        ExceptionGroup("errors", [WebSocketDisconnect(), RuntimeError()])
+    )
+
+
+async def test_connection_error(free_tcp_port: int) -> None:
+    with pytest.raises(Exception) as excinfo:
+        async with AsyncWebSocketClient(host="http://localhost", port=free_tcp_port):
+            pass  # pragma: nocover
+    assert excinfo.group_contains(httpx.ConnectError)
+
+
+async def test_cache(free_tcp_port: int, tmp_path, enabled_metrics) -> None:
+    async with AsyncWebSocketServer(host="localhost", port=free_tcp_port):
+        async with AsyncWebSocketClient(
+            host="http://localhost", port=free_tcp_port
+        ) as client0:
+            text0 = client0.doc.get("text", type=Text)
+            async with AsyncWebSocketClient(
+                host="http://localhost", port=free_tcp_port, cache_dir=tmp_path
+            ) as client1:
+                text1 = client1.doc.get("text", type=Text)
+                text1 += "." * 10_000
+                with fail_after(1):
+                    while True:
+                        await sleep(0.01)
+                        if len(text0) == 10_000:
+                            break
+            text0 += "!"
+            await sleep(0.1)
+            sent_byte_nb = enabled_metrics.bytes.get("room", "/", "out")
+            async with AsyncWebSocketClient(
+                host="http://localhost", port=free_tcp_port, cache_dir=tmp_path
+            ) as client2:
+                text2 = client2.doc.get("text", type=Text)
+                with fail_after(1):
+                    while True:
+                        await sleep(0.01)
+                        if str(text2) == "." * 10_000 + "!":
+                            break
+                # only the update made since the last session was sent
+                sent_byte_nb = (
+                    enabled_metrics.bytes.get("room", "/", "out") - sent_byte_nb
+                )
+                assert sent_byte_nb < 1_000
+
+
+def test_frame() -> None:
+    frame = create_frame(FrameType.MESSAGE, 300, b"message")
+    assert read_frame(frame) == (FrameType.MESSAGE, 300, b"message")
+    # empty, unknown type, missing index, truncated index
+    for frame in (b"", b"\x03\x00", b"\x02", b"\x02\x80"):
+        with pytest.raises(ValueError, match="Invalid frame"):
+            read_frame(frame)
+
+
+async def test_batched_pull(free_tcp_port: int) -> None:
+    async with (
+        AsyncWebSocketServer(host="localhost", port=free_tcp_port),
+        AsyncWebSocketClient(host="http://localhost", port=free_tcp_port) as client0,
+        AsyncWebSocketClient(
+            auto_pull=False, host="http://localhost", port=free_tcp_port
+        ) as client1,
+    ):
+        client1.pull()
+        await client0.synchronized.wait()
+        await client1.synchronized.wait()
+        text0 = client0.doc.get("text", type=Text)
+        text1 = client1.doc.get("text", type=Text)
+        events: list[TransactionEvent] = []
+        client1.doc.observe(events.append)
+        channel = client1._client._channel
+        assert isinstance(channel, HttpxAsyncWebSocket)
+        assert channel._buffer is not None
+        # the first update is received by the client, which waits to pull it
+        text0 += "0"
+        await sleep(0.1)
+        for i in range(1, 10):
+            text0 += str(i)
+            # the next updates are read in advance from the WebSocket
+            with fail_after(1):
+                while len(channel._buffer._messages) < i:
+                    await sleep(0.01)
+        assert str(text1) == ""
+        client1.pull()
+        with fail_after(1):
+            while str(text1) != "0123456789":
+                await sleep(0.01)
+        # the updates are applied in a single transaction
+        assert len(events) == 1
+        ws: AsyncWebSocketSession
+        async with aconnect_ws(
+            f"http://localhost:{free_tcp_port}",
+            keepalive_ping_interval_seconds=None,
+        ) as ws:
+            # without a task group, the messages are not read in advance
+            with pytest.raises(WouldBlock):
+                HttpxAsyncWebSocket(ws, "").receive_nowait()
+
+
+async def test_multiplexer(free_tcp_port: int) -> None:
+    async with (
+        AsyncWebSocketServer(host="localhost", port=free_tcp_port) as server,
+        AsyncWebSocketMultiplexer(host="http://localhost", port=free_tcp_port) as mux,
+        AsyncWebSocketClient(
+            "room0", host="http://localhost", port=free_tcp_port
+        ) as client0,
+        AsyncWebSocketClient(
+            "room1", host="http://localhost", port=free_tcp_port
+        ) as client1,
+    ):
+        async with (
+            mux.client("room0") as mux_client0,
+            mux.client(
+                "room1",
+                awareness_interval=0.1,
+                push_interval=0.01,
+                max_push_delay=0.1,
+                max_push_size=2**10,
+                max_pull_size=2**10,
+            ) as mux_client1,
+        ):
+            # the options are forwarded to the client
+            async_client = mux_client1._client
+            assert async_client._awareness_interval == 0.1
+            assert async_client._push_interval == 0.01
+            assert async_client._max_push_delay == 0.1
+            assert async_client._max_push_size == async_client._max_pull_size == 2**10
+            await mux_client0.synchronized.wait()
+            await mux_client1.synchronized.wait()
+            assert set(server.room_manager._rooms) == {"/room0", "/room1"}
+            for client, mux_client in ((client0, mux_client0), (client1, mux_client1)):
+                text = client.doc.get("text", type=Text)
+                mux_text = mux_client.doc.get("text", type=Text)
+                text += f"Hello {client._id}"
+                with fail_after(1):
+                    while True:
+                        await sleep(0.01)
+                        if str(mux_text) == f"Hello {client._id}":
+                            break
+                mux_text += "!"
+                with fail_after(1):
+                    while True:
+                        await sleep(0.01)
+                        if str(text) == f"Hello {client._id}!":
+                            break
+            room0 = server.room_manager._rooms["/room0"]
+            assert len(room0._clients) == 2
+        # the multiplexed clients unsubscribed
+        with fail_after(1):
+            while True:
+                await sleep(0.01)
+                if len(room0._clients) == 1:
+                    break
+
+
+async def test_multiplexer_invalid_frame(free_tcp_port: int) -> None:
+    ws: AsyncWebSocketSession
+    async with (
+        AsyncWebSocketServer(host="localhost", port=free_tcp_port) as server,
+        aconnect_ws(
+            f"http://localhost:{free_tcp_port}",
+            keepalive_ping_interval_seconds=None,
+            subprotocols=[MULTIPLEX_SUBPROTOCOL],
+        ) as ws,
+    ):
+        await ws.send_bytes(b"")
+        await ws.send_bytes(b"\x03\x00")
+        # a room ID which is not UTF-8
+        await ws.send_bytes(create_frame(FrameType.SUBSCRIBE, 0, b"\xff"))
+        # the invalid frames are dropped, and the connection keeps serving rooms
+        await ws.send_bytes(create_frame(FrameType.SUBSCRIBE, 1, b"/room0"))
+        await ws.send_bytes(
+            create_frame(FrameType.MESSAGE, 1, create_sync_message(Doc()))
+        )
+        with fail_after(1):
+            frame_type, index, payload = read_frame(await ws.receive_bytes())
+        assert (frame_type, index) == (FrameType.MESSAGE, 1)
+        assert set(server.room_manager._rooms) == {"/room0"}
+
+
+async def test_multiplexer_receives_invalid_frame(free_tcp_port: int) -> None:
+    server = AsyncWebSocketServer(host="localhost", port=free_tcp_port)
+    app = server._app
+
+    async def invalid_frame_app(scope, receive, send) -> None:
+        if scope["type"] != "websocket":
+            return await app(scope, receive, send)
+        await receive()
+        await send({"type": "websocket.accept", "subprotocol": MULTIPLEX_SUBPROTOCOL})
+        # once the client subscribes to the room, an invalid frame is sent
+        # before a message of the room
+        await receive()
+        await send({"type": "websocket.send", "bytes": b""})
+        frame = create_frame(FrameType.MESSAGE, 0, b"message")
+        await send({"type": "websocket.send", "bytes": frame})
+        await receive()
+
+    server._app = invalid_frame_app  # type: ignore[assignment]
+    async with (
+        server,
+        AsyncWebSocketMultiplexer(host="http://localhost", port=free_tcp_port) as mux,
+    ):
+        channel = await mux._subscribe("room0")
+        with fail_after(1):
+            assert await channel.receive() == b"message"
+
+
+class StalledServer(AsyncWebSocketServer):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.channels: list[AsyncChannel] = []
+        self.stopped = Event()
+
+    async def _serve(self, websocket: AsyncChannel) -> None:
+        # the messages of the room are not received until the server is stopped
+        self.channels.append(websocket)
+        await self.stopped.wait()
+
+
+async def test_multiplexer_overflow(free_tcp_port: int) -> None:
+    server = StalledServer(
+        host="localhost",
+        port=free_tcp_port,
+        max_buffer_size=1,
+        overflow_policy="drop",
+    )
+    ws: AsyncWebSocketSession
+    async with (
+        server,
+        aconnect_ws(
+            f"http://localhost:{free_tcp_port}",
+            keepalive_ping_interval_seconds=None,
+            subprotocols=[MULTIPLEX_SUBPROTOCOL],
+        ) as ws,
+    ):
+        await ws.send_bytes(create_frame(FrameType.SUBSCRIBE, 0, b"/room0"))
+        for i in range(2):
+            await ws.send_bytes(create_frame(FrameType.MESSAGE, 0, b"message"))
+        await ws.send_bytes(create_frame(FrameType.SUBSCRIBE, 1, b"/room1"))
+        with fail_after(1):
+            while len(server.channels) < 2:
+                await sleep(0.01)
+        channel0, channel1 = server.channels
+        assert isinstance(channel0, MultiplexedChannel)
+        assert isinstance(channel1, MultiplexedChannel)
+        # only the channel of the room whose buffer overflowed is closed
+        with pytest.raises(BrokenResourceError):
+            await channel0.send(b"message")
+        assert not channel1._buffer.closed
+        server.stopped.set()
+
+
+async def test_multiplexer_closed(free_tcp_port: int) -> None:
+    async with (
+        AsyncWebSocketServer(host="localhost", port=free_tcp_port) as server,
+        AsyncWebSocketMultiplexer(host="http://localhost", port=free_tcp_port) as mux,
+    ):
+        async with mux.client("room0") as mux_client:
+            await mux_client.synchronized.wait()
+            room = server.room_manager._rooms["/room0"]
+            await mux._websocket._websocket.close()
+            # the room's client is removed
+            with fail_after(1):
+                while True:
+                    await sleep(0.01)
+                    if len(room._clients) == 0:
+                        break
+            with pytest.raises(BrokenResourceError):
+                await mux_client._channel.send(b"message")
+
+
+def test_compress_message() -> None:
+    message = b"\x00" + b"." * 1_000
+    compressed = compress_message(message, 100)
+    assert compressed[0] == COMPRESSED
+    assert len(compressed) < 100
+    assert decompress_message(compressed) == message
+    # small messages are sent raw
+    assert compress_message(message[:10], 100) == message[:10]
+    assert decompress_message(message[:10]) == message[:10]
+    # decompressed messages are limited in size
+    with pytest.raises(ValueError):
+        decompress_message(compressed, 100)
+    with pytest.raises(ValueError):
+        decompress_message(compressed[:-1])
+
+
+async def test_compression(free_tcp_port: int) -> None:
+    async with (
+        AsyncWebSocketServer(
+            host="localhost", port=free_tcp_port, compression_threshold=100
+        ),
+        AsyncWebSocketClient(
+            host="http://localhost", port=free_tcp_port, compression_threshold=100
+        ) as client0,
+        AsyncWebSocketClient(host="http://localhost", port=free_tcp_port) as client1,
+    ):
+        text0 = client0.doc.get("text", type=Text)
+        text1 = client1.doc.get("text", type=Text)
+        text0 += "." * 10_000
+        with fail_after(1):
+            while True:
+                await sleep(0.01)
+                if len(text1) == 10_000:
+                    break
+        ws: AsyncWebSocketSession
+        async with aconnect_ws(
+            f"http://localhost:{free_tcp_port}",
+            keepalive_ping_interval_seconds=None,
+            subprotocols=[COMPRESSION_SUBPROTOCOL],
+        ) as ws:
+            assert ws.subprotocol == COMPRESSION_SUBPROTOCOL
+            await ws.send_bytes(create_sync_message(Doc()))
+            # the document is sent compressed
+            with fail_after(1):
+                while True:
+                    message = await ws.receive_bytes()
+                    if message[0] == COMPRESSED:
+                        break
+            assert len(message) < 1_000
+            doc: Doc = Doc()
+            text = doc.get("text", type=Text)
+            handle_sync_message(decompress_message(message)[1:], doc)
+            assert str(text) == "." * 10_000
+
+
+async def test_compression_max_message_size(free_tcp_port: int) -> None:
+    async with AsyncWebSocketServer(
+        host="localhost",
+        port=free_tcp_port,
+        compression_threshold=100,
+        max_message_size=10_000,
+    ):
+        ws: AsyncWebSocketSession
+        async with aconnect_ws(
+            f"http://localhost:{free_tcp_port}",
+            keepalive_ping_interval_seconds=None,
+            subprotocols=[COMPRESSION_SUBPROTOCOL],
+        ) as ws:
+            # a small message which decompresses to a big one
+            await ws.send_bytes(bytes([COMPRESSED]) + zlib.compress(bytes(1_000_000)))
+            # the server closes the connection
+            with fail_after(1):
+                with pytest.raises(WebSocketDisconnect) as excinfo:
+                    while True:
+                        await ws.receive_bytes()
+            assert excinfo.value.code == 1009
+
+
+async def test_compression_not_supported(free_tcp_port: int) -> None:
+    async with (
+        AsyncWebSocketServer(host="localhost", port=free_tcp_port),
+        AsyncWebSocketClient(
+            host="http://localhost", port=free_tcp_port, compression_threshold=100
+        ) as client0,
+        AsyncWebSocketClient(host="http://localhost", port=free_tcp_port) as client1,
+    ):
+        text0 = client0.doc.get("text", type=Text)
+        text1 = client1.doc.get("text", type=Text)
+        text0 += "." * 10_000
+        with fail_after(1):
+            while True:
+                await sleep(0.01)
+                if len(text1) == 10_000:
+                    break
@@ -1,23 +1,28 @@
 from __future__ import annotations
 
+import os
 import sys
 from contextlib import AsyncExitStack, ExitStack
 from io import FileIO
 from pathlib import Path
 from types import TracebackType
+from typing import Literal
 
 import anyio
 from anyio import (
     TASK_STATUS_IGNORED,
     CancelScope,
+    Event,
     Lock,
-    create_memory_object_stream,
     create_task_group,
+    current_time,
+    move_on_after,
     open_file,
     sleep,
+    to_process,
+    to_thread,
 )
 from anyio.abc import TaskGroup, TaskStatus
-from anyio.streams.memory import MemoryObjectReceiveStream, MemoryObjectSendStream
 from pycrdt import (
     Decoder,
     Doc,
@@ -25,6 +30,8 @@ from pycrdt import (
     YSyncMessageType,
     create_sync_message,
     handle_sync_message,
+    merge_updates,
+    read_message,
     write_message,
 )
 
@@ -35,13 +42,25 @@ from wiredb import (
     Channel,
     Client,
     ClientMixin,
+    MessageBuffer,
 )
+from wiredb.buffer import OverflowPolicy
+from wiredb.metrics import metrics
 
 if sys.version_info >= (3, 11):
     pass
 else:  # pragma: nocover
     pass
 
+FsyncPolicy = Literal["never", "batch", "interval"]
+
+# the previous file format, which is only a log of updates,
+# and which is migrated to the current one when a file is opened
+LEGACY_VERSION = "0.0.1"
+# the size of the index following the version of a file, which holds the size
+# of the snapshot of the document
+INDEX_SIZE = 8
+
 
 class FileClient(ClientMixin):
     def __init__(
@@ -53,14 +72,18 @@ class FileClient(ClientMixin):
         path: Path | str,
         write_delay: float = 0,
         squash: bool = False,
+        max_push_size: int | None = None,
+        max_pull_size: int | None = None,
     ) -> None:
         self._id = id
         self._doc = doc
         self._auto_push = auto_push
+        self._max_push_size = max_push_size
+        self._max_pull_size = max_pull_size
         self._path: Path = Path(path)
         self._write_delay = write_delay
         self._squash = squash
-        self._version = "0.0.1"
+        self._version = "0.0.2"
         self._lock = Lock()
 
     @property
@@ -70,31 +93,30 @@ class FileClient(ClientMixin):
     def __enter__(self) -> FileClient:
         with ExitStack() as exit_stack:
             file_doc: Doc = Doc()
-            size = len(self._version) + 1
+            size = len(create_file(self._version))
             if file_exists := self._path.exists():
-                file_version, messages = read_file(self._path)
-                if file_version != self._version:  # pragma: nocover
+                file_version, data = read_file(self._path)
+                if file_version not in (
+                    self._version,
+                    LEGACY_VERSION,
+                ):  # pragma: nocover
                     raise RuntimeError(
                         f'File version mismatch (got "{file_version}", expected "{self._version}")'
                     )
-                size += len(messages)
-                decoder = Decoder(messages)
-                while True:
-                    update = decoder.read_message()
-                    if not update:
-                        break
-                    file_doc.apply_update(update)
+                size = len(file_version) + 1 + len(data)
+                snapshot, updates = read_updates(file_version, data)
+                apply_updates(file_doc, snapshot, updates)
             sync_message = create_sync_message(file_doc)
-            self._file = exit_stack.enter_context(
-                open(self._path, mode="a+b", buffering=0)
-            )
             if not file_exists:
-                write_file(self._file, self._version.encode() + bytes([0]))
-            elif self._squash:  # pragma: nocover
-                squash_file(self._file)
+                replace_file(self._path, create_file(self._version))
+            elif self._squash or file_version != self._version:
+                # the file is squashed or migrated to the current format
+                data = create_file(self._version, file_doc.get_update())
+                replace_file(self._path, data)
+                size = len(data)
             message_list = [sync_message]
             channel = File(
-                self._file,
+                open(self._path, mode="a+b", buffering=0),
                 self._id,
                 file_doc,
                 self._write_delay,
@@ -102,9 +124,17 @@ class FileClient(ClientMixin):
                 self._squash,
                 self._version,
                 message_list=message_list,
+                file_path=self._path,
             )
+            exit_stack.callback(channel.close)
             self._client = exit_stack.enter_context(
-                Client(channel, self._doc, self._auto_push)
+                Client(
+                    channel,
+                    self._doc,
+                    self._auto_push,
+                    max_push_size=self._max_push_size,
+                    max_pull_size=self._max_pull_size,
+                )
             )
             self._exit_stack = exit_stack.pop_all()
         return self
@@ -128,16 +158,47 @@ class AsyncFileClient(AsyncClientMixin):
         *,
         path: Path | str,
         write_delay: float = 0,
+        max_write_delay: float | None = None,
+        max_write_updates: int | None = None,
+        max_write_bytes: int | None = None,
         squash: bool = False,
+        compaction_ratio: float | None = None,
+        min_compaction_bytes: int = 2**16,
+        fsync_policy: FsyncPolicy = "never",
+        fsync_interval: float = 1,
+        max_buffer_size: int | None = None,
+        max_buffer_bytes: int | None = None,
+        overflow_policy: OverflowPolicy = "block",
+        push_interval: float = 0,
+        max_push_delay: float | None = None,
+        max_push_size: int | None = None,
+        max_pull_size: int | None = None,
     ) -> None:
         self._id = id
         self._doc = doc
         self._auto_push = auto_push
+        self._push_interval = push_interval
+        self._max_push_delay = max_push_delay
+        self._max_push_size = max_push_size
+        self._max_pull_size = max_pull_size
         self._auto_pull = auto_pull
+        self._max_buffer_size = max_buffer_size
+        self._max_buffer_bytes = max_buffer_bytes
+        self._overflow_policy = overflow_policy
         self._path: Path = Path(path)
         self._write_delay = write_delay
+        # an update waits for at most ten write delays by default
+        self._max_write_delay = (
+            10 * write_delay if max_write_delay is None else max_write_delay
+        )
+        self._max_write_updates = max_write_updates
+        self._max_write_bytes = max_write_bytes
         self._squash = squash
-        self._version = "0.0.1"
+        self._compaction_ratio = compaction_ratio
+        self._min_compaction_bytes = min_compaction_bytes
+        self._fsync_policy = fsync_policy
+        self._fsync_interval = fsync_interval
+        self._version = "0.0.2"
         self._lock = Lock()
 
     @property
@@ -148,54 +209,79 @@ class AsyncFileClient(AsyncClientMixin):
         async with AsyncExitStack() as exit_stack:
             path = anyio.Path(self._path)
             file_doc: Doc = Doc()
-            size = len(self._version) + 1
+            size = len(create_file(self._version))
+            snapshot_size = 0
             if file_exists := await path.exists():
-                file_version, messages = await aread_file(path, self._lock)
-                if file_version != self._version:
+                file_version, data = await aread_file(path, self._lock)
+                if file_version not in (self._version, LEGACY_VERSION):
                     raise RuntimeError(
                         f'File version mismatch (got "{file_version}", expected "{self._version}")'
                     )
-                size += len(messages)
-                decoder = Decoder(messages)
-                while True:
-                    update = decoder.read_message()
-                    if not update:
-                        break
-                    file_doc.apply_update(update)
+                size = len(file_version) + 1 + len(data)
+                snapshot, updates = read_updates(file_version, data)
+                snapshot_size = len(snapshot)
+                apply_updates(file_doc, snapshot, updates)
             async with file_doc.new_transaction():
                 sync_message = create_sync_message(file_doc)
-            self._file = await exit_stack.enter_async_context(
-                await open_file(path, mode="a+b", buffering=0)
-            )
             if not file_exists:
                 with CancelScope(shield=True):
-                    await awrite_file(
-                        self._file, self._version.encode() + bytes([0]), self._lock
-                    )
-            elif self._squash:
-                await asquash_file(self._file, self._lock)
-            send_stream, receive_stream = create_memory_object_stream[bytes](
-                max_buffer_size=float("inf")
+                    await areplace_file(path, create_file(self._version))
+            elif self._squash or file_version != self._version:
+                # the file is squashed or migrated to the current format
+                async with file_doc.new_transaction():
+                    snapshot = file_doc.get_update()
+                data = create_file(self._version, snapshot)
+                with CancelScope(shield=True):
+                    await areplace_file(path, data)
+                snapshot_size = len(snapshot)
+                size = len(data)
+            buffer = await exit_stack.enter_async_context(
+                MessageBuffer(
+                    self._max_buffer_size,
+                    self._max_buffer_bytes,
+                    self._overflow_policy,
+                )
             )
-            send_stream = await exit_stack.enter_async_context(send_stream)
-            receive_stream = await exit_stack.enter_async_context(receive_stream)
             self._task_group = await exit_stack.enter_async_context(create_task_group())
-            await send_stream.send(sync_message)
+            await buffer.send(sync_message)
             channel = AsyncFile(
-                self._file,
+                await open_file(path, mode="a+b", buffering=0),
                 self._id,
                 file_doc,
                 self._write_delay,
                 size,
                 self._squash,
                 self._version,
-                send_stream=send_stream,
-                receive_stream=receive_stream,
+                buffer=buffer,
                 task_group=self._task_group,
                 lock=self._lock,
+                max_write_delay=self._max_write_delay,
+                max_write_updates=self._max_write_updates,
+                max_write_bytes=self._max_write_bytes,
+                compaction_ratio=self._compaction_ratio,
+                min_compaction_bytes=self._min_compaction_bytes,
+                snapshot_size=snapshot_size,
+                file_path=path,
+                fsync_policy=self._fsync_policy,
+                fsync_interval=self._fsync_interval,
             )
+            exit_stack.push_async_callback(channel.aclose)
+            await self._task_group.start(channel._run_writer)
+            if self._fsync_policy == "interval":
+                await self._task_group.start(channel._run_fsync)
+            # the pending updates are written when the client exits
+            exit_stack.push_async_callback(channel._flush)
             self._client = await exit_stack.enter_async_context(
-                AsyncClient(channel, self._doc, self._auto_push, self._auto_pull)
+                AsyncClient(
+                    channel,
+                    self._doc,
+                    self._auto_push,
+                    self._auto_pull,
+                    push_interval=self._push_interval,
+                    max_push_delay=self._max_push_delay,
+                    max_push_size=self._max_push_size,
+                    max_pull_size=self._max_pull_size,
+                )
             )
             self._exit_stack = exit_stack.pop_all()
         return self
@@ -222,9 +308,11 @@ class File(Channel):
         version: str,
         *,
         message_list: list[bytes] | None = None,
+        file_path: Path | None = None,
     ) -> None:
         self._file = file
         self._path = path
+        self._file_path = file_path
         self._file_doc: Doc | None = file_doc
         self._message_list = message_list
         self._write_delay = write_delay
@@ -264,11 +352,26 @@ class File(Channel):
     def _write_updates(self):
         messages = b"".join(self._messages)
         self._messages.clear()
-        if self._squash:  # pragma: nocover
-            squash_file(self._file, messages)
+        if self._squash:
+            # the file is squashed on every write
+            assert self._file_path is not None
+            self._file.seek(0)
+            data = self._file.read() + messages
+            version_size = len(self._version) + 1
+            snapshot, updates = read_updates(self._version, data[version_size:])
+            snapshot = squash_updates(snapshot, updates)
+            # an open file cannot be replaced on Windows
+            self._file.close()
+            try:
+                replace_file(self._file_path, create_file(self._version, snapshot))
+            finally:
+                self._file = open(self._file_path, mode="a+b", buffering=0)
         else:
             write_file(self._file, messages)
 
+    def close(self) -> None:
+        self._file.close()
+
 
 class AsyncFile(AsyncChannel):
     def __init__(
@@ -282,24 +385,51 @@ class AsyncFile(AsyncChannel):
         version: str,
         *,
         message_list: list[bytes] | None = None,
-        send_stream: MemoryObjectSendStream[bytes] | None = None,
-        receive_stream: MemoryObjectReceiveStream[bytes] | None = None,
+        buffer: MessageBuffer | None = None,
         task_group: TaskGroup | None = None,
         lock: Lock | None = None,
+        max_write_delay: float | None = None,
+        max_write_updates: int | None = None,
+        max_write_bytes: int | None = None,
+        compaction_ratio: float | None = None,
+        min_compaction_bytes: int = 0,
+        snapshot_size: int = 0,
+        file_path: anyio.Path | None = None,
+        fsync_policy: FsyncPolicy = "never",
+        fsync_interval: float = 1,
     ) -> None:
         self._file = file
         self._path = path
+        self._file_path = file_path
         self._file_doc: Doc | None = file_doc
         self._message_list = message_list
-        self._send_stream = send_stream
-        self._receive_stream = receive_stream
+        self._buffer = buffer
         self._task_group = task_group
         self._write_delay = write_delay
+        self._max_write_delay = max_write_delay
+        self._max_write_updates = max_write_updates
+        self._max_write_bytes = max_write_bytes
+        self._compaction_ratio = compaction_ratio
+        self._min_compaction_bytes = min_compaction_bytes
+        self._fsync_policy = fsync_policy
+        self._fsync_interval = fsync_interval
         self._squash = squash
         self._version = version
         self._lock = lock
+        # whether data was written since the file was last synced to disk
+        self._unsynced = False
+        # the size of the snapshot at the beginning of the log,
+        # and of the updates appended after it
+        self._snapshot_size = snapshot_size
+        self._tail_size = size - len(create_file(version)) - snapshot_size
+        self._compacting = False
+        # the updates waiting to be written, their size,
+        # and the time at which the oldest one was received
         self._messages: list[bytes] = []
-        self._write_cancel_scope: CancelScope | None = None
+        self._message_bytes = 0
+        self._first_message_time: float | None = None
+        # set when an update is received
+        self._message_event = Event()
 
     async def __anext__(self) -> bytes:
         try:
@@ -314,47 +444,189 @@ class AsyncFile(AsyncChannel):
         return self._path  # pragma: nocover
 
     async def send(self, message: bytes) -> None:
-        assert self._task_group is not None
-        assert self._send_stream is not None
+        assert self._buffer is not None
         message_type = message[0]
         if message_type == YMessageType.SYNC:
             if message[1] == YSyncMessageType.SYNC_UPDATE:
-                if self._write_cancel_scope is not None:
-                    self._write_cancel_scope.cancel()
-                self._messages.append(message[2:])
-                await self._task_group.start(self._write_updates)
+                self._add_message(message[2:])
+                if self._buffer.overflow_policy == "collapse" and self._is_full():
+                    self._collapse()
+                if self._is_full():
+                    # the pending updates are written without delay,
+                    # and the sender waits for them to be written
+                    await self._write_updates()
             else:
                 assert self._file_doc is not None
                 async with self._file_doc.new_transaction():
                     reply = handle_sync_message(message[1:], self._file_doc)
                 if reply is not None:
-                    await self._send_stream.send(reply)
+                    await self._buffer.send(reply)
                 if message[1] == YSyncMessageType.SYNC_STEP2:
                     update = message[2:]
                     if update != bytes([2, 0, 0]):
-                        self._messages.append(update)
-                        await self._task_group.start(self._write_updates)
+                        self._add_message(update)
                     self._file_doc = None
 
     async def receive(self) -> bytes:
-        assert self._receive_stream is not None
-        return await self._receive_stream.receive()
+        assert self._buffer is not None
+        return await self._buffer.receive()
+
+    def receive_nowait(self) -> bytes:
+        assert self._buffer is not None
+        return self._buffer.receive_nowait()
+
+    def _add_message(self, message: bytes) -> None:
+        if not self._messages:
+            self._first_message_time = current_time()
+        self._messages.append(message)
+        self._message_bytes += len(message)
+        self._message_event.set()
+
+    def _is_full(self) -> bool:
+        assert self._buffer is not None
+        max_size = self._buffer.max_size
+        max_bytes = self._buffer.max_bytes
+        return (max_size is not None and len(self._messages) > max_size) or (
+            max_bytes is not None and self._message_bytes > max_bytes
+        )
+
+    def _is_batch_full(self) -> bool:
+        return (
+            self._max_write_updates is not None
+            and len(self._messages) >= self._max_write_updates
+        ) or (
+            self._max_write_bytes is not None
+            and self._message_bytes >= self._max_write_bytes
+        )
+
+    def _collapse(self) -> None:
+        updates = [read_message(message) for message in self._messages]
+        self._messages = [write_message(merge_updates(*updates))]
+        self._message_bytes = len(self._messages[0])
+
+    async def _run_writer(
+        self, *, task_status: TaskStatus[None] = TASK_STATUS_IGNORED
+    ) -> None:
+        task_status.started()
+        while True:
+            await self._message_event.wait()
+            # wait until no update is received during the write delay, unless the batch
+            # is full or the oldest pending update has waited for the maximum write delay
+            while self._messages and not self._is_batch_full():
+                self._message_event = Event()
+                delay = self._write_delay
+                if self._max_write_delay is not None:
+                    assert self._first_message_time is not None
+                    deadline = self._first_message_time + self._max_write_delay
+                    delay = min(delay, deadline - current_time())
+                if delay <= 0:
+                    break
+                with move_on_after(delay):
+                    await self._message_event.wait()
+                    continue
+                break
+            self._message_event = Event()
+            await self._write_updates()
+
+    async def _write_updates(self) -> None:
+        assert self._lock is not None
+        if not self._messages:
+            return
+        with CancelScope(shield=True):
+            messages = b"".join(self._messages)
+            self._messages.clear()
+            self._message_bytes = 0
+            self._first_message_time = None
+            start_time = current_time() if metrics.enabled else None
+            async with self._lock:
+                await self._file.write(messages)
+                if self._fsync_policy == "batch":
+                    await afsync(self._file)
+                else:
+                    self._unsynced = True
+                self._tail_size += len(messages)
+            if start_time is not None:
+                metrics.write_seconds.observe(current_time() - start_time)
+        if (
+            self._compaction_ratio is not None
+            and not self._compacting
+            and self._tail_size >= self._min_compaction_bytes
+            and self._tail_size > self._compaction_ratio * self._snapshot_size
+        ):
+            assert self._task_group is not None
+            self._compacting = True
+            self._task_group.start_soon(self._compact)
+
+    async def _flush(self) -> None:
+        await self._write_updates()
+        if self._fsync_policy != "never" and self._unsynced:
+            with CancelScope(shield=True):
+                await self._fsync()
+
+    async def _fsync(self) -> None:
+        assert self._lock is not None
+        async with self._lock:
+            self._unsynced = False
+            await afsync(self._file)
 
-    async def _write_updates(
+    async def _run_fsync(
         self, *, task_status: TaskStatus[None] = TASK_STATUS_IGNORED
-    ):
+    ) -> None:
+        task_status.started()
+        while True:
+            await sleep(self._fsync_interval)
+            if self._unsynced:
+                await self._fsync()
+
+    async def _compact(self) -> None:
+        # the squashed log is written to a new file which replaces the current one,
+        # so that the document is never lost, and the updates appended while the log
+        # is squashed are copied after the snapshot, so that appends are not blocked
         assert self._lock is not None
-        with CancelScope() as self._write_cancel_scope:
-            task_status.started()
-            await sleep(self._write_delay)
+        assert self._file_path is not None
+        tmp_path = self._file_path.with_name(f"{self._file_path.name}.tmp")
+        try:
+            async with self._lock:
+                await self._file.seek(0)
+                data = await self._file.read()
+            version_size = len(self._version) + 1
+            snapshot, updates = read_updates(self._version, data[version_size:])
+            # squashing holds the GIL, it would stall the event loop in a thread
+            snapshot = await to_process.run_sync(squash_updates, snapshot, updates)
+            async with await open_file(tmp_path, mode="wb") as tmp_file:
+                await tmp_file.write(create_file(self._version, snapshot))
             with CancelScope(shield=True):
-                messages = b"".join(self._messages)
-                self._messages.clear()
-                self._write_cancel_scope = None
-                if self._squash:
-                    await asquash_file(self._file, self._lock, messages)
-                else:
-                    await awrite_file(self._file, messages, self._lock)
+                async with self._lock:
+                    await self._file.seek(len(data))
+                    tail = await self._file.read()
+                    async with await open_file(tmp_path, mode="ab") as tmp_file:
+                        await tmp_file.write(tail)
+                        await afsync(tmp_file)
+                    # an open file cannot be replaced on Windows
+                    await self._file.aclose()
+                    try:
+                        await tmp_path.replace(self._file_path)
+                        await afsync_directory(self._file_path.parent)
+                    finally:
+                        self._file = await open_file(
+                            self._file_path, mode="a+b", buffering=0
+                        )
+                    self._unsynced = False
+                    self._snapshot_size = len(snapshot)
+                    self._tail_size = len(tail)
+        finally:
+            with CancelScope(shield=True):
+                await tmp_path.unlink(missing_ok=True)
+            self._compacting = False
+
+    async def aclose(self) -> None:
+        """
+        Closes the file, once it is not being compacted.
+        """
+        assert self._lock is not None
+        with CancelScope(shield=True):
+            async with self._lock:
+                await self._file.aclose()
 
 
 def read_file(path: Path) -> tuple[str, bytes]:
@@ -374,51 +646,126 @@ def write_file(file: FileIO, data: bytes) -> None:
     file.write(data)
 
 
-async def awrite_file(file: anyio.AsyncFile[bytes], data: bytes, lock: Lock) -> None:
-    async with lock:
+def replace_file(path: Path, data: bytes) -> None:
+    """
+    Atomically replaces the content of a file, by writing the data to a new file
+    which is synced to disk and renamed to the file.
+
+    Args:
+        path: The path of the file.
+        data: The new content of the file.
+    """
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, mode="wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    tmp_path.replace(path)
+    fsync_directory(path.parent)
+
+
+async def areplace_file(path: anyio.Path, data: bytes) -> None:
+    """
+    The async version of `replace_file()`.
+    """
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    async with await open_file(tmp_path, mode="wb") as file:
         await file.write(data)
-
-
-def squash_file(
-    file: FileIO, with_messages: bytes | None = None
-) -> None:  # pragma: nocover
-    file.seek(0)
-    data = file.read()
-    version, messages = data.split(bytes([0]), 1)
-    header_size = len(version) + 1
-    file.truncate(header_size)
-    file_doc: Doc = Doc()
-    if with_messages is not None:
-        messages += with_messages
+        await afsync(file)
+    await tmp_path.replace(path)
+    await afsync_directory(path.parent)
+
+
+async def afsync(file: anyio.AsyncFile[bytes]) -> None:
+    await file.flush()
+    await to_thread.run_sync(os.fsync, file.wrapped.fileno())
+
+
+def fsync_directory(path: Path) -> None:
+    # a renamed file is only durable once its directory is synced,
+    # which is not possible on Windows
+    if sys.platform == "win32":  # pragma: nocover
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+async def afsync_directory(path: anyio.Path) -> None:
+    await to_thread.run_sync(fsync_directory, Path(path))
+
+
+def create_file(version: str, snapshot: bytes = b"") -> bytes:
+    """
+    Creates the content of a file, made of its version, an index holding the size
+    of the snapshot of the document, and the snapshot. The updates made to
+    the document are then appended to the file as messages.
+
+    Args:
+        version: The version of the file.
+        snapshot: The update of the document, if any.
+
+    Returns:
+        The content of the file.
+    """
+    index = len(snapshot).to_bytes(INDEX_SIZE, "little")
+    return version.encode() + bytes([0]) + index + snapshot
+
+
+def read_updates(version: str, data: bytes) -> tuple[bytes, list[bytes]]:
+    """
+    Args:
+        version: The version of a file, which may be `LEGACY_VERSION`.
+        data: The content of the file following its version.
+
+    Returns:
+        The snapshot of the file (empty if there is none), and the updates
+        appended to it.
+    """
+    if version == LEGACY_VERSION:
+        snapshot = b""
+        messages = data
+    else:
+        snapshot_size = int.from_bytes(data[:INDEX_SIZE], "little")
+        snapshot = data[INDEX_SIZE : INDEX_SIZE + snapshot_size]
+        messages = data[INDEX_SIZE + snapshot_size :]
+    updates = []
     decoder = Decoder(messages)
     while True:
         update = decoder.read_message()
         if not update:
             break
-        file_doc.apply_update(update)
-    squashed_update = file_doc.get_update()
-    message = write_message(squashed_update)
-    file.write(message)
-
-
-async def asquash_file(
-    file: anyio.AsyncFile[bytes], lock: Lock, with_messages: bytes | None = None
-) -> None:
-    async with lock:
-        await file.seek(0)
-        data = await file.read()
-        version, messages = data.split(bytes([0]), 1)
-        header_size = len(version) + 1
-        await file.truncate(header_size)
-        file_doc: Doc = Doc()
-        if with_messages is not None:
-            messages += with_messages
-        decoder = Decoder(messages)
-        while True:
-            update = decoder.read_message()
-            if not update:
-                break
-            file_doc.apply_update(update)
-        squashed_update = file_doc.get_update()
-        message = write_message(squashed_update)
-        await file.write(message)
+        updates.append(update)
+    return snapshot, updates
+
+
+def apply_updates(doc: Doc, snapshot: bytes, updates: list[bytes]) -> None:
+    """
+    Applies the snapshot and the updates of a file to a document, in a single transaction.
+
+    Args:
+        doc: The document.
+        snapshot: The snapshot of the file.
+        updates: The updates of the file.
+    """
+    with doc.transaction():
+        if snapshot:
+            doc.apply_update(snapshot)
+        for update in updates:
+            doc.apply_update(update)
+
+
+def squash_updates(snapshot: bytes, updates: list[bytes]) -> bytes:
+    """
+    Args:
+        snapshot: The snapshot of a file.
+        updates: The updates of the file.
+
+    Returns:
+        The update of a document to which the snapshot and the updates are applied.
+    """
+    file_doc: Doc = Doc()
+    apply_updates(file_doc, snapshot, updates)
+    return file_doc.get_update()
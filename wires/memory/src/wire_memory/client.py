@@ -19,10 +19,18 @@ class AsyncMemoryClient(AsyncClientMixin):
         auto_pull: bool = True,
         *,
         server: AsyncMemoryServer,
+        push_interval: float = 0,
+        max_push_delay: float | None = None,
+        max_push_size: int | None = None,
+        max_pull_size: int | None = None,
     ) -> None:
         self._id = id
         self._doc = doc
         self._auto_push = auto_push
+        self._push_interval = push_interval
+        self._max_push_delay = max_push_delay
+        self._max_push_size = max_push_size
+        self._max_pull_size = max_pull_size
         self._auto_pull = auto_pull
         self._server = server
 
@@ -33,7 +41,16 @@ class AsyncMemoryClient(AsyncClientMixin):
             receive_stream = await exit_stack.enter_async_context(_receive_stream)
             self.channel = Memory(send_stream, receive_stream, self._id)
             self._client = await exit_stack.enter_async_context(
-                AsyncClient(self.channel, self._doc, self._auto_push, self._auto_pull)
+                AsyncClient(
+                    self.channel,
+                    self._doc,
+                    self._auto_push,
+                    self._auto_pull,
+                    push_interval=self._push_interval,
+                    max_push_delay=self._max_push_delay,
+                    max_push_size=self._max_push_size,
+                    max_pull_size=self._max_pull_size,
+                )
             )
             self._exit_stack = exit_stack.pop_all()
         return self
@@ -1,18 +1,53 @@
 from __future__ import annotations
 
-import math
 from collections.abc import Callable
 from contextlib import AsyncExitStack
 from types import TracebackType
 
-from anyio import Lock, create_memory_object_stream, create_task_group
+from anyio import BrokenResourceError, Lock, create_task_group
 
-from wiredb import AsyncChannel, AsyncServer, Room
+from wiredb import AsyncChannel, AsyncServer, MessageBuffer, Room
+from wiredb.buffer import OverflowPolicy
 
 
 class AsyncMemoryServer(AsyncServer):
-    def __init__(self, room_factory: Callable[[str], Room] = Room) -> None:
-        super().__init__(room_factory=room_factory)
+    def __init__(
+        self,
+        room_factory: Callable[[str], Room] = Room,
+        *,
+        room_ttl: float = 0,
+        max_idle_rooms: int | None = None,
+        max_idle_size: int | None = None,
+        max_buffer_size: int | None = None,
+        max_buffer_bytes: int | None = None,
+        overflow_policy: OverflowPolicy = "block",
+    ) -> None:
+        """
+        Creates a server whose clients are connected through in-memory buffers.
+
+        Args:
+            room_factory: An optional callable used to create a room.
+            room_ttl: The time (in seconds) during which a room without clients is kept alive.
+            max_idle_rooms: The maximum number of rooms without clients kept alive.
+            max_idle_size: The maximum estimated size (in bytes) of the shared documents
+                of the rooms without clients kept alive.
+            max_buffer_size: The maximum number of messages in each direction of
+                a connection, or `None` for no limit.
+            max_buffer_bytes: The maximum number of bytes in each direction of
+                a connection, or `None` for no limit.
+            overflow_policy: What to do when a buffer is full: `"block"` waits until
+                the receiver catches up, `"drop"` closes the connection, and `"collapse"`
+                merges the queued updates into a single update.
+        """
+        super().__init__(
+            room_factory=room_factory,
+            room_ttl=room_ttl,
+            max_idle_rooms=max_idle_rooms,
+            max_idle_size=max_idle_size,
+        )
+        self._max_buffer_size = max_buffer_size
+        self._max_buffer_bytes = max_buffer_bytes
+        self._overflow_policy = overflow_policy
 
     async def __aenter__(self) -> "AsyncMemoryServer":
         async with AsyncExitStack() as exit_stack:
@@ -29,17 +64,18 @@ class AsyncMemoryServer(AsyncServer):
     ) -> bool | None:
         return await self._exit_stack.__aexit__(exc_type, exc_val, exc_tb)
 
-    async def connect(self, id: str):
-        server_send_stream, client_receive_stream = create_memory_object_stream[bytes](
-            max_buffer_size=math.inf
-        )
-        client_send_stream, server_receive_stream = create_memory_object_stream[bytes](
-            max_buffer_size=math.inf
-        )
-        channel = Memory(server_send_stream, server_receive_stream, id)
+    async def connect(self, id: str) -> tuple[MessageBuffer, MessageBuffer]:
+        server_buffer = self._create_buffer()
+        client_buffer = self._create_buffer()
+        channel = Memory(client_buffer, server_buffer, id)
         room = await self.room_manager.get_room(id)
         await self._task_group.start(self._serve, room, channel)
-        return client_send_stream, client_receive_stream
+        return server_buffer, client_buffer
+
+    def _create_buffer(self) -> MessageBuffer:
+        return MessageBuffer(
+            self._max_buffer_size, self._max_buffer_bytes, self._overflow_policy
+        )
 
     async def _serve(self, room: Room, channel: Memory, *, task_status):
         async with (
@@ -73,10 +109,20 @@ class Memory(AsyncChannel):
 
     async def send(self, message: bytes) -> None:
         async with self._send_lock:
-            await self._send_stream.send(message)
+            try:
+                await self._send_stream.send(message)
+            except BrokenResourceError:
+                # the connection is dropped in both directions
+                self._receive_stream.close()
+                raise
             self.send_nb += 1
 
     async def receive(self) -> bytes:
         message = await self._receive_stream.receive()
         self.receive_nb += 1
         return message
+
+    def receive_nowait(self) -> bytes:
+        message = self._receive_stream.receive_nowait()
+        self.receive_nb += 1
+        return message
@@ -8,6 +8,7 @@ from anyio import create_task_group
 from pycrdt import Doc
 
 from wiredb import AsyncClient, AsyncClientMixin
+from wiredb.buffer import OverflowPolicy
 
 from .server import STOP, Pipe
 
@@ -21,21 +22,52 @@ class AsyncPipeClient(AsyncClientMixin):
         auto_pull: bool = True,
         *,
         connection,
+        max_buffer_size: int | None = None,
+        max_buffer_bytes: int | None = None,
+        overflow_policy: OverflowPolicy = "block",
+        push_interval: float = 0,
+        max_push_delay: float | None = None,
+        max_push_size: int | None = None,
+        max_pull_size: int | None = None,
     ) -> None:
         self._id = id
         self._doc = doc
         self._auto_push = auto_push
+        self._push_interval = push_interval
+        self._max_push_delay = max_push_delay
+        self._max_push_size = max_push_size
+        self._max_pull_size = max_pull_size
         self._auto_pull = auto_pull
         self._sender, self._receiver, self._server_sender, self._server_receiver = (
             connection
         )
+        self._max_buffer_size = max_buffer_size
+        self._max_buffer_bytes = max_buffer_bytes
+        self._overflow_policy = overflow_policy
 
     async def __aenter__(self) -> "AsyncPipeClient":
         async with AsyncExitStack() as exit_stack:
             tg = await exit_stack.enter_async_context(create_task_group())
-            channel = Pipe(tg, self._sender, self._receiver, self._id)
+            channel = Pipe(
+                tg,
+                self._sender,
+                self._receiver,
+                self._id,
+                max_buffer_size=self._max_buffer_size,
+                max_buffer_bytes=self._max_buffer_bytes,
+                overflow_policy=self._overflow_policy,
+            )
             self._client = await exit_stack.enter_async_context(
-                AsyncClient(channel, self._doc, self._auto_push, self._auto_pull)
+                AsyncClient(
+                    channel,
+                    self._doc,
+                    self._auto_push,
+                    self._auto_pull,
+                    push_interval=self._push_interval,
+                    max_push_delay=self._max_push_delay,
+                    max_push_size=self._max_push_size,
+                    max_pull_size=self._max_pull_size,
+                )
             )
             self._exit_stack = exit_stack.pop_all()
         return self
@@ -48,8 +80,12 @@ class AsyncPipeClient(AsyncClientMixin):
     ) -> bool | None:
         os.write(self._sender, STOP)
         os.write(self._server_sender, STOP)
-        os.close(self._sender)
-        os.close(self._receiver)
-        os.close(self._server_sender)
-        os.close(self._server_receiver)
-        return await self._exit_stack.__aexit__(exc_type, exc_val, exc_tb)
+        # the client must be stopped before the pipes are closed,
+        # since it may still be sending updates
+        try:
+            return await self._exit_stack.__aexit__(exc_type, exc_val, exc_tb)
+        finally:
+            os.close(self._sender)
+            os.close(self._receiver)
+            os.close(self._server_sender)
+            os.close(self._server_receiver)
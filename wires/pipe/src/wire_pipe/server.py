@@ -7,16 +7,17 @@ from functools import partial
 from types import TracebackType
 
 from anyio import (
+    BrokenResourceError,
     Lock,
-    create_memory_object_stream,
     create_task_group,
     from_thread,
+    get_cancelled_exc_class,
     to_thread,
 )
 from anyio.abc import TaskGroup
-from anyio.streams.buffered import BufferedByteReceiveStream
 
-from wiredb import AsyncChannel, AsyncServer, Room
+from wiredb import AsyncChannel, AsyncServer, MessageBuffer, Room
+from wiredb.buffer import OverflowPolicy
 
 SEPARATOR = bytes([226, 164, 131, 121, 240, 77, 100, 52])
 STOP = bytes([80, 131, 218, 244, 198, 47, 146, 214])
@@ -24,8 +25,44 @@ MAX_RECEIVE_BYTE_NB = 2**16
 
 
 class AsyncPipeServer(AsyncServer):
-    def __init__(self, room_factory: Callable[[str], Room] = Room) -> None:
-        super().__init__(room_factory=room_factory)
+    def __init__(
+        self,
+        room_factory: Callable[[str], Room] = Room,
+        *,
+        room_ttl: float = 0,
+        max_idle_rooms: int | None = None,
+        max_idle_size: int | None = None,
+        max_buffer_size: int | None = None,
+        max_buffer_bytes: int | None = None,
+        overflow_policy: OverflowPolicy = "block",
+    ) -> None:
+        """
+        Creates a server whose clients are connected through OS pipes.
+
+        Args:
+            room_factory: An optional callable used to create a room.
+            room_ttl: The time (in seconds) during which a room without clients is kept alive.
+            max_idle_rooms: The maximum number of rooms without clients kept alive.
+            max_idle_size: The maximum estimated size (in bytes) of the shared documents
+                of the rooms without clients kept alive.
+            max_buffer_size: The maximum number of received messages buffered for
+                a connection, or `None` for no limit.
+            max_buffer_bytes: The maximum number of received bytes buffered for
+                a connection, or `None` for no limit.
+            overflow_policy: What to do when a buffer is full: `"block"` stops reading
+                from the pipe, so that the sender blocks when the pipe is full, `"drop"`
+                closes the connection, and `"collapse"` merges the queued updates into
+                a single update.
+        """
+        super().__init__(
+            room_factory=room_factory,
+            room_ttl=room_ttl,
+            max_idle_rooms=max_idle_rooms,
+            max_idle_size=max_idle_size,
+        )
+        self._max_buffer_size = max_buffer_size
+        self._max_buffer_bytes = max_buffer_bytes
+        self._overflow_policy = overflow_policy
 
     async def __aenter__(self) -> AsyncPipeServer:
         async with AsyncExitStack() as exit_stack:
@@ -48,10 +85,15 @@ class AsyncPipeServer(AsyncServer):
         if server_sender is None:
             client_receiver, server_sender = os.pipe()
             server_receiver, client_sender = os.pipe()
-            # os.set_inheritable(client_receiver, True)
-            # os.set_inheritable(client_sender, True)
-            # os.set_inheritable(server_sender, True)
-        channel = Pipe(self._task_group, server_sender, server_receiver, id)
+        channel = Pipe(
+            self._task_group,
+            server_sender,
+            server_receiver,
+            id,
+            max_buffer_size=self._max_buffer_size,
+            max_buffer_bytes=self._max_buffer_bytes,
+            overflow_policy=self._overflow_policy,
+        )
         room = await self.room_manager.get_room(id)
         await self._task_group.start(room.serve, channel)
         if client_sender is not None:
@@ -59,15 +101,24 @@ class AsyncPipeServer(AsyncServer):
 
 
 class Pipe(AsyncChannel):
-    def __init__(self, tg: TaskGroup, sender: int, receiver: int, id: str):
+    def __init__(
+        self,
+        tg: TaskGroup,
+        sender: int,
+        receiver: int,
+        id: str,
+        *,
+        max_buffer_size: int | None = None,
+        max_buffer_bytes: int | None = None,
+        overflow_policy: OverflowPolicy = "block",
+    ):
         self._sender = sender
         self._receiver = receiver
-        self._send_stream, receive_stream = create_memory_object_stream[bytes](
-            float("inf")
-        )
-        self._buffered_stream = BufferedByteReceiveStream(receive_stream)
+        self._buffer = MessageBuffer(max_buffer_size, max_buffer_bytes, overflow_policy)
         self._id = id
         self._send_lock = Lock()
+        # whether a write was cancelled while it may still be in progress
+        self._send_abandoned = False
         self._receive_lock = Lock()
         tg.start_soon(partial(to_thread.run_sync, self._run, abandon_on_cancel=True))
 
@@ -84,18 +135,56 @@ class Pipe(AsyncChannel):
         return self._id  # pragma: nocover
 
     async def send(self, message: bytes):
-        msg = message + SEPARATOR
-        nb = 0
-        while nb != len(msg):
-            msg = msg[nb:]
-            nb = os.write(self._sender, msg)
+        async with self._send_lock:
+            if self._send_abandoned:  # pragma: nocover
+                raise BrokenResourceError()
+            try:
+                # writing blocks while the pipe is full, which must only block
+                # this connection and not the event loop
+                await to_thread.run_sync(
+                    write_pipe,
+                    self._sender,
+                    message + SEPARATOR,
+                    abandon_on_cancel=True,
+                )
+            except get_cancelled_exc_class():
+                # the abandoned write could interleave with the next messages
+                self._send_abandoned = True
+                raise
 
     def _run(self) -> None:
+        data = bytearray()
         while True:
-            message = os.read(self._receiver, MAX_RECEIVE_BYTE_NB)
-            if STOP in message:
+            try:
+                chunk = os.read(self._receiver, MAX_RECEIVE_BYTE_NB)
+            except OSError:  # pragma: nocover
+                # the pipe was closed by the other end
                 return
-            from_thread.run_sync(self._send_stream.send_nowait, message)
+            if STOP in chunk:
+                return
+            # the data is only split once a separator is received, which may span
+            # two chunks, so that a big message is not copied for every chunk
+            start = max(len(data) - len(SEPARATOR) + 1, 0)
+            data += chunk
+            if data.find(SEPARATOR, start) == -1:
+                continue
+            *messages, rest = bytes(data).split(SEPARATOR)
+            data = bytearray(rest)
+            for message in messages:
+                try:
+                    # stop reading from the pipe until there is room in the buffer
+                    from_thread.run(self._buffer.send, message)
+                except BrokenResourceError:  # pragma: nocover
+                    return
 
     async def receive(self) -> bytes:
-        return await self._buffered_stream.receive_until(SEPARATOR, MAX_RECEIVE_BYTE_NB)
+        return await self._buffer.receive()
+
+    def receive_nowait(self) -> bytes:
+        return self._buffer.receive_nowait()
+
+
+def write_pipe(fd: int, data: bytes) -> None:
+    while data:
+        nb = os.write(fd, data)
+        data = data[nb:]
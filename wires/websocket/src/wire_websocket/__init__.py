@@ -1,3 +1,8 @@
 from .client import AsyncWebSocketClient as AsyncWebSocketClient
 from .client import WebSocketClient as WebSocketClient
+from .multiplex import AsyncMultiplexedClient as AsyncMultiplexedClient
+from .multiplex import AsyncWebSocketMultiplexer as AsyncWebSocketMultiplexer
 from .server import AsyncWebSocketServer as AsyncWebSocketServer
+from .sharded_server import (
+    AsyncShardedWebSocketServer as AsyncShardedWebSocketServer,
+)
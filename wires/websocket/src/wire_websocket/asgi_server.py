@@ -1,9 +1,19 @@
 from __future__ import annotations
 
-from collections.abc import Awaitable
+from collections.abc import Awaitable, Coroutine
 from typing import Any, Callable
 
 from wiredb import AsyncChannel
+from wiredb.buffer import OverflowPolicy
+from wiredb.metrics import metrics
+
+from .compression import (
+    COMPRESSION_SUBPROTOCOL,
+    MAX_MESSAGE_SIZE,
+    compress_message,
+    decompress_message,
+)
+from .multiplex import MULTIPLEX_SUBPROTOCOL, serve_multiplexed
 
 
 class ASGIWebsocket(AsyncChannel):
@@ -12,10 +22,17 @@ class ASGIWebsocket(AsyncChannel):
         receive: Callable[[], Awaitable[dict[str, Any]]],
         send: Callable[[dict[str, Any]], Awaitable[None]],
         path: str,
+        compression_threshold: int | None = None,
+        max_message_size: int = MAX_MESSAGE_SIZE,
+        headers: list[tuple[bytes, bytes]] | None = None,
     ) -> None:
         self._receive = receive
         self._send = send
         self._path = path
+        self._compression_threshold = compression_threshold
+        self._max_message_size = max_message_size
+        # the HTTP headers of the connection request
+        self.headers = [] if headers is None else headers
 
     @property
     def id(self) -> str:
@@ -25,6 +42,8 @@ class ASGIWebsocket(AsyncChannel):
         return await self.receive()
 
     async def send(self, message: bytes) -> None:
+        if self._compression_threshold is not None:
+            message = compress_message(message, self._compression_threshold)
         await self._send(
             dict(
                 type="websocket.send",
@@ -35,6 +54,13 @@ class ASGIWebsocket(AsyncChannel):
     async def receive(self) -> bytes:
         message = await self._receive()
         if message["type"] == "websocket.receive":
+            if self._compression_threshold is not None:
+                try:
+                    return decompress_message(message["bytes"], self._max_message_size)
+                except ValueError:
+                    # the message is too big
+                    await self._send({"type": "websocket.close", "code": 1009})
+                    raise StopAsyncIteration()
             return message["bytes"]
         if message["type"] == "websocket.disconnect":
             raise StopAsyncIteration()
@@ -44,9 +70,40 @@ class ASGIWebsocket(AsyncChannel):
 class ASGIServer:
     def __init__(
         self,
-        serve: Callable[[ASGIWebsocket], Awaitable[None]],
+        serve: Callable[[AsyncChannel], Coroutine[Any, Any, None]],
+        *,
+        metrics_path: str | None = None,
+        compression_threshold: int | None = None,
+        max_message_size: int = MAX_MESSAGE_SIZE,
+        max_buffer_size: int | None = 64,
+        max_buffer_bytes: int | None = None,
+        overflow_policy: OverflowPolicy = "block",
     ) -> None:
+        """
+        An ASGI application which serves WebSocket connections, and optionally
+        the metrics in the Prometheus text exposition format over HTTP.
+        A WebSocket connection with the multiplexing subprotocol serves
+        all the rooms its client subscribes to, and a WebSocket connection with
+        the compression subprotocol compresses its messages if compression is enabled.
+
+        Args:
+            serve: The handler of a WebSocket connection.
+            metrics_path: The HTTP path of the metrics, or `None` to not serve them.
+            compression_threshold: The minimum size (in bytes) of a message to compress,
+                or `None` to not support compression.
+            max_message_size: The maximum size (in bytes) of a decompressed message,
+                above which the connection is closed.
+            max_buffer_size: See `serve_multiplexed()`.
+            max_buffer_bytes: See `serve_multiplexed()`.
+            overflow_policy: See `serve_multiplexed()`.
+        """
         self._serve = serve
+        self._metrics_path = metrics_path
+        self._compression_threshold = compression_threshold
+        self._max_message_size = max_message_size
+        self._max_buffer_size = max_buffer_size
+        self._max_buffer_bytes = max_buffer_bytes
+        self._overflow_policy = overflow_policy
 
     async def __call__(
         self,
@@ -65,6 +122,65 @@ class ASGIServer:
         elif scope["type"] == "websocket":
             msg = await receive()
             if msg["type"] == "websocket.connect":
-                await send({"type": "websocket.accept"})
-                websocket = ASGIWebsocket(receive, send, scope["path"])
-                await self._serve(websocket)
+                subprotocols = scope.get("subprotocols", [])
+                headers = scope.get("headers", [])
+                if MULTIPLEX_SUBPROTOCOL in subprotocols:
+                    await send(
+                        {
+                            "type": "websocket.accept",
+                            "subprotocol": MULTIPLEX_SUBPROTOCOL,
+                        }
+                    )
+                    websocket = ASGIWebsocket(
+                        receive, send, scope["path"], headers=headers
+                    )
+                    await serve_multiplexed(
+                        websocket,
+                        self._serve,
+                        headers=headers,
+                        max_buffer_size=self._max_buffer_size,
+                        max_buffer_bytes=self._max_buffer_bytes,
+                        overflow_policy=self._overflow_policy,
+                    )
+                elif (
+                    self._compression_threshold is not None
+                    and COMPRESSION_SUBPROTOCOL in subprotocols
+                ):
+                    await send(
+                        {
+                            "type": "websocket.accept",
+                            "subprotocol": COMPRESSION_SUBPROTOCOL,
+                        }
+                    )
+                    websocket = ASGIWebsocket(
+                        receive,
+                        send,
+                        scope["path"],
+                        self._compression_threshold,
+                        self._max_message_size,
+                        headers,
+                    )
+                    await self._serve(websocket)
+                else:
+                    await send({"type": "websocket.accept"})
+                    websocket = ASGIWebsocket(
+                        receive, send, scope["path"], headers=headers
+                    )
+                    await self._serve(websocket)
+        elif scope["type"] == "http":
+            if self._metrics_path is not None and scope["path"] == self._metrics_path:
+                status = 200
+                body = metrics.render().encode()
+                content_type = b"text/plain; version=0.0.4; charset=utf-8"
+            else:
+                status = 404
+                body = b"Not Found"
+                content_type = b"text/plain; charset=utf-8"
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": status,
+                    "headers": [(b"content-type", content_type)],
+                }
+            )
+            await send({"type": "http.response.body", "body": body})
@@ -1,22 +1,38 @@
 from __future__ import annotations
 
+import logging
+import random
 import sys
-from collections.abc import Generator
+from collections.abc import Callable, Generator
 from contextlib import AsyncExitStack, ExitStack, contextmanager
+from pathlib import Path
 from queue import Empty
 from types import TracebackType
+from typing import Literal
+from urllib.parse import quote
 
 from anyio import (
     TASK_STATUS_IGNORED,
+    CancelScope,
+    Event,
     Lock,
     create_task_group,
     get_cancelled_exc_class,
+    sleep,
     sleep_forever,
 )
-from anyio.abc import TaskStatus
-from httpx import Cookies
-from httpx_ws import AsyncWebSocketSession, WebSocketSession, aconnect_ws, connect_ws
-from pycrdt import Doc
+from anyio.abc import TaskGroup, TaskStatus
+from httpx import Cookies, TransportError
+from httpx_ws import (
+    AsyncWebSocketSession,
+    WebSocketDisconnect,
+    WebSocketNetworkError,
+    WebSocketSession,
+    aconnect_ws,
+    connect_ws,
+)
+from pycrdt import Awareness, Doc
+from wire_file import AsyncFileClient
 
 from wiredb import (
     AsyncChannel,
@@ -25,12 +41,30 @@ from wiredb import (
     Channel,
     Client,
     ClientMixin,
+    MessageBuffer,
+)
+
+from .compression import (
+    COMPRESSION_SUBPROTOCOL,
+    MAX_MESSAGE_SIZE,
+    compress_message,
+    decompress_message,
+)
+
+if sys.version_info < (3, 11):  # pragma: nocover
+    from exceptiongroup import BaseExceptionGroup
+
+ConnectionState = Literal["connecting", "connected", "disconnected"]
+
+# the errors after which a client reconnects
+CONNECTION_ERRORS = (
+    OSError,
+    TransportError,
+    WebSocketDisconnect,
+    WebSocketNetworkError,
 )
 
-if sys.version_info >= (3, 11):
-    pass
-else:  # pragma: nocover
-    pass
+logger = logging.getLogger(__name__)
 
 
 class WebSocketClient(ClientMixin):
@@ -43,10 +77,18 @@ class WebSocketClient(ClientMixin):
         host: str,
         port: int,
         cookies: Cookies | None = None,
+        max_push_size: int | None = None,
+        max_pull_size: int | None = None,
+        compression_threshold: int | None = None,
+        max_message_size: int = MAX_MESSAGE_SIZE,
     ) -> None:
         self._id = id
         self._doc = doc
         self._auto_push = auto_push
+        self._max_push_size = max_push_size
+        self._max_pull_size = max_pull_size
+        self._compression_threshold = compression_threshold
+        self._max_message_size = max_message_size
         self._host = host
         self._port = port
         self._cookies = cookies
@@ -58,15 +100,27 @@ class WebSocketClient(ClientMixin):
             f"{self._host}:{self._port}/{self._id}",
             keepalive_ping_interval_seconds=None,
             cookies=self._cookies,
+            subprotocols=_get_subprotocols(self._compression_threshold),
         ) as ws:
-            self._channel = HttpxWebSocket(ws, self._id)
+            self._channel = HttpxWebSocket(
+                ws,
+                self._id,
+                _get_compression_threshold(ws, self._compression_threshold),
+                self._max_message_size,
+            )
             yield
 
     def __enter__(self) -> "WebSocketClient":
         with ExitStack() as exit_stack:
             exit_stack.enter_context(self._connect_ws())
             self._client = exit_stack.enter_context(
-                Client(self._channel, self._doc, self._auto_push)
+                Client(
+                    self._channel,
+                    self._doc,
+                    self._auto_push,
+                    max_push_size=self._max_push_size,
+                    max_pull_size=self._max_pull_size,
+                )
             )
             self._exit_stack = exit_stack.pop_all()
         return self
@@ -91,38 +145,205 @@ class AsyncWebSocketClient(AsyncClientMixin):
         host: str,
         port: int,
         cookies: Cookies | None = None,
+        push_interval: float = 0,
+        max_push_delay: float | None = None,
+        max_push_size: int | None = None,
+        max_pull_size: int | None = None,
+        reconnect: bool = False,
+        reconnect_delay: float = 0.1,
+        max_reconnect_delay: float = 10,
+        cache_dir: Path | str | None = None,
+        compression_threshold: int | None = None,
+        max_message_size: int = MAX_MESSAGE_SIZE,
     ) -> None:
+        """
+        Creates an async WebSocket client, where the path of the WebSocket is the ID
+        of its room.
+
+        Args:
+            id: The room ID.
+            doc: An optional external shared document (or a new one will be created).
+            auto_push: Whether to automatically send updates of the shared document as they
+                are made by this client.
+            auto_pull: Whether to automatically apply updates to the shared document
+                as they are received.
+            host: The host of the server.
+            port: The port of the server.
+            cookies: The cookies sent when connecting.
+            push_interval: See `AsyncClient`.
+            max_push_delay: See `AsyncClient`.
+            max_push_size: See `AsyncClient`.
+            max_pull_size: See `AsyncClient`.
+            reconnect: Whether to reconnect when the connection is lost, keeping the same
+                shared document. The synchronization handshake then only exchanges the
+                updates that each side is missing, including the local updates made while
+                disconnected. If `True`, entering the client waits until it is connected.
+            reconnect_delay: The base delay (in seconds) between two connection attempts.
+                The delay doubles after each failed attempt, and a random delay between 0
+                and this delay is actually waited, so that clients don't all reconnect
+                at the same time.
+            max_reconnect_delay: The maximum delay (in seconds) between two connection
+                attempts.
+            cache_dir: An optional directory where the shared document is cached, in a
+                file per server and room. The cached document is loaded before connecting,
+                so that the synchronization handshake only exchanges the changes made since
+                the last session, and the local changes are kept until they are sent.
+            compression_threshold: If not `None`, the compression of messages is requested
+                to the server, and if it is supported the messages of at least this size
+                (in bytes) are compressed.
+            max_message_size: The maximum size (in bytes) of a decompressed message,
+                above which the connection is closed.
+        """
         self._id = id
         self._doc = doc
         self._auto_push = auto_push
+        self._push_interval = push_interval
+        self._max_push_delay = max_push_delay
+        self._max_push_size = max_push_size
+        self._max_pull_size = max_pull_size
         self._auto_pull = auto_pull
         self._host = host
         self._port = port
         self._cookies = cookies
+        self._reconnect = reconnect
+        self._reconnect_delay = reconnect_delay
+        self._max_reconnect_delay = max_reconnect_delay
+        self._cache_dir = None if cache_dir is None else Path(cache_dir)
+        self._compression_threshold = compression_threshold
+        self._max_message_size = max_message_size
+        self._connection_state: ConnectionState = "disconnected"
+        self._connection_callbacks: list[Callable[[ConnectionState], None]] = []
+
+    @property
+    def connection_state(self) -> ConnectionState:
+        """
+        Returns:
+            The state of the connection: `"connecting"`, `"connected"` or `"disconnected"`.
+        """
+        return self._connection_state
+
+    def observe_connection(self, callback: Callable[[ConnectionState], None]) -> None:
+        """
+        Registers a callback to call with the new state of the connection when it changes.
+
+        Args:
+            callback: The callback.
+        """
+        self._connection_callbacks.append(callback)
 
-    async def _aconnect_ws(
+    def unobserve_connection(self, callback: Callable[[ConnectionState], None]) -> None:
+        """
+        Unregisters a callback registered with `observe_connection()`.
+
+        Args:
+            callback: The callback.
+        """
+        self._connection_callbacks.remove(callback)
+
+    def _set_connection_state(self, state: ConnectionState) -> None:
+        self._connection_state = state
+        for callback in self._connection_callbacks:
+            callback(state)
+
+    async def _run(
         self, *, task_status: TaskStatus[None] = TASK_STATUS_IGNORED
     ) -> None:
+        self._task_status = task_status
+        attempt_nb = 0
         try:
-            ws: AsyncWebSocketSession
-            async with aconnect_ws(
-                f"{self._host}:{self._port}/{self._id}",
-                keepalive_ping_interval_seconds=None,
-                cookies=self._cookies,
-            ) as ws:
-                self._channel = HttpxAsyncWebSocket(ws, self._id)
-                task_status.started()
-                await sleep_forever()
+            while True:
+                self._set_connection_state("connecting")
+                try:
+                    await self._connect()
+                except Exception as exception:
+                    if not self._reconnect or not is_connection_error(exception):
+                        raise
+                    logger.warning(
+                        "Connection to %s:%s/%s lost, reconnecting",
+                        self._host,
+                        self._port,
+                        self._id,
+                        exc_info=True,
+                    )
+                else:
+                    attempt_nb = 0
+                self._set_connection_state("disconnected")
+                delay = min(
+                    self._reconnect_delay * 2**attempt_nb, self._max_reconnect_delay
+                )
+                attempt_nb += 1
+                await sleep(random.uniform(0, delay))
         except get_cancelled_exc_class():
-            pass
+            self._set_connection_state("disconnected")
+
+    async def _connect(self) -> None:
+        ws: AsyncWebSocketSession
+        async with aconnect_ws(
+            f"{self._host}:{self._port}/{self._id}",
+            keepalive_ping_interval_seconds=None,
+            cookies=self._cookies,
+            subprotocols=_get_subprotocols(self._compression_threshold),
+        ) as ws:
+            async with create_task_group() as tg:
+                channel = HttpxAsyncWebSocket(
+                    ws,
+                    self._id,
+                    _get_compression_threshold(ws, self._compression_threshold),
+                    self._max_message_size,
+                    task_group=tg,
+                )
+                tg.start_soon(self._cancel_on_close, channel, tg.cancel_scope)
+                await tg.start(self._run_client, channel)
+                self._set_connection_state("connected")
+                self._task_status.started()
+                self._task_status = TASK_STATUS_IGNORED
+            if not self._reconnect:
+                # the client stops synchronizing
+                self._set_connection_state("disconnected")
+                await sleep_forever()
+
+    async def _cancel_on_close(
+        self, channel: HttpxAsyncWebSocket, cancel_scope: CancelScope
+    ) -> None:
+        await channel.closed.wait()
+        cancel_scope.cancel()
+
+    async def _run_client(
+        self, channel: HttpxAsyncWebSocket, *, task_status: TaskStatus[None]
+    ) -> None:
+        async with AsyncClient(
+            channel,
+            self._doc,
+            self._auto_push,
+            self._auto_pull,
+            push_interval=self._push_interval,
+            max_push_delay=self._max_push_delay,
+            max_push_size=self._max_push_size,
+            max_pull_size=self._max_pull_size,
+            awareness=self._awareness,
+        ) as client:
+            self._client = client
+            task_status.started()
+            await sleep_forever()
 
     async def __aenter__(self) -> AsyncWebSocketClient:
         async with AsyncExitStack() as exit_stack:
+            if self._cache_dir is not None:
+                self._cache_dir.mkdir(parents=True, exist_ok=True)
+                name = quote(f"{self._host}:{self._port}/{self._id}", safe="")
+                file_client = await exit_stack.enter_async_context(
+                    AsyncFileClient(doc=self._doc, path=self._cache_dir / f"{name}.y")
+                )
+                self._doc = file_client.doc
+            # all the connections use the same shared document and awareness,
+            # so that the application observers survive a reconnection
+            if self._doc is None:
+                self._doc = Doc()
+            self._awareness = Awareness(self._doc)
+            self._awareness.set_local_state(None)
             self._task_group = await exit_stack.enter_async_context(create_task_group())
-            await self._task_group.start(self._aconnect_ws)
-            self._client = await exit_stack.enter_async_context(
-                AsyncClient(self._channel, self._doc, self._auto_push, self._auto_pull)
-            )
+            await self._task_group.start(self._awareness.start)
+            await self._task_group.start(self._run)
             self._exit_stack = exit_stack.pop_all()
         return self
 
@@ -136,36 +357,109 @@ class AsyncWebSocketClient(AsyncClientMixin):
         return await self._exit_stack.__aexit__(exc_type, exc_val, exc_tb)
 
 
+def is_connection_error(exception: BaseException) -> bool:
+    """
+    Args:
+        exception: An exception raised by a connection.
+
+    Returns:
+        Whether the exception is one of `CONNECTION_ERRORS`, or a group of them,
+        after which a client reconnects.
+    """
+    if isinstance(exception, BaseExceptionGroup):
+        return all(is_connection_error(exc) for exc in exception.exceptions)
+    return isinstance(exception, CONNECTION_ERRORS)
+
+
+def _get_subprotocols(compression_threshold: int | None) -> list[str] | None:
+    if compression_threshold is None:
+        return None
+    return [COMPRESSION_SUBPROTOCOL]
+
+
+def _get_compression_threshold(
+    websocket: WebSocketSession | AsyncWebSocketSession,
+    compression_threshold: int | None,
+) -> int | None:
+    # compression is only used if the server accepted it
+    if websocket.subprotocol != COMPRESSION_SUBPROTOCOL:
+        return None
+    return compression_threshold
+
+
 class HttpxWebSocket(Channel):
-    def __init__(self, websocket: WebSocketSession, path: str) -> None:
+    def __init__(
+        self,
+        websocket: WebSocketSession,
+        path: str,
+        compression_threshold: int | None = None,
+        max_message_size: int = MAX_MESSAGE_SIZE,
+    ) -> None:
         self._websocket = websocket
         self._path = path
+        self._compression_threshold = compression_threshold
+        self._max_message_size = max_message_size
 
     @property
     def id(self) -> str:
         return self._path  # pragma: nocover
 
     def send(self, message: bytes) -> None:
+        if self._compression_threshold is not None:
+            message = compress_message(message, self._compression_threshold)
         self._websocket.send_bytes(message)
 
     def receive(self, timeout: float | None = None) -> bytes:
         try:
-            return bytes(self._websocket.receive_bytes(timeout))
+            message = bytes(self._websocket.receive_bytes(timeout))
         except Empty:
             raise TimeoutError()
+        if self._compression_threshold is not None:
+            message = decompress_message(message, self._max_message_size)
+        return message
 
 
 class HttpxAsyncWebSocket(AsyncChannel):
-    def __init__(self, websocket: AsyncWebSocketSession, path: str) -> None:
+    def __init__(
+        self,
+        websocket: AsyncWebSocketSession,
+        path: str,
+        compression_threshold: int | None = None,
+        max_message_size: int = MAX_MESSAGE_SIZE,
+        *,
+        task_group: TaskGroup | None = None,
+    ) -> None:
+        """
+        A channel over an HTTPX WebSocket session.
+
+        Args:
+            websocket: The WebSocket session.
+            path: The path of the WebSocket, which is the channel ID.
+            compression_threshold: If not `None`, the messages of at least this size
+                (in bytes) are compressed.
+            max_message_size: The maximum size (in bytes) of a decompressed message.
+            task_group: If not `None`, a task of this task group reads the messages
+                in advance, so that the ones already received are available with
+                `receive_nowait()`. At most `max_message_size` bytes are buffered.
+        """
         self._websocket = websocket
         self._path = path
+        self._compression_threshold = compression_threshold
+        self._max_message_size = max_message_size
         self._send_lock = Lock()
+        # set when the connection is closed
+        self.closed = Event()
+        self._buffer: MessageBuffer | None = None
+        if task_group is not None:
+            self._buffer = MessageBuffer(max_bytes=max_message_size)
+            task_group.start_soon(self._read, self._buffer)
 
     async def __anext__(self) -> bytes:
         try:
             message = await self.receive()
         except Exception:
-            raise StopAsyncIteration()  # pragma: nocover
+            self.closed.set()
+            raise StopAsyncIteration()
 
         return message
 
@@ -174,8 +468,34 @@ class HttpxAsyncWebSocket(AsyncChannel):
         return self._path  # pragma: nocover
 
     async def send(self, message: bytes) -> None:
+        if self._compression_threshold is not None:
+            message = compress_message(message, self._compression_threshold)
         async with self._send_lock:
             await self._websocket.send_bytes(message)
 
     async def receive(self) -> bytes:
-        return bytes(await self._websocket.receive_bytes())
+        if self._buffer is None:
+            return await self._receive()
+        return await self._buffer.receive()
+
+    def receive_nowait(self) -> bytes:
+        if self._buffer is None:
+            return super().receive_nowait()
+        return self._buffer.receive_nowait()
+
+    async def _receive(self) -> bytes:
+        message = bytes(await self._websocket.receive_bytes())
+        if self._compression_threshold is not None:
+            message = decompress_message(message, self._max_message_size)
+        return message
+
+    async def _read(self, buffer: MessageBuffer) -> None:
+        try:
+            while True:
+                # stop reading from the WebSocket until there is room in the buffer
+                await buffer.send(await self._receive())
+        except Exception:
+            # the connection is closed, which ends the iteration of the channel
+            pass
+        finally:
+            buffer.close()
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import zlib
+
+# the WebSocket subprotocol of a connection whose messages may be compressed
+COMPRESSION_SUBPROTOCOL = "wiredb.zlib"
+
+# the first byte of a compressed message, which is not a message type
+# of the synchronization protocol
+COMPRESSED = 255
+
+# the default maximum size (in bytes) of a decompressed message
+MAX_MESSAGE_SIZE = 2**26
+
+
+def compress_message(message: bytes, threshold: int) -> bytes:
+    """
+    Compresses a message with zlib, if it is at least as big as the threshold
+    and compression makes it smaller. A compressed message starts with `COMPRESSED`.
+
+    Args:
+        message: The message to compress.
+        threshold: The minimum size (in bytes) of a message to compress.
+
+    Returns:
+        The compressed message, or the message itself.
+    """
+    if len(message) < threshold:
+        return message
+    compressed = bytes([COMPRESSED]) + zlib.compress(message)
+    if len(compressed) < len(message):
+        return compressed
+    return message
+
+
+def decompress_message(message: bytes, max_size: int = MAX_MESSAGE_SIZE) -> bytes:
+    """
+    Args:
+        message: A message returned by `compress_message()`.
+        max_size: The maximum size (in bytes) of the decompressed message, so that
+            a small compressed message cannot exhaust the memory.
+
+    Returns:
+        The decompressed message.
+
+    Raises:
+        ValueError: The decompressed message would be bigger than `max_size`,
+            or the compressed message is truncated.
+    """
+    if message[:1] == bytes([COMPRESSED]):
+        decompressor = zlib.decompressobj()
+        decompressed = decompressor.decompress(message[1:], max_size)
+        if not decompressor.eof:
+            raise ValueError(
+                f"Decompressed message bigger than {max_size} bytes or truncated"
+            )
+        return decompressed
+    return message
@@ -0,0 +1,409 @@
+from __future__ import annotations
+
+from collections.abc import Awaitable, Callable, Coroutine
+from contextlib import AsyncExitStack
+from enum import IntEnum
+from types import TracebackType
+from typing import Any
+
+from anyio import (
+    TASK_STATUS_IGNORED,
+    BrokenResourceError,
+    EndOfStream,
+    Lock,
+    create_task_group,
+    get_cancelled_exc_class,
+    sleep_forever,
+)
+from anyio.abc import TaskStatus
+from httpx import Cookies
+from httpx_ws import AsyncWebSocketSession, aconnect_ws
+from pycrdt import Decoder, Doc, write_var_uint
+
+from wiredb import AsyncChannel, AsyncClient, AsyncClientMixin, MessageBuffer
+from wiredb.buffer import OverflowPolicy
+
+from .client import HttpxAsyncWebSocket
+
+# the WebSocket subprotocol of a connection carrying the messages of many rooms
+MULTIPLEX_SUBPROTOCOL = "wiredb.multiplex"
+
+
+class FrameType(IntEnum):
+    SUBSCRIBE = 0
+    UNSUBSCRIBE = 1
+    MESSAGE = 2
+
+
+def create_frame(frame_type: FrameType, index: int, payload: bytes = b"") -> bytes:
+    """
+    Creates a frame of a multiplexed connection, which is made of its type,
+    the index of its room in the connection, and its payload:
+
+    - for `SUBSCRIBE`, the room ID, the index being chosen by the client and never reused.
+    - for `UNSUBSCRIBE`, nothing.
+    - for `MESSAGE`, a message of the synchronization protocol.
+
+    Args:
+        frame_type: The type of the frame.
+        index: The index of the room in the connection.
+        payload: The payload of the frame.
+
+    Returns:
+        The frame.
+    """
+    return bytes([frame_type]) + write_var_uint(index) + payload
+
+
+def read_frame(frame: bytes) -> tuple[FrameType, int, bytes]:
+    """
+    Args:
+        frame: A frame created with `create_frame()`.
+
+    Returns:
+        The type, the room index and the payload of the frame.
+
+    Raises:
+        ValueError: The frame is invalid.
+    """
+    try:
+        frame_type = FrameType(frame[0])
+        decoder = Decoder(frame[1:])
+        index = decoder.read_var_uint()
+    except (IndexError, RuntimeError, ValueError):
+        raise ValueError("Invalid frame") from None
+    return frame_type, index, frame[1 + decoder.i0 :]
+
+
+class MultiplexedChannel(AsyncChannel):
+    def __init__(
+        self,
+        id: str,
+        index: int,
+        send: Callable[[bytes], Awaitable[None]],
+        *,
+        headers: list[tuple[bytes, bytes]] | None = None,
+        max_buffer_size: int | None = None,
+        max_buffer_bytes: int | None = None,
+        overflow_policy: OverflowPolicy = "block",
+    ) -> None:
+        """
+        The channel of a room in a multiplexed connection.
+
+        Args:
+            id: The room ID.
+            index: The index of the room in the connection.
+            send: The function sending a frame over the connection.
+            headers: The HTTP headers of the connection request.
+            max_buffer_size: The maximum number of received messages buffered for
+                the room, or `None` for no limit.
+            max_buffer_bytes: The maximum number of received bytes buffered for
+                the room, or `None` for no limit.
+            overflow_policy: The overflow policy of the buffer, see `MessageBuffer`.
+        """
+        self._id = id
+        self._index = index
+        self._send = send
+        self.headers = [] if headers is None else headers
+        self._buffer = MessageBuffer(max_buffer_size, max_buffer_bytes, overflow_policy)
+
+    @property
+    def id(self) -> str:
+        return self._id
+
+    @property
+    def index(self) -> int:
+        return self._index
+
+    async def __anext__(self) -> bytes:
+        try:
+            return await self.receive()
+        except EndOfStream:
+            raise StopAsyncIteration()
+
+    async def send(self, message: bytes) -> None:
+        if self._buffer.closed:
+            raise BrokenResourceError()
+        await self._send(create_frame(FrameType.MESSAGE, self._index, message))
+
+    async def receive(self) -> bytes:
+        return await self._buffer.receive()
+
+    def receive_nowait(self) -> bytes:
+        return self._buffer.receive_nowait()
+
+    async def put(self, message: bytes) -> None:
+        """
+        Puts a message received over the connection in the channel.
+
+        Args:
+            message: The received message.
+        """
+        await self._buffer.send(message)
+
+    def close(self) -> None:
+        """
+        Closes the channel, which ends its iteration once the received messages
+        are consumed.
+        """
+        self._buffer.close()
+
+
+async def serve_multiplexed(
+    websocket: AsyncChannel,
+    serve: Callable[[AsyncChannel], Coroutine[Any, Any, None]],
+    *,
+    headers: list[tuple[bytes, bytes]] | None = None,
+    max_buffer_size: int | None = None,
+    max_buffer_bytes: int | None = None,
+    overflow_policy: OverflowPolicy = "block",
+) -> None:
+    """
+    Serves the rooms that a client subscribes to over a multiplexed connection.
+    Invalid frames are dropped.
+
+    Args:
+        websocket: The channel of the connection.
+        serve: The handler of the channel of a room.
+        headers: The HTTP headers of the connection request, which are given to
+            the channels of the rooms.
+        max_buffer_size: The maximum number of received messages buffered for
+            a room, or `None` for no limit.
+        max_buffer_bytes: The maximum number of received bytes buffered for
+            a room, or `None` for no limit.
+        overflow_policy: What to do when the buffer of a room is full: `"block"`
+            stops reading from the connection, `"drop"` closes the channel of the room,
+            and `"collapse"` merges the queued updates into a single update.
+    """
+    channels: dict[int, MultiplexedChannel] = {}
+    send_lock = Lock()
+
+    async def send(frame: bytes) -> None:
+        async with send_lock:
+            await websocket.send(frame)
+
+    async with create_task_group() as tg:
+        try:
+            async for frame in websocket:
+                try:
+                    frame_type, index, payload = read_frame(frame)
+                    if frame_type == FrameType.SUBSCRIBE:
+                        id = payload.decode()
+                except ValueError:
+                    # an invalid frame doesn't affect the other rooms
+                    continue
+                if frame_type == FrameType.SUBSCRIBE:
+                    channel = MultiplexedChannel(
+                        id,
+                        index,
+                        send,
+                        headers=headers,
+                        max_buffer_size=max_buffer_size,
+                        max_buffer_bytes=max_buffer_bytes,
+                        overflow_policy=overflow_policy,
+                    )
+                    channels[index] = channel
+                    tg.start_soon(serve, channel)
+                elif frame_type == FrameType.UNSUBSCRIBE:
+                    if index in channels:
+                        channels.pop(index).close()
+                elif index in channels:
+                    try:
+                        await channels[index].put(payload)
+                    except BrokenResourceError:
+                        # the buffer overflowed or the room stopped receiving
+                        channels.pop(index).close()
+        finally:
+            for channel in channels.values():
+                channel.close()
+
+
+class AsyncWebSocketMultiplexer:
+    def __init__(
+        self,
+        *,
+        host: str,
+        port: int,
+        cookies: Cookies | None = None,
+    ) -> None:
+        """
+        Creates a WebSocket connection which carries the messages of many rooms,
+        each room having its own client:
+        ```py
+        async with AsyncWebSocketMultiplexer(host="http://localhost", port=8000) as mux:
+            async with mux.client("room0") as client0, mux.client("room1") as client1:
+                ...
+        ```
+
+        Args:
+            host: The host of the server.
+            port: The port of the server.
+            cookies: The cookies sent when connecting.
+        """
+        self._host = host
+        self._port = port
+        self._cookies = cookies
+        self._channels: dict[int, MultiplexedChannel] = {}
+        self._index = 0
+
+    def client(
+        self,
+        id: str = "",
+        doc: Doc | None = None,
+        auto_push: bool = True,
+        auto_pull: bool = True,
+        *,
+        awareness_interval: float = 0.05,
+        push_interval: float = 0,
+        max_push_delay: float | None = None,
+        max_push_size: int | None = None,
+        max_pull_size: int | None = None,
+    ) -> AsyncMultiplexedClient:
+        """
+        Creates a client of a room over the connection, which subscribes to the room
+        when it is entered and unsubscribes from it when it is exited.
+
+        Args:
+            id: The room ID.
+            doc: An optional external shared document (or a new one will be created).
+            auto_push: See `AsyncClient`.
+            auto_pull: See `AsyncClient`.
+            awareness_interval: See `AsyncClient`.
+            push_interval: See `AsyncClient`.
+            max_push_delay: See `AsyncClient`.
+            max_push_size: See `AsyncClient`.
+            max_pull_size: See `AsyncClient`.
+
+        Returns:
+            The client.
+        """
+        return AsyncMultiplexedClient(
+            self,
+            id,
+            doc,
+            auto_push,
+            auto_pull,
+            awareness_interval=awareness_interval,
+            push_interval=push_interval,
+            max_push_delay=max_push_delay,
+            max_push_size=max_push_size,
+            max_pull_size=max_pull_size,
+        )
+
+    async def _subscribe(self, id: str) -> MultiplexedChannel:
+        index = self._index
+        self._index += 1
+        channel = MultiplexedChannel(id, index, self._websocket.send)
+        self._channels[index] = channel
+        await self._websocket.send(
+            create_frame(FrameType.SUBSCRIBE, index, f"/{id}".encode())
+        )
+        return channel
+
+    async def _unsubscribe(self, channel: MultiplexedChannel) -> None:
+        del self._channels[channel.index]
+        channel.close()
+        if not self._websocket.closed.is_set():
+            frame = create_frame(FrameType.UNSUBSCRIBE, channel.index)
+            await self._websocket.send(frame)
+
+    async def _run(
+        self, *, task_status: TaskStatus[None] = TASK_STATUS_IGNORED
+    ) -> None:
+        try:
+            ws: AsyncWebSocketSession
+            async with aconnect_ws(
+                f"{self._host}:{self._port}",
+                keepalive_ping_interval_seconds=None,
+                cookies=self._cookies,
+                subprotocols=[MULTIPLEX_SUBPROTOCOL],
+            ) as ws:
+                self._websocket = HttpxAsyncWebSocket(ws, "")
+                task_status.started()
+                async for frame in self._websocket:
+                    try:
+                        frame_type, index, payload = read_frame(frame)
+                    except ValueError:
+                        # an invalid frame doesn't affect the other rooms
+                        continue
+                    if frame_type == FrameType.MESSAGE and index in self._channels:
+                        await self._channels[index].put(payload)
+                # the connection is closed
+                for channel in self._channels.values():
+                    channel.close()
+                await sleep_forever()
+        except get_cancelled_exc_class():
+            pass
+
+    async def __aenter__(self) -> AsyncWebSocketMultiplexer:
+        async with AsyncExitStack() as exit_stack:
+            self._task_group = await exit_stack.enter_async_context(create_task_group())
+            await self._task_group.start(self._run)
+            self._exit_stack = exit_stack.pop_all()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_val: BaseException | None,
+        exc_tb: TracebackType | None,
+    ) -> bool | None:
+        self._task_group.cancel_scope.cancel()
+        return await self._exit_stack.__aexit__(exc_type, exc_val, exc_tb)
+
+
+class AsyncMultiplexedClient(AsyncClientMixin):
+    def __init__(
+        self,
+        multiplexer: AsyncWebSocketMultiplexer,
+        id: str,
+        doc: Doc | None,
+        auto_push: bool,
+        auto_pull: bool,
+        *,
+        awareness_interval: float = 0.05,
+        push_interval: float = 0,
+        max_push_delay: float | None = None,
+        max_push_size: int | None = None,
+        max_pull_size: int | None = None,
+    ) -> None:
+        self._multiplexer = multiplexer
+        self._id = id
+        self._doc = doc
+        self._auto_push = auto_push
+        self._auto_pull = auto_pull
+        self._awareness_interval = awareness_interval
+        self._push_interval = push_interval
+        self._max_push_delay = max_push_delay
+        self._max_push_size = max_push_size
+        self._max_pull_size = max_pull_size
+
+    async def __aenter__(self) -> AsyncMultiplexedClient:
+        async with AsyncExitStack() as exit_stack:
+            self._channel = await self._multiplexer._subscribe(self._id)
+            exit_stack.push_async_callback(
+                self._multiplexer._unsubscribe, self._channel
+            )
+            self._client = await exit_stack.enter_async_context(
+                AsyncClient(
+                    self._channel,
+                    self._doc,
+                    self._auto_push,
+                    self._auto_pull,
+                    awareness_interval=self._awareness_interval,
+                    push_interval=self._push_interval,
+                    max_push_delay=self._max_push_delay,
+                    max_push_size=self._max_push_size,
+                    max_pull_size=self._max_pull_size,
+                )
+            )
+            self._exit_stack = exit_stack.pop_all()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_val: BaseException | None,
+        exc_tb: TracebackType | None,
+    ) -> bool | None:
+        return await self._exit_stack.__aexit__(exc_type, exc_val, exc_tb)
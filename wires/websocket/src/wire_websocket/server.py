@@ -2,34 +2,106 @@ from __future__ import annotations
 
 from collections.abc import Callable
 from contextlib import AsyncExitStack
+from functools import partial
 from types import TracebackType
 
 from anycorn import Config, serve
 from anyio import Event, create_task_group
 
 from wiredb import AsyncChannel, AsyncServer, Room
+from wiredb.buffer import OverflowPolicy
+from wiredb.metrics import metrics
 
 from .asgi_server import ASGIServer
+from .compression import MAX_MESSAGE_SIZE
 
 
 class AsyncWebSocketServer(AsyncServer):
     def __init__(
-        self, room_factory: Callable[[str], Room] = Room, *, host: str, port: int
+        self,
+        room_factory: Callable[[str], Room] = Room,
+        *,
+        host: str,
+        port: int,
+        room_ttl: float = 0,
+        max_idle_rooms: int | None = None,
+        max_idle_size: int | None = None,
+        metrics_path: str | None = None,
+        compression_threshold: int | None = None,
+        max_message_size: int = MAX_MESSAGE_SIZE,
+        max_buffer_size: int | None = 64,
+        max_buffer_bytes: int | None = None,
+        overflow_policy: OverflowPolicy = "block",
     ) -> None:
-        super().__init__(room_factory=room_factory)
+        """
+        Creates a WebSocket server, where the path of a WebSocket is the ID of its room.
+
+        Args:
+            room_factory: An optional callable used to create a room.
+            host: The host the server is bound to.
+            port: The port the server is bound to.
+            room_ttl: The time (in seconds) during which a room without clients is kept alive.
+            max_idle_rooms: The maximum number of rooms without clients kept alive.
+            max_idle_size: The maximum estimated size (in bytes) of the shared documents
+                of the rooms without clients kept alive.
+            metrics_path: The HTTP path where the metrics are served in the Prometheus
+                text exposition format, or `None` to not serve them. Metrics are
+                recorded while they are served.
+            compression_threshold: If not `None`, the clients can request the compression
+                of messages, in which case the messages of at least this size (in bytes)
+                are compressed with zlib.
+            max_message_size: The maximum size (in bytes) of a decompressed message
+                received from a client, above which the client is disconnected.
+            max_buffer_size: The maximum number of received messages buffered for
+                a room of a multiplexed connection, or `None` for no limit.
+            max_buffer_bytes: The maximum number of received bytes buffered for
+                a room of a multiplexed connection, or `None` for no limit.
+            overflow_policy: What to do when the buffer of a room of a multiplexed
+                connection is full: `"block"` stops reading from the connection,
+                `"drop"` disconnects the room, and `"collapse"` merges the queued
+                updates into a single update.
+        """
+        super().__init__(
+            room_factory=room_factory,
+            room_ttl=room_ttl,
+            max_idle_rooms=max_idle_rooms,
+            max_idle_size=max_idle_size,
+        )
         self._host = host
         self._port = port
-        self._app = ASGIServer(self._serve)
+        self._app = ASGIServer(
+            self._serve,
+            metrics_path=metrics_path,
+            compression_threshold=compression_threshold,
+            max_message_size=max_message_size,
+            max_buffer_size=max_buffer_size,
+            max_buffer_bytes=max_buffer_bytes,
+            overflow_policy=overflow_policy,
+        )
+        self._metrics_path = metrics_path
         self._config = Config()
         self._config.bind = [f"{host}:{port}"]
         self._shutdown_event = Event()
 
+    @property
+    def port(self) -> int:
+        """
+        Returns:
+            The port the server is bound to, which is useful if it was created with `port=0`.
+        """
+        return int(self._urls[0].rsplit(":", 1)[1])
+
     async def __aenter__(self) -> "AsyncWebSocketServer":
         async with AsyncExitStack() as exit_stack:
+            if self._metrics_path is not None:
+                # metrics are enabled until the server exits
+                exit_stack.callback(setattr, metrics, "enabled", metrics.enabled)
+                metrics.enabled = True
             self._task_group = await exit_stack.enter_async_context(create_task_group())
             await exit_stack.enter_async_context(self.room_manager)
-            self._task_group.start_soon(
-                lambda: serve(
+            self._urls = await self._task_group.start(
+                partial(
+                    serve,
                     self._app,  # type: ignore[arg-type]
                     self._config,
                     shutdown_trigger=self._shutdown_event.wait,
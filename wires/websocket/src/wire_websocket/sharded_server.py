@@ -0,0 +1,361 @@
+from __future__ import annotations
+
+from bisect import bisect
+from collections.abc import Callable
+from contextlib import AsyncExitStack
+from functools import partial
+from hashlib import blake2b
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from types import TracebackType
+
+from anycorn import Config, serve
+from anyio import (
+    CancelScope,
+    Event,
+    create_task_group,
+    run,
+    to_thread,
+)
+from httpx_ws import AsyncWebSocketSession, aconnect_ws
+
+from wiredb import AsyncChannel, Room
+
+from .asgi_server import ASGIServer
+from .client import HttpxAsyncWebSocket
+from .compression import MAX_MESSAGE_SIZE
+from .server import AsyncWebSocketServer
+
+
+class HashRing:
+    def __init__(self, replica_nb: int = 64) -> None:
+        """
+        Creates a consistent hashing ring, which maps keys to nodes so that adding
+        or removing a node only moves the keys of that node.
+
+        Args:
+            replica_nb: The number of points of each node on the ring.
+        """
+        self._replica_nb = replica_nb
+        self._hashes: list[int] = []
+        self._nodes: list[str] = []
+
+    @property
+    def nodes(self) -> set[str]:
+        """
+        Returns:
+            The nodes on the ring.
+        """
+        return set(self._nodes)
+
+    def add(self, node: str) -> None:
+        """
+        Adds a node to the ring.
+
+        Args:
+            node: The node to add.
+        """
+        for i in range(self._replica_nb):
+            hash = _hash(f"{node}:{i}")
+            index = bisect(self._hashes, hash)
+            self._hashes.insert(index, hash)
+            self._nodes.insert(index, node)
+
+    def remove(self, node: str) -> None:
+        """
+        Removes a node from the ring.
+
+        Args:
+            node: The node to remove.
+        """
+        points = [
+            (hash, _node)
+            for hash, _node in zip(self._hashes, self._nodes)
+            if _node != node
+        ]
+        self._hashes = [hash for hash, _ in points]
+        self._nodes = [_node for _, _node in points]
+
+    def get(self, key: str) -> str:
+        """
+        Args:
+            key: The key to map to a node.
+
+        Returns:
+            The node the key is mapped to.
+
+        Raises:
+            LookupError: The ring has no node.
+        """
+        if not self._hashes:
+            raise LookupError("The ring has no node")
+        index = bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class Worker:
+    def __init__(self, id: str, room_factory: Callable[[str], Room], host: str) -> None:
+        """
+        A process running an `AsyncWebSocketServer` which serves a shard of the rooms.
+
+        Args:
+            id: The worker ID.
+            room_factory: The callable used to create a room in the worker process.
+            host: The host the worker server is bound to.
+        """
+        self.id = id
+        self.host = host
+        # worker processes are spawned since forking a running event loop is not supported
+        context = get_context("spawn")
+        connection, worker_connection = context.Pipe()
+        self._connection = connection
+        self._process = context.Process(
+            target=_run_worker,
+            args=(room_factory, host, worker_connection),
+            daemon=True,
+        )
+
+    async def start(self) -> None:
+        """
+        Starts the worker process, and waits until its server is started.
+
+        Raises:
+            RuntimeError: The worker process exited before its server was started.
+        """
+        self._process.start()
+        try:
+            self.port = await to_thread.run_sync(self._connection.recv)
+        except EOFError:
+            await to_thread.run_sync(self._process.join)
+            raise RuntimeError(
+                f"Worker {self.id} exited with code {self._process.exitcode} "
+                "before starting"
+            ) from None
+
+    async def stop(self, timeout: float = 10) -> None:
+        """
+        Stops the worker server, so that its rooms are closed gracefully,
+        and terminates the worker process if it didn't exit after a timeout.
+
+        Args:
+            timeout: The time (in seconds) to wait for the worker process to exit.
+        """
+        try:
+            self._connection.send(None)
+        except OSError:  # pragma: nocover
+            # the worker process already exited
+            pass
+        await to_thread.run_sync(self._process.join, timeout)
+        if self._process.is_alive():  # pragma: nocover
+            self._process.terminate()
+            await to_thread.run_sync(self._process.join)
+        self._connection.close()
+
+
+def _run_worker(
+    room_factory: Callable[[str], Room], host: str, connection: Connection
+) -> None:  # pragma: nocover
+    async def main() -> None:
+        async with AsyncWebSocketServer(room_factory, host=host, port=0) as server:
+            connection.send(server.port)
+            # the server exits when the worker is stopped, or when the parent process
+            # closes the connection
+            try:
+                await to_thread.run_sync(connection.recv, abandon_on_cancel=True)
+            except EOFError:
+                pass
+
+    run(main)
+
+
+class AsyncShardedWebSocketServer:
+    def __init__(
+        self,
+        room_factory: Callable[[str], Room] = Room,
+        *,
+        host: str,
+        port: int,
+        worker_nb: int,
+        worker_host: str = "127.0.0.1",
+        compression_threshold: int | None = None,
+        max_message_size: int = MAX_MESSAGE_SIZE,
+    ) -> None:
+        """
+        Creates a WebSocket server which runs its rooms in several worker processes,
+        so that more than one CPU core can be used. Each room is assigned to a worker
+        by consistent hashing of its ID, and the client connections are proxied to
+        the worker of their room. The cookies of the clients are forwarded to the workers,
+        while the multiplexing and compression subprotocols are handled by the server,
+        which connects to the workers without them.
+
+        Workers can be added or removed while the server is running, in which case
+        the rooms that are assigned to another worker are moved: their clients are
+        disconnected, and the rooms are recreated in the new worker when the clients
+        reconnect.
+
+        Args:
+            room_factory: An optional callable used to create a room in a worker process.
+                It must be picklable.
+            host: The host the server is bound to.
+            port: The port the server is bound to.
+            worker_nb: The number of worker processes to start.
+            worker_host: The host the worker servers are bound to.
+            compression_threshold: If not `None`, the clients can request the compression
+                of messages, in which case the messages of at least this size (in bytes)
+                are compressed with zlib.
+            max_message_size: The maximum size (in bytes) of a decompressed message
+                received from a client, above which the client is disconnected.
+
+        Raises:
+            ValueError: `worker_nb` is smaller than 1.
+        """
+        if worker_nb < 1:
+            raise ValueError(f"worker_nb must be at least 1 (got {worker_nb})")
+        self._room_factory = room_factory
+        self._worker_nb = worker_nb
+        self._worker_host = worker_host
+        self._workers: dict[str, Worker] = {}
+        self._worker_id = 0
+        self._ring = HashRing()
+        # the connections of each room, and the worker they are proxied to
+        self._connections: dict[str, dict[CancelScope, str]] = {}
+        self._app = ASGIServer(
+            self._serve,
+            compression_threshold=compression_threshold,
+            max_message_size=max_message_size,
+        )
+        self._config = Config()
+        self._config.bind = [f"{host}:{port}"]
+        self._shutdown_event = Event()
+
+    @property
+    def workers(self) -> dict[str, Worker]:
+        """
+        Returns:
+            The workers, by ID.
+        """
+        return self._workers
+
+    def get_worker(self, id: str) -> Worker:
+        """
+        Args:
+            id: The room ID.
+
+        Returns:
+            The worker the room is assigned to.
+        """
+        return self._workers[self._ring.get(id)]
+
+    async def add_worker(self) -> Worker:
+        """
+        Starts a new worker process and moves the rooms that are now assigned to it.
+
+        Returns:
+            The new worker.
+        """
+        worker = Worker(
+            f"worker{self._worker_id}", self._room_factory, self._worker_host
+        )
+        self._worker_id += 1
+        await worker.start()
+        self._workers[worker.id] = worker
+        self._ring.add(worker.id)
+        self._move_rooms()
+        return worker
+
+    async def remove_worker(self, worker: Worker) -> None:
+        """
+        Moves the rooms of a worker to the other workers and stops its process.
+
+        Args:
+            worker: The worker to remove.
+
+        Raises:
+            RuntimeError: The worker is the last one, which would leave the rooms
+                without a worker.
+        """
+        if len(self._workers) == 1:
+            raise RuntimeError("Cannot remove the last worker")
+        self._ring.remove(worker.id)
+        del self._workers[worker.id]
+        self._move_rooms()
+        await worker.stop()
+
+    def _move_rooms(self) -> None:
+        for id, connections in self._connections.items():
+            worker_id = self._ring.get(id)
+            for scope, _worker_id in connections.items():
+                if _worker_id != worker_id:
+                    scope.cancel()
+
+    async def __aenter__(self) -> AsyncShardedWebSocketServer:
+        async with AsyncExitStack() as exit_stack:
+            exit_stack.push_async_callback(self._stop_workers)
+            for i in range(self._worker_nb):
+                await self.add_worker()
+            self._task_group = await exit_stack.enter_async_context(create_task_group())
+            await self._task_group.start(
+                partial(
+                    serve,
+                    self._app,  # type: ignore[arg-type]
+                    self._config,
+                    shutdown_trigger=self._shutdown_event.wait,
+                    mode="asgi",
+                )
+            )
+            self._exit_stack = exit_stack.pop_all()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_val: BaseException | None,
+        exc_tb: TracebackType | None,
+    ) -> bool | None:
+        self._shutdown_event.set()
+        return await self._exit_stack.__aexit__(exc_type, exc_val, exc_tb)
+
+    async def _stop_workers(self) -> None:
+        for worker in list(self._workers.values()):
+            await worker.stop()
+
+    async def _serve(self, websocket: AsyncChannel) -> None:
+        id = websocket.id
+        worker = self.get_worker(id)
+        # the cookies are forwarded, for instance to authenticate the client
+        cookies = [
+            value.decode("latin-1")
+            for name, value in getattr(websocket, "headers", [])
+            if name == b"cookie"
+        ]
+        ws: AsyncWebSocketSession
+        async with aconnect_ws(
+            f"http://{worker.host}:{worker.port}{id}",
+            keepalive_ping_interval_seconds=None,
+            headers={"cookie": "; ".join(cookies)} if cookies else {},
+        ) as ws:
+            worker_websocket = HttpxAsyncWebSocket(ws, id)
+            async with create_task_group() as tg:
+                connections = self._connections.setdefault(id, {})
+                connections[tg.cancel_scope] = worker.id
+                try:
+                    tg.start_soon(
+                        _forward, websocket, worker_websocket, tg.cancel_scope
+                    )
+                    await _forward(worker_websocket, websocket, tg.cancel_scope)
+                finally:
+                    del connections[tg.cancel_scope]
+                    if not connections:
+                        del self._connections[id]
+
+
+async def _forward(
+    source: AsyncChannel, destination: AsyncChannel, scope: CancelScope
+) -> None:
+    async for message in source:
+        await destination.send(message)
+    scope.cancel()